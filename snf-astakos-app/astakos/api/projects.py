@@ -14,16 +14,17 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 import re
+from itertools import chain
 from django.utils import simplejson as json
 from django.views.decorators.csrf import csrf_exempt
 from django.http import HttpResponse
 from django.db.models import Q
 from django.db import transaction
 
-from astakos.api.util import json_response
+from astakos.api.util import json_response, json_stream_response
 
 from snf_django.lib import api
-from snf_django.lib.api import faults
+from snf_django.lib.api import faults, streaming
 from snf_django.lib.api import utils
 from .util import user_from_token, invert_dict, check_is_dict
 
@@ -270,8 +271,15 @@ def get_projects(request):
     mode = request.GET.get("mode", "default")
     query = make_project_query(filters)
     projects = _get_projects(query, mode=mode, request_user=user)
-    data = get_projects_details(projects, request_user=user)
-    return json_response(data)
+    chunks = streaming.queryset_chunks(projects.order_by("id"))
+    # Serialize the first chunk before returning, so that errors are still
+    # reported with a proper status. The rest are fetched while streaming,
+    # after the transaction has been committed.
+    first = get_projects_details(next(chunks, []), request_user=user)
+    data = chain(first, (project for chunk in chunks
+                         for project in get_projects_details(
+                             chunk, request_user=user)))
+    return json_stream_response(data)
 
 
 def _get_projects(query, mode="default", request_user=None):
@@ -22,7 +22,7 @@ from django.utils import simplejson as json
 from django.template.loader import render_to_string
 
 from astakos.im.models import AstakosUser, Component
-from snf_django.lib.api import faults
+from snf_django.lib.api import faults, streaming
 from snf_django.lib.api.utils import isoformat
 
 from astakos.im.forms import FeedbackForm
@@ -52,6 +52,13 @@ def json_response(content, status_code=None):
     return response
 
 
+def json_stream_response(items, status_code=200):
+    data = streaming.json_list(items, default=_dthandler)
+    response = streaming.StreamingResponse(data, status=status_code)
+    response['Content-Type'] = 'application/json; charset=UTF-8'
+    return response
+
+
 def xml_response(content, template, status_code=None):
     response = HttpResponse()
     if status_code is not None:
@@ -0,0 +1,190 @@
+# Copyright (C) 2010-2014 GRNET S.A.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""In-process caching helpers shared by Synnefo components."""
+
+from time import time
+from threading import Lock
+
+from synnefo.lib.ordereddict import OrderedDict
+
+
+class LRUCache(object):
+    """Thread-safe, size-bounded LRU cache with optional expiration.
+
+    Every entry may carry its own timeout, in seconds. Expired entries are
+    dropped lazily, when they are looked up or when they reach the tail of
+    the LRU list.
+
+    By default maxsize counts entries. If a `weigh` function is given,
+    maxsize bounds the total weight of the cached values instead, e.g. their
+    size in bytes.
+
+    >>> c = LRUCache(maxsize=2)
+    >>> c.set("a", 1)
+    >>> c.set("b", 2)
+    >>> c.get("a")
+    1
+    >>> c.set("c", 3)
+    >>> c.get("b") is None
+    True
+    >>> c.stats()["evictions"]
+    1
+    >>> c = LRUCache(maxsize=4, weigh=len)
+    >>> c.set("a", "xyz")
+    >>> c.set("b", "xy")
+    >>> "a" in c
+    False
+    """
+
+    def __init__(self, maxsize=1000, timeout=None, weigh=None):
+        assert(maxsize > 0), "maxsize must be positive"
+        self.maxsize = maxsize
+        self.timeout = timeout
+        self.weigh = weigh or (lambda value: 1)
+        self.currsize = 0
+        self._data = OrderedDict()
+        self._lock = Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        with self._lock:
+            return self._lookup(key) is not None
+
+    def _lookup(self, key):
+        entry = self._data.get(key)
+        if entry is None:
+            return None
+        value, expires, weight = entry
+        if expires is not None and expires <= time():
+            del self._data[key]
+            self.currsize -= weight
+            return None
+        return entry
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._lookup(key)
+            if entry is None:
+                self.misses += 1
+                return default
+            # Move the entry to the head of the LRU list
+            del self._data[key]
+            self._data[key] = entry
+            self.hits += 1
+            return entry[0]
+
+    def set(self, key, value, timeout=None):
+        if timeout is None:
+            timeout = self.timeout
+        expires = time() + timeout if timeout is not None else None
+        weight = self.weigh(value)
+        with self._lock:
+            self._pop(key)
+            if weight > self.maxsize:
+                return
+            self._data[key] = (value, expires, weight)
+            self.currsize += weight
+            while self.currsize > self.maxsize:
+                self.currsize -= self._data.popitem(last=False)[1][2]
+                self.evictions += 1
+
+    def _pop(self, key):
+        entry = self._data.pop(key, None)
+        if entry is not None:
+            self.currsize -= entry[2]
+        return entry
+
+    def delete(self, key):
+        with self._lock:
+            return self._pop(key) is not None
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.currsize = 0
+
+    def stats(self):
+        """Return a dictionary with the cache counters."""
+        return {"size": len(self._data),
+                "currsize": self.currsize,
+                "maxsize": self.maxsize,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions}
+
+
+class RecentSet(object):
+    """Bounded set that remembers the most recently added items.
+
+    Items are kept in two generations of at most `size` items each. When
+    the current generation fills up it replaces the previous one, which is
+    dropped. This is much more compact than an LRU, at the cost of
+    forgetting items somewhat earlier than one would.
+
+    >>> s = RecentSet(size=2)
+    >>> s.update(["a", "b", "c"])
+    >>> "a" in s, "c" in s
+    (True, True)
+    >>> s.update(["d", "e"])
+    >>> "a" in s
+    False
+    """
+
+    def __init__(self, size=65536):
+        assert(size > 0), "size must be positive"
+        self.size = size
+        self._current = set()
+        self._previous = set()
+        self._lock = Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._current | self._previous)
+
+    def __contains__(self, item):
+        if item in self._current or item in self._previous:
+            self.hits += 1
+            return True
+        self.misses += 1
+        return False
+
+    def add(self, item):
+        with self._lock:
+            if len(self._current) >= self.size:
+                self._previous = self._current
+                self._current = set()
+            self._current.add(item)
+
+    def update(self, items):
+        for item in items:
+            self.add(item)
+
+    def clear(self):
+        with self._lock:
+            self._current = set()
+            self._previous = set()
+
+    def stats(self):
+        """Return a dictionary with the set counters."""
+        return {"size": len(self),
+                "hits": self.hits,
+                "misses": self.misses}
@@ -122,6 +122,7 @@ def list_floating_ips(request):
                                             floating_ip=True).order_by("id")\
                                     .select_related("nic")
     floating_ips = utils.filter_modified_since(request, objects=floating_ips)
+    floating_ips = utils.paginate(request, floating_ips)
 
     floating_ips = map(ip_to_dict, floating_ips)
 
@@ -92,6 +92,7 @@ def list_networks(request, detail=True):
 
     user_networks = api.utils.filter_modified_since(request,
                                                     objects=user_networks)
+    user_networks = api.utils.paginate(request, user_networks)
 
     network_dicts = [network_to_dict(network, detail)
                      for network in user_networks]
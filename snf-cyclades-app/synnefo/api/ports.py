@@ -70,8 +70,9 @@ def list_ports(request, detail=True):
     if detail:
         user_ports = user_ports.prefetch_related("ips")
 
-    port_dicts = [port_to_dict(port, detail)
-                  for port in user_ports.order_by('id')]
+    user_ports = api.utils.paginate(request, user_ports.order_by('id'))
+
+    port_dicts = [port_to_dict(port, detail) for port in user_ports]
 
     if request.serialization == 'xml':
         data = render_to_string('list_ports.xml', {
@@ -20,9 +20,10 @@ from django.db import transaction
 from django.http import HttpResponse
 from django.template.loader import render_to_string
 from django.utils import simplejson as json
+from django.utils.html import escape
 
 from snf_django.lib import api
-from snf_django.lib.api import faults, utils
+from snf_django.lib.api import faults, utils, streaming
 
 from synnefo.api import util
 from synnefo.db.models import (VirtualMachine, VirtualMachineMetadata)
@@ -358,18 +359,37 @@ def list_servers(request, detail=False):
         user_vms = user_vms.prefetch_related("nics__ips", "metadata")
 
     user_vms = utils.filter_modified_since(request, objects=user_vms)
+    user_vms = utils.paginate(request, user_vms.order_by('id'),
+                              apply_limit=False)
+    limit = utils.get_limit(request)
 
-    servers_dict = [vm_to_dict(server, detail)
-                    for server in user_vms.order_by('id')]
+    servers_dict = (vm_to_dict(server, detail)
+                    for server in streaming.iterate_queryset(user_vms,
+                                                             limit=limit))
 
     if request.serialization == 'xml':
-        data = render_to_string('list_servers.xml', {
-            'servers': servers_dict,
-            'detail': detail})
+        render = render_server_xml if detail else render_server_ref_xml
+        data = streaming.xml_list(servers_dict, render, SERVERS_XML_HEADER,
+                                  '</servers>')
     else:
-        data = json.dumps({'servers': servers_dict})
+        data = streaming.json_list(servers_dict, key='servers')
 
-    return HttpResponse(data, status=200)
+    return streaming.StreamingResponse(data, status=200)
+
+
+SERVERS_XML_HEADER = (
+    '<?xml version="1.0" encoding="UTF-8"?>'
+    '<servers xmlns="http://docs.openstack.org/compute/api/v1.1"'
+    ' xmlns:atom="http://www.w3.org/2005/Atom">')
+
+
+def render_server_xml(server):
+    return render_to_string('server.xml', {'server': server})
+
+
+def render_server_ref_xml(server):
+    return '<server id="%s" name="%s"></server>' % (server['id'],
+                                                    escape(server['name']))
 
 
 @api.api_method(http_method='POST', user_required=True, logger=log)
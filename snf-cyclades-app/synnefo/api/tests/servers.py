@@ -83,6 +83,25 @@ class ServerAPITest(ComputeAPITest):
         self.assertEqual(server["name"], u"Hi \u2601")
         self.assertEqual(server["id"], db_server.id)
 
+    def test_server_list_pagination(self):
+        """Test if the servers list is paginated with marker and limit."""
+        vm5 = mfactory.VirtualMachineFactory(userid=self.user2)
+        ids = lambda r: [s["id"] for s in json.loads(r.content)["servers"]]
+
+        response = self.myget('servers?limit=2', self.user2)
+        self.assertSuccess(response)
+        self.assertEqual(ids(response), [self.vm2.id, self.vm4.id])
+
+        response = self.myget('servers?limit=2&marker=%s' % self.vm4.id,
+                              self.user2)
+        self.assertSuccess(response)
+        self.assertEqual(ids(response), [vm5.id])
+
+        response = self.myget('servers?marker=foo', self.user2)
+        self.assertBadRequest(response)
+        response = self.myget('servers?limit=-1', self.user2)
+        self.assertBadRequest(response)
+
     def test_server_list_detail(self):
         """Test if the servers list details are returned."""
         user = self.user2
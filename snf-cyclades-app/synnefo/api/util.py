@@ -33,7 +33,8 @@ from synnefo.db.models import (Flavor, VirtualMachine, VirtualMachineMetadata,
                                Network, NetworkInterface, SecurityGroup,
                                BridgePoolTable, MacPrefixPoolTable, IPAddress,
                                IPPoolTable)
-from synnefo.plankton.backend import PlanktonBackend
+from synnefo.plankton.backend import (PlanktonBackend, get_cached_image,
+                                      cache_image)
 
 from synnefo.cyclades_settings import cyclades_services, BASE_HOST
 from synnefo.lib.services import get_service_path
@@ -154,7 +155,11 @@ def get_image(image_id, user_id):
 
 def get_image_dict(image_id, user_id):
     image = {}
-    img = get_image(image_id, user_id)
+    # The cached images are shared, so they must not be modified
+    img = get_cached_image(image_id, user_id)
+    if img is None:
+        img = get_image(image_id, user_id)
+        cache_image(img)
     image["id"] = img["id"]
     image["name"] = img["name"]
     image["format"] = img["disk_format"]
@@ -8,6 +8,21 @@ BACKEND_DB_CONNECTION = 'sqlite:////usr/share/synnefo/pithos/backend.db'
 BACKEND_BLOCK_PATH = '/usr/share/synnefo/pithos/data/'
 PITHOS_BACKEND_POOL_SIZE = 8
 
+# Seconds for which each process caches the image listings of the users and
+# the public images. Image changes made through the same process drop the
+# cached listings, but changes made through Pithos become visible only when
+# they expire. Set to 0 to disable the cache.
+PLANKTON_IMAGE_INDEX_TIMEOUT = 0
+# Maximum number of image listings cached by each process
+PLANKTON_IMAGE_INDEX_SIZE = 1000
+
+# Seconds for which each process caches the images used to create servers.
+# The cached images are shared between the users that are allowed to read
+# them, and expire like the image listings. Set to 0 to disable the cache.
+PLANKTON_IMAGE_CACHE_TIMEOUT = 0
+# Maximum number of images cached by each process
+PLANKTON_IMAGE_CACHE_SIZE = 1000
+
 # The Pithos container where images will be stored by default
 DEFAULT_PLANKTON_CONTAINER = 'images'
 
@@ -5,3 +5,12 @@
 
 # Minutes between reconciliations
 RECONCILIATION_MIN = 30
+
+# Directory where server reconciliation keeps the status of finalized Ganeti
+# jobs, one file per backend, so that they are not requested again on every
+# run. The directory must be writable by snf-manage. Set to None to disable
+# the cache.
+RECONCILIATION_JOB_CACHE_DIR = None
+
+# Maximum number of jobs kept in the cache of each backend
+RECONCILIATION_JOB_CACHE_SIZE = 10000
@@ -82,6 +82,8 @@ class Backend(models.Model):
     disk_templates = fields.SeparatedValuesField("Disk Templates", null=True)
     # Last refresh of backend resources
     updated = models.DateTimeField(auto_now_add=True)
+    # Start of the last server reconciliation
+    reconciled = models.DateTimeField(null=True)
     # Backend resources
     mfree = models.PositiveIntegerField('Free Memory', default=0, null=False)
     mtotal = models.PositiveIntegerField('Total Memory', default=0, null=False)
@@ -19,6 +19,7 @@
 import logging
 import json
 from functools import wraps
+from time import time
 
 from django.db import transaction
 from synnefo.db.models import (Backend, VirtualMachine, Network,
@@ -26,6 +27,7 @@ from synnefo.db.models import (Backend, VirtualMachine, Network,
 from synnefo.logic import utils, backend as backend_mod, rapi
 
 from synnefo.lib.utils import merge_time
+from synnefo.lib.ordereddict import OrderedDict
 
 log = logging.getLogger(__name__)
 
@@ -305,6 +307,71 @@ def update_build_progress(vm, msg, event_time):
               msg['instance'])
 
 
+class ProgressCoalescer(object):
+    """Coalesce image copy progress messages of the same instance.
+
+    Only the latest copy progress of an instance matters. Instead of handling
+    every 'image-copy-progress' message, the coalescer holds it for up to
+    'timeout' seconds. If a newer one arrives for the same instance in the
+    meantime, the held message is acknowledged without touching the DB. Any
+    other message of the instance is handled right after its held one, so
+    that the order of messages is preserved.
+
+    The dispatcher must call 'flush' when the earliest held message expires,
+    as reported by 'next_timeout'.
+
+    """
+    def __init__(self, callback, timeout=1):
+        self.callback = callback
+        self.timeout = timeout
+        self.pending = OrderedDict()
+
+    def __call__(self, client, message):
+        try:
+            msg = json.loads(message['body'])
+            instance = msg['instance']
+            coalesce = msg.get('type') == 'image-copy-progress'
+        except (ValueError, KeyError, TypeError):
+            # Let the callback handle invalid messages
+            self.callback(client, message)
+            return
+
+        held = self.pending.get(instance)
+        if held is not None:
+            held_client, held_message, expires = held
+            if coalesce:
+                log.debug("Ignoring superseded progress message: %s",
+                          held_message)
+                held_client.basic_ack(held_message)
+                # Keep the expiration time of the first held message
+                self.pending[instance] = (client, message, expires)
+                return
+            del self.pending[instance]
+            self.callback(held_client, held_message)
+
+        if coalesce:
+            self.pending[instance] = (client, message, time() + self.timeout)
+        else:
+            self.callback(client, message)
+
+    def next_timeout(self):
+        """Return the seconds until the earliest held message expires."""
+        if not self.pending:
+            return None
+        _, _, expires = self.pending.itervalues().next()
+        return max(expires - time(), 0)
+
+    def flush(self, force=False):
+        """Handle the held messages that have expired, or all of them."""
+        now = time()
+        for instance, (client, message, expires) in self.pending.items():
+            if not force and expires > now:
+                # Messages are held in order of expiration
+                break
+            del self.pending[instance]
+            self.callback(client, message)
+
+
 @handle_message_delivery
 @transaction.commit_on_success()
 def update_cluster(msg):
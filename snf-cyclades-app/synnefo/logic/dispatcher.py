@@ -32,13 +32,15 @@ sys.path.append(path)
 os.environ['DJANGO_SETTINGS_MODULE'] = 'synnefo.settings'
 from django.conf import settings
 
-from django.db import close_connection
+from django.db import close_connection, connection, transaction
 
 import time
 
 import json
 import socket
 import traceback
+import zlib
+from multiprocessing import Process
 import daemon
 import daemon.runner
 from lockfile import LockTimeout
@@ -77,6 +79,17 @@ CHECK_TOOL_ACK_TIMEOUT = 10
 # Time out after S seconds while waiting for the status report from
 # snf-dispatcher to arrive.
 CHECK_TOOL_REPORT_TIMEOUT = 30
+# Log message counters and event lag every S seconds.
+STATS_INTERVAL = 60
+# Hold image copy progress messages for S seconds, so that only the latest
+# progress of each instance within this window updates the DB.
+PROGRESS_COALESCE_TIMEOUT = 1
+# Number of unacknowledged progress messages, i.e. of instances whose
+# progress can be coalesced at the same time.
+PROGRESS_PREFETCH_COUNT = 100
+# Check that a kept DB connection is still usable, if it has been idle for
+# more than S seconds.
+DB_CHECK_INTERVAL = 30
 
 
 def get_hostname():
@@ -84,25 +97,51 @@ def get_hostname():
 
 
 class Dispatcher:
+    """Consume and handle messages from the Ganeti clusters.
+
+    By default, the dispatcher handles all messages itself. With 'workers'
+    set, it starts as many worker processes and only routes each message to
+    the queue of a worker. The worker is chosen by hashing the instance or
+    network name of the message, so that all messages about a VM or a
+    network are handled by the same worker, in the order they arrived.
+
+    """
     debug = False
 
-    def __init__(self, debug=False):
+    def __init__(self, debug=False, workers=0, worker=None, keep_db=False):
         self.debug = debug
+        self.workers = workers
+        self.worker = worker
+        self.keep_db = keep_db
+        self.processes = {}
+        self.stats = DispatcherStats(worker)
+        self.db = DBSession(persistent=keep_db)
+        self.coalescer = None
         self._init()
 
     def wait(self):
         log.info("Waiting for messages..")
         timeout = 600
+        for worker in range(self.workers):
+            self.start_worker(worker)
         while True:
             try:
-                # Close the Django DB connection before processing
-                # every incoming message. This plays nicely with
-                # DB connection pooling, if enabled and allows
-                # the dispatcher to recover from broken connections
+                self.check_workers()
+                # Unless the DB connection is kept, close the Django DB
+                # connection before processing every incoming message. This
+                # plays nicely with DB connection pooling, if enabled and
+                # allows the dispatcher to recover from broken connections
                 # gracefully.
-                close_connection()
-                msg = self.client.basic_wait(timeout=timeout)
-                if not msg:
+                self.db.prepare()
+                wait_timeout = timeout
+                if self.coalescer is not None:
+                    progress_timeout = self.coalescer.next_timeout()
+                    if progress_timeout is not None:
+                        wait_timeout = max(progress_timeout, 0.01)
+                msg = self.client.basic_wait(timeout=wait_timeout)
+                if self.coalescer is not None:
+                    self.coalescer.flush()
+                if not msg and wait_timeout == timeout:
                     log.warning("Idle connection for %d seconds. Will connect"
                                 " to a different host. Verify that"
                                 " snf-ganeti-eventd is running!!", timeout)
@@ -119,6 +158,31 @@ class Dispatcher:
 
         self.client.basic_cancel()
         self.client.close()
+        self.stop_workers()
+
+    def start_worker(self, worker):
+        process = Process(target=worker_mode,
+                          args=(worker, self.debug, self.keep_db))
+        process.daemon = True
+        process.start()
+        self.processes[worker] = process
+        log.info("Started worker %d (PID: %s)", worker, process.pid)
+
+    def check_workers(self):
+        """Restart any worker that has exited."""
+        for worker, process in self.processes.items():
+            if not process.is_alive():
+                log.error("Worker %d (PID: %s) exited with code %s."
+                          " Restarting it", worker, process.pid,
+                          process.exitcode)
+                self.start_worker(worker)
+
+    def stop_workers(self):
+        for process in self.processes.values():
+            process.terminate()
+        for process in self.processes.values():
+            process.join()
+        self.processes = {}
 
     def _init(self):
         log.info("Initializing")
@@ -153,16 +217,49 @@ class Dispatcher:
             queue = binding[0]
             exchange = binding[1]
             routing_key = binding[2]
+            queue_dl = queues.convert_queue_to_dead(queue)
+            exchange_dl = queues.convert_exchange_to_dead(exchange)
+
+            prefetch_count = 5
+            if not self.workers:
+                callback = self.stats.track(self.db.track(callback))
+                if binding[3] == "update_build_progress":
+                    self.coalescer = callbacks.ProgressCoalescer(
+                        callback, timeout=PROGRESS_COALESCE_TIMEOUT)
+                    callback = self.coalescer
+                    prefetch_count = PROGRESS_PREFETCH_COUNT
+
+            if self.worker is not None:
+                # Workers only consume their own queues, which are declared
+                # by the dispatcher that routes messages to them
+                queue = queues.get_worker_queue(queue, self.worker)
+                self.client.basic_consume(queue=queue,
+                                          callback=callback,
+                                          prefetch_count=prefetch_count)
+                log.debug("Consuming queue %s with handler %s", queue,
+                          binding[3])
+                continue
 
             self.client.queue_bind(queue=queue, exchange=exchange,
                                    routing_key=routing_key)
 
-            self.client.basic_consume(queue=binding[0],
+            if self.workers:
+                for worker in range(self.workers):
+                    worker_queue = queues.get_worker_queue(queue, worker)
+                    self.client.queue_declare(queue=worker_queue,
+                                              mirrored=True,
+                                              dead_letter_exchange=exchange_dl)
+                    # Messages rejected by workers keep the name of the
+                    # worker queue as routing key
+                    self.client.queue_bind(queue=queue_dl,
+                                           exchange=exchange_dl,
+                                           routing_key=worker_queue)
+                callback = route_message(queue, self.workers)
+
+            self.client.basic_consume(queue=queue,
                                       callback=callback,
-                                      prefetch_count=5)
+                                      prefetch_count=prefetch_count)
 
-            queue_dl = queues.convert_queue_to_dead(queue)
-            exchange_dl = queues.convert_exchange_to_dead(exchange)
             # Bind the corresponding dead-letter queue
             self.client.queue_bind(queue=queue_dl,
                                    exchange=exchange_dl,
@@ -171,16 +268,165 @@ class Dispatcher:
             log.debug("Binding %s(%s) to queue %s with handler %s",
                       exchange, routing_key, queue, binding[3])
 
+        if self.worker is not None:
+            return
+
         # Declare the queue that will be used for receiving requests, e.g. a
         # status check request
         hostname, pid = get_hostname(), os.getpid()
         queue = queues.get_dispatcher_request_queue(hostname, pid)
         self.client.queue_declare(queue=queue, mirrored=True, ttl=60)
-        self.client.basic_consume(queue=queue, callback=handle_request)
+        self.client.basic_consume(queue=queue,
+                                  callback=self.db.track(handle_request))
         log.debug("Binding %s(%s) to queue %s with handler 'hadle_request'",
                   exchange, routing_key, queue)
 
 
+class DBSession(object):
+    """Manage the Django DB connection of a dispatcher process.
+
+    By default, the connection is closed before waiting for each message, so
+    that every message is handled with a new connection. A persistent session
+    keeps the connection open instead. It rolls back any transaction left
+    open after each message and checks a connection that has been idle for
+    DB_CHECK_INTERVAL seconds before using it again. The connection is closed
+    only when it fails, and Django opens a new one on the next query.
+
+    """
+    def __init__(self, persistent=False):
+        self.persistent = persistent
+        self.last_used = time.time()
+
+    def prepare(self):
+        if not self.persistent:
+            close_connection()
+
+    def track(self, callback):
+        if not self.persistent:
+            return callback
+
+        def wrapper(client, message):
+            self.check()
+            try:
+                callback(client, message)
+            finally:
+                self.release()
+        return wrapper
+
+    def check(self):
+        if connection.connection is None or \
+           time.time() - self.last_used < DB_CHECK_INTERVAL:
+            return
+        try:
+            connection.cursor().execute("SELECT 1")
+            transaction.rollback_unless_managed()
+        except Exception as e:
+            log.warning("DB connection is not usable, reconnecting: %s", e)
+            close_connection()
+
+    def release(self):
+        # Do not hold any locks, e.g. from 'select_for_update', while
+        # waiting for the next message
+        try:
+            transaction.rollback_unless_managed()
+        except Exception as e:
+            log.warning("Failed to end DB transaction, closing the DB"
+                        " connection: %s", e)
+            close_connection()
+        self.last_used = time.time()
+
+
+class DispatcherStats(object):
+    """Count handled messages and measure their event lag.
+
+    The event lag of a message is the time from the Ganeti event that it
+    describes until it has been handled. The counters are logged and reset
+    every STATS_INTERVAL seconds.
+
+    """
+    def __init__(self, worker=None):
+        if worker is None:
+            self.name = "Dispatcher"
+        else:
+            self.name = "Worker %d" % worker
+        self.reset()
+
+    def reset(self):
+        self.started = time.time()
+        self.messages = 0
+        self.lag_count = 0
+        self.lag_total = 0.0
+        self.lag_max = 0.0
+
+    def track(self, callback):
+        def wrapper(client, message):
+            try:
+                callback(client, message)
+            finally:
+                self.add(message)
+        return wrapper
+
+    def add(self, message):
+        self.messages += 1
+        lag = get_event_lag(message)
+        if lag is not None:
+            self.lag_count += 1
+            self.lag_total += lag
+            self.lag_max = max(self.lag_max, lag)
+        if time.time() - self.started >= STATS_INTERVAL:
+            self.report()
+            self.reset()
+
+    def report(self):
+        lag_avg = self.lag_total / self.lag_count if self.lag_count else 0
+        log.info("%s: handled %d messages in %d seconds, event lag:"
+                 " avg %.3fs, max %.3fs", self.name, self.messages,
+                 time.time() - self.started, lag_avg, self.lag_max)
+
+
+def get_event_lag(message):
+    """Return the seconds elapsed since the event of a message."""
+    try:
+        seconds, microseconds = json.loads(message["body"])["event_time"]
+    except Exception:
+        return None
+    return time.time() - (seconds + microseconds / 1e6)
+
+
+def get_worker(message, workers):
+    """Choose the worker that will handle a message.
+
+    Messages are assigned to workers by the name of the instance or network
+    they refer to, so that messages about the same VM or network are always
+    handled by the same worker, in order.
+
+    """
+    try:
+        body = json.loads(message["body"])
+        key = body.get("instance") or body.get("network") or \
+            body.get("cluster") or ""
+    except (ValueError, AttributeError):
+        key = ""
+    if isinstance(key, unicode):
+        key = key.encode("utf-8")
+    return (zlib.crc32(str(key)) & 0xffffffff) % workers
+
+
+def route_message(queue, workers):
+    """Get a callback that forwards messages from 'queue' to the workers.
+
+    The message is acknowledged after the broker has confirmed that it has
+    been published to the queue of the worker.
+
+    """
+    def callback(client, message):
+        worker = get_worker(message, workers)
+        client.basic_publish("", queues.get_worker_queue(queue, worker),
+                             message["body"])
+        client.basic_ack(message)
+    return callback
+
+
 def handle_request(client, msg):
     """Callback function for handling requests.
 
@@ -289,8 +535,24 @@ def parse_arguments(args):
                            " snf-dispatcher process, that will check"
                            " communication between snf-dispatcher and Ganeti"
                            " backends via AMQP brokers")
-
-    return parser.parse_args(args)
+    parser.add_option("--keep-db-connection", dest="keep_db",
+                      default=False, action="store_true",
+                      help="Keep the DB connection open across messages,"
+                           " reconnecting only if it fails, instead of using"
+                           " a new connection for each message")
+    parser.add_option("-w", "--workers", dest="workers", type="int",
+                      default=0,
+                      help="Number of worker processes that handle messages."
+                           " Messages about the same VM or network are always"
+                           " handled by the same worker. Changing the number"
+                           " of workers leaves any messages already routed to"
+                           " the removed workers in their queues (default: 0,"
+                           " handle all messages in the main process)")
+
+    (opts, args) = parser.parse_args(args)
+    if opts.workers < 0:
+        parser.error("--workers must not be negative")
+    return (opts, args)
 
 
 def check_dispatcher_status(pid_file):
@@ -445,13 +707,20 @@ def get_user_confirmation():
     return True
 
 
-def debug_mode():
-    disp = Dispatcher(debug=True)
+def debug_mode(opts):
+    disp = Dispatcher(debug=True, workers=opts.workers, keep_db=opts.keep_db)
     disp.wait()
 
 
 def daemon_mode(opts):
-    disp = Dispatcher(debug=False)
+    disp = Dispatcher(debug=False, workers=opts.workers,
+                      keep_db=opts.keep_db)
+    disp.wait()
+
+
+def worker_mode(worker, debug, keep_db):
+    setproctitle.setproctitle("%s: worker %d" % (sys.argv[0], worker))
+    disp = Dispatcher(debug=debug, worker=worker, keep_db=keep_db)
     disp.wait()
 
 
@@ -503,7 +772,7 @@ def main():
 
     # Debug mode, process messages without daemonizing
     if opts.debug:
-        debug_mode()
+        debug_mode(opts)
         return
 
     # Create pidfile,
@@ -45,6 +45,13 @@ class Command(SynnefoCommand):
                     metavar="True|False",
                     help="Perform server reconciliation for each backend"
                          " parallel."),
+        make_option('--incremental', action='store_true',
+                    dest='incremental', default=False,
+                    help='Check for unsynced state only the servers that'
+                         ' have changed in the DB or in Ganeti since the'
+                         ' previous reconciliation of their backend. Only'
+                         ' runs that fix all unsynced state count as'
+                         ' reconciliations'),
         make_option('--fix-stale', action='store_true', dest='fix_stale',
                     default=False, help='Fix (remove) stale DB entries in DB'),
         make_option('--fix-orphans', action='store_true', dest='fix_orphans',
@@ -74,6 +74,11 @@ def convert_exchange_to_dead(exchange):
     return exchange + "-dl"
 
 
+def get_worker_queue(queue, worker):
+    """Get the queue that a dispatcher worker consumes instead of 'queue'"""
+    return "%s-worker-%d" % (queue, worker)
+
+
 EVENTD_HEARTBEAT_ROUTING_KEY = "eventd.heartbeat"
 
 
@@ -40,12 +40,17 @@ For G, the operating state is True if the machine is up, False otherwise.
 
 from django.conf import settings
 
+import os
+import sys
+import json
 import logging
 import itertools
 import bitarray
+import threading
 from datetime import datetime, timedelta
 
 from django.db import transaction
+from django.db.models import Q
 from synnefo.db.models import (Backend, VirtualMachine, Flavor,
                                pooled_rapi_client, Network,
                                BackendNetwork, BridgePoolTable,
@@ -58,6 +63,18 @@ logger = logging.getLogger()
 logging.basicConfig()
 
 BUILDING_NIC_TIMEOUT = timedelta(seconds=120)
+# Number of servers that are loaded from the DB at a time
+SERVERS_CHUNK_SIZE = 500
+# Number of concurrent requests used to look up Ganeti jobs
+JOBS_LOOKUP_THREADS = 4
+# Above this number of jobs, all jobs are fetched with a single bulk request
+JOBS_BULK_THRESHOLD = 500
+# Options that fix all the unsynced state of the servers. Incremental runs
+# rely on the previous run having fixed it, so only runs with all of them
+# mark the backend as reconciled.
+UNSYNCED_FIX_OPTIONS = ("fix_unsynced", "fix_unsynced_nics",
+                        "fix_unsynced_disks", "fix_unsynced_flavors",
+                        "fix_pending_tasks")
 
 
 class BackendReconciler(object):
@@ -73,30 +90,59 @@ class BackendReconciler(object):
     def close(self):
         self.backend.put_client(self.client)
 
-    @transaction.commit_on_success
     def reconcile(self):
+        """Reconcile the servers of the backend.
+
+        Servers are loaded from the DB in chunks and each one is fixed in its
+        own transaction. In incremental mode, only the servers that have
+        changed in the DB or in Ganeti since the start of the previous
+        reconciliation of the backend are checked for unsynced state. Stale
+        and orphan servers are always detected.
+
+        """
         log = self.log
         backend = self.backend
         log.debug("Reconciling backend %s", backend)
 
         self.event_time = datetime.now()
-
-        self.db_servers = get_database_servers(backend)
-        self.db_servers_keys = set(self.db_servers.keys())
+        self.since = None
+        if self.options.get("incremental"):
+            self.since = backend.reconciled
+            if self.since is None:
+                log.info("Backend %s has not been reconciled before. Checking"
+                         " all servers.", backend)
+
+        # Query Ganeti while querying the DB
+        gnt_servers = FetchThread(get_ganeti_servers, backend)
+
+        db_servers = get_database_servers(backend)
+        self.db_servers_keys = set(db_servers.values_list("id", flat=True))
         log.debug("Got servers info from database.")
 
-        self.gnt_servers = get_ganeti_servers(backend)
+        # Only the jobs of building servers and of pending tasks are needed
+        self.gnt_jobs = get_ganeti_jobs(backend,
+                                        get_referenced_jobs(db_servers))
+        log.debug("Got jobs from Ganeti backend")
+
+        self.gnt_servers = gnt_servers.get()
         self.gnt_servers_keys = set(self.gnt_servers.keys())
         log.debug("Got servers info from Ganeti backend.")
 
-        self.gnt_jobs = get_ganeti_jobs(backend)
-        log.debug("Got jobs from Ganeti backend")
+        # Servers are loaded again later, in chunks. Leave the ones that
+        # changed after Ganeti was queried, e.g. by a task that started in
+        # the meantime, to the next reconciliation.
+        db_servers = db_servers.filter(updated__lt=self.event_time)
 
-        self.stale_servers = self.reconcile_stale_servers()
+        self.stale_servers = self.reconcile_stale_servers(db_servers)
         self.orphan_servers = self.reconcile_orphan_servers()
-        self.unsynced_servers = self.reconcile_unsynced_servers()
+        self.unsynced_servers = self.reconcile_unsynced_servers(db_servers)
         self.close()
 
+        if all(self.options.get(option) for option in UNSYNCED_FIX_OPTIONS):
+            Backend.objects.filter(id=backend.id)\
+                           .update(reconciled=self.event_time)
+            backend.reconciled = self.event_time
+
     def get_build_status(self, db_server):
         """Return the status of the build job.
 
@@ -120,12 +166,12 @@ class BackendReconciler(object):
         else:
             return "ERROR", None
 
-    def reconcile_stale_servers(self):
+    def reconcile_stale_servers(self, db_servers):
         # Detect stale servers
         stale = []
         stale_keys = self.db_servers_keys - self.gnt_servers_keys
-        for server_id in stale_keys:
-            db_server = self.db_servers[server_id]
+        for db_server in iterate_servers(db_servers, stale_keys):
+            server_id = db_server.id
             if db_server.operstate == "BUILD":
                 build_status, end_timestamp = self.get_build_status(db_server)
                 if build_status == "ERROR":
@@ -151,15 +197,19 @@ class BackendReconciler(object):
         # Fix them
         if stale and self.options["fix_stale"]:
             for server_id in stale:
-                vm = get_locked_server(server_id)
-                backend_mod.process_op_status(
-                    vm=vm,
-                    etime=self.event_time,
-                    jobid=-0,
-                    opcode='OP_INSTANCE_REMOVE', status='success',
-                    logmsg='Reconciliation: simulated Ganeti event')
+                self.remove_stale_server(server_id)
             self.log.debug("Simulated Ganeti removal for stale servers.")
 
+    @transaction.commit_on_success
+    def remove_stale_server(self, server_id):
+        vm = get_locked_server(server_id)
+        backend_mod.process_op_status(
+            vm=vm,
+            etime=self.event_time,
+            jobid=-0,
+            opcode='OP_INSTANCE_REMOVE', status='success',
+            logmsg='Reconciliation: simulated Ganeti event')
+
     def reconcile_orphan_servers(self):
         orphans = self.gnt_servers_keys - self.db_servers_keys
         if orphans:
@@ -174,34 +224,52 @@ class BackendReconciler(object):
                 self.client.DeleteInstance(server_name)
             self.log.debug("Issued OP_INSTANCE_REMOVE for orphan servers.")
 
-    def reconcile_unsynced_servers(self):
-        #log = self.log
-        for server_id in self.db_servers_keys & self.gnt_servers_keys:
-            db_server = self.db_servers[server_id]
-            gnt_server = self.gnt_servers[server_id]
-            if db_server.operstate == "BUILD":
-                build_status, end_timestamp = self.get_build_status(db_server)
-                if build_status == "RUNNING":
-                    # Do not reconcile building VMs
-                    continue
-                elif build_status == "ERROR":
-                    # Special handling of build errors
-                    self.reconcile_building_server(db_server)
-                    continue
-                elif end_timestamp >= self.event_time:
-                    # Do not continue reconciliation for building server that
-                    # the build job completed after quering the state of
-                    # Ganeti servers.
-                    continue
-
-            self.reconcile_unsynced_operstate(server_id, db_server,
-                                              gnt_server)
-            self.reconcile_unsynced_flavor(server_id, db_server,
-                                           gnt_server)
-            self.reconcile_unsynced_nics(server_id, db_server, gnt_server)
-            self.reconcile_unsynced_disks(server_id, db_server, gnt_server)
-            if db_server.task is not None:
-                self.reconcile_pending_task(server_id, db_server)
+    def reconcile_unsynced_servers(self, db_servers):
+        server_ids = self.db_servers_keys & self.gnt_servers_keys
+        if self.since is not None:
+            # Building servers and servers with pending tasks depend on the
+            # state of Ganeti jobs, so they are always checked
+            changed = db_servers.filter(Q(updated__gte=self.since) |
+                                        Q(operstate="BUILD") |
+                                        Q(task__isnull=False))
+            changed = set(changed.values_list("id", flat=True))
+            changed.update(server_id for server_id in server_ids
+                           if self.gnt_servers[server_id]["updated"] >=
+                           self.since)
+            server_ids &= changed
+            self.log.debug("Checking %d servers that changed since %s",
+                           len(server_ids), self.since)
+
+        for db_server in iterate_servers(db_servers, server_ids):
+            self.reconcile_unsynced_server(db_server)
+
+    @transaction.commit_on_success
+    def reconcile_unsynced_server(self, db_server):
+        server_id = db_server.id
+        gnt_server = self.gnt_servers[server_id]
+        if db_server.operstate == "BUILD":
+            build_status, end_timestamp = self.get_build_status(db_server)
+            if build_status == "RUNNING":
+                # Do not reconcile building VMs
+                return
+            elif build_status == "ERROR":
+                # Special handling of build errors
+                self.reconcile_building_server(db_server)
+                return
+            elif end_timestamp >= self.event_time:
+                # Do not continue reconciliation for building server that
+                # the build job completed after quering the state of
+                # Ganeti servers.
+                return
+
+        self.reconcile_unsynced_operstate(server_id, db_server,
+                                          gnt_server)
+        self.reconcile_unsynced_flavor(server_id, db_server,
+                                       gnt_server)
+        self.reconcile_unsynced_nics(server_id, db_server, gnt_server)
+        self.reconcile_unsynced_disks(server_id, db_server, gnt_server)
+        if db_server.task is not None:
+            self.reconcile_pending_task(server_id, db_server)
 
     def reconcile_building_server(self, db_server):
         self.log.info("Server '%s' is BUILD in DB, but 'ERROR' in Ganeti.",
@@ -437,10 +505,42 @@ def get_online_backends():
 
 
 def get_database_servers(backend):
-    servers = backend.virtual_machines.select_related("flavor")\
-                                      .prefetch_related("nics__ips__subnet")\
-                                      .filter(deleted=False)
-    return dict([(s.id, s) for s in servers])
+    return backend.virtual_machines.select_related("flavor")\
+                                   .filter(deleted=False)
+
+
+def iterate_servers(servers, server_ids, chunk_size=SERVERS_CHUNK_SIZE):
+    """Load the servers with the given IDs, 'chunk_size' at a time."""
+    server_ids = sorted(server_ids)
+    for i in xrange(0, len(server_ids), chunk_size):
+        chunk = servers.filter(id__in=server_ids[i:i + chunk_size])
+        for server in chunk.order_by("id"):
+            yield server
+
+
+class FetchThread(threading.Thread):
+    """Call a function in a separate thread and keep its result."""
+    def __init__(self, func, *args):
+        super(FetchThread, self).__init__()
+        self.daemon = True
+        self.func = func
+        self.args = args
+        self.result = None
+        self.exc_info = None
+        self.start()
+
+    def run(self):
+        try:
+            self.result = self.func(*self.args)
+        except Exception:
+            self.exc_info = sys.exc_info()
+
+    def get(self):
+        """Wait for the function to return and get its result."""
+        self.join()
+        if self.exc_info is not None:
+            raise self.exc_info[0], self.exc_info[1], self.exc_info[2]
+        return self.result
 
 
 def get_ganeti_servers(backend):
@@ -516,9 +616,126 @@ def disks_from_instance(i):
     return disks
 
 
-def get_ganeti_jobs(backend):
-    gnt_jobs = backend_mod.get_jobs(backend)
-    return dict([(int(j["id"]), j) for j in gnt_jobs])
+def get_referenced_jobs(db_servers):
+    """Return the IDs of the jobs of building servers and pending tasks."""
+    servers = db_servers.filter(Q(operstate="BUILD") | Q(task__isnull=False))
+    job_ids = set()
+    for build_job_id, task_job_id in servers.values_list("backendjobid",
+                                                         "task_job_id"):
+        job_ids.update([build_job_id, task_job_id])
+    job_ids.discard(None)
+    return job_ids
+
+
+def get_ganeti_jobs(backend, job_ids):
+    """Get the status of the given Ganeti jobs, as a dict by job ID.
+
+    Finalized jobs are looked up in the job cache of the backend first. The
+    rest are requested one by one, from a few threads in parallel, unless
+    there are so many that a single bulk request is cheaper. Jobs that do
+    not exist in Ganeti are missing from the result.
+
+    """
+    cache = JobCache(backend)
+    gnt_jobs = {}
+    missing = []
+    for job_id in job_ids:
+        job = cache.get(job_id)
+        if job is not None:
+            gnt_jobs[job_id] = job
+        else:
+            missing.append(job_id)
+
+    if len(missing) > JOBS_BULK_THRESHOLD:
+        missing = set(missing)
+        jobs = [(int(j["id"]), j) for j in backend_mod.get_jobs(backend)]
+        jobs = [(job_id, j) for job_id, j in jobs if job_id in missing]
+    else:
+        missing.sort()
+        threads = [FetchThread(get_jobs_status, backend,
+                               missing[i::JOBS_LOOKUP_THREADS])
+                   for i in range(min(JOBS_LOOKUP_THREADS, len(missing)))]
+        jobs = itertools.chain(*[t.get() for t in threads])
+
+    for job_id, job in jobs:
+        gnt_jobs[job_id] = job
+        if job["status"] in rapi.JOB_STATUS_FINALIZED:
+            cache.add(job_id, job)
+    cache.save()
+    return gnt_jobs
+
+
+def get_jobs_status(backend, job_ids):
+    """Request the status of each job, skipping jobs that do not exist."""
+    jobs = []
+    with pooled_rapi_client(backend) as client:
+        for job_id in job_ids:
+            try:
+                jobs.append((job_id, client.GetJobStatus(job_id)))
+            except rapi.GanetiApiError as e:
+                if e.code != 404:
+                    raise
+    return jobs
+
+
+class JobCache(object):
+    """Status of the finalized Ganeti jobs of a backend, kept in a file.
+
+    Finalized jobs never change, so there is no need to request them from
+    Ganeti again on the next reconciliation. Only the `size` most recent
+    jobs are kept. The cache is disabled if no directory is given, and any
+    error reading or writing the file only costs some extra requests.
+
+    """
+    FIELDS = ("status", "end_ts")
+
+    def __init__(self, backend, directory=None, size=None):
+        if directory is None:
+            directory = settings.RECONCILIATION_JOB_CACHE_DIR
+        if size is None:
+            size = settings.RECONCILIATION_JOB_CACHE_SIZE
+        self.size = size
+        self.jobs = {}
+        self.changed = False
+        self.path = None
+        if directory:
+            self.path = os.path.join(directory,
+                                     "jobs-%s.json" % backend.clustername)
+            self.load()
+
+    def load(self):
+        try:
+            with open(self.path) as f:
+                jobs = json.load(f)
+            self.jobs = dict((int(job_id), job)
+                             for job_id, job in jobs.items())
+        except IOError:
+            # The cache has not been written yet
+            pass
+        except (ValueError, AttributeError):
+            logger.warning("Ignoring corrupted job cache '%s'", self.path)
+
+    def get(self, job_id):
+        return self.jobs.get(job_id)
+
+    def add(self, job_id, job):
+        self.jobs[job_id] = dict((f, job.get(f)) for f in self.FIELDS)
+        self.changed = True
+
+    def save(self):
+        if self.path is None or not self.changed:
+            return
+        job_ids = sorted(self.jobs.keys())[-self.size:]
+        jobs = dict((job_id, self.jobs[job_id]) for job_id in job_ids)
+        tmp_path = "%s.%d" % (self.path, os.getpid())
+        try:
+            with open(tmp_path, "w") as f:
+                json.dump(jobs, f)
+            os.rename(tmp_path, self.path)
+        except (IOError, OSError) as e:
+            logger.warning("Could not write job cache '%s': %s",
+                           self.path, e)
+        self.changed = False
 
 
 class NetworkReconciler(object):
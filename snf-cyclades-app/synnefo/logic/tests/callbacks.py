@@ -28,7 +28,8 @@ from datetime import datetime
 from mock import patch
 from synnefo.api.util import allocate_resource
 from synnefo.logic.callbacks import (update_db, update_network,
-                                     update_build_progress)
+                                     update_build_progress,
+                                     ProgressCoalescer)
 from snf_django.utils.testing import mocked_quotaholder
 from synnefo.logic.rapi import GanetiApiError
 
@@ -664,3 +665,35 @@ class UpdateBuildProgressTest(TestCase):
             self.assertTrue(client.basic_ack.called)
             vm = self.get_db_vm()
             self.assertEqual(vm.buildpercentage, old)
+
+    def test_coalesce_progress(self, client):
+        coalescer = ProgressCoalescer(update_build_progress, timeout=60)
+        old = self.vm.buildpercentage
+        msgs = [self.create_msg(progress=progress,
+                                instance=self.vm.backend_vm_id)
+                for progress in [20, 40, 60]]
+        for msg in msgs:
+            coalescer(client, msg)
+        # Superseded messages are acked without updating the DB
+        self.assertEqual([c[0][0] for c in client.basic_ack.call_args_list],
+                         msgs[:2])
+        self.assertEqual(self.get_db_vm().buildpercentage, old)
+        self.assertTrue(coalescer.next_timeout() > 0)
+        coalescer.flush()
+        self.assertEqual(self.get_db_vm().buildpercentage, old)
+        coalescer.flush(force=True)
+        self.assertEqual(self.get_db_vm().buildpercentage, 60)
+        self.assertEqual(client.basic_ack.call_count, 3)
+        self.assertEqual(coalescer.next_timeout(), None)
+
+    def test_coalesce_progress_order(self, client):
+        coalescer = ProgressCoalescer(update_build_progress, timeout=60)
+        coalescer(client, self.create_msg(progress=30,
+                                          instance=self.vm.backend_vm_id))
+        # Other messages of the instance are handled after the held one
+        coalescer(client, self.create_msg(type='image-info',
+                                          messages=['Image copied'],
+                                          instance=self.vm.backend_vm_id))
+        self.assertEqual(self.get_db_vm().buildpercentage, 30)
+        self.assertEqual(client.basic_ack.call_count, 2)
+        self.assertEqual(coalescer.next_timeout(), None)
@@ -13,15 +13,21 @@
 #
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
+import shutil
 import logging
+from tempfile import mkdtemp
+from django.conf import settings as django_settings
 from django.test import TestCase
 
-from synnefo.db.models import VirtualMachine, Network, BackendNetwork
+from synnefo.db.models import (Backend, VirtualMachine, Network,
+                               BackendNetwork)
 from synnefo.db import models_factory as mfactory
 from synnefo.logic import reconciliation
+from synnefo.logic.rapi import GanetiApiError
 from mock import patch
-from snf_django.utils.testing import mocked_quotaholder
+from snf_django.utils.testing import mocked_quotaholder, override_settings
 from time import time
+from datetime import datetime, timedelta
 from synnefo import settings
 
 
@@ -35,7 +41,9 @@ class ServerReconciliationTest(TestCase):
                    "fix_stale": True,
                    "fix_orphans": True,
                    "fix_unsynced_nics": True,
-                   "fix_unsynced_flavors": True}
+                   "fix_unsynced_disks": True,
+                   "fix_unsynced_flavors": True,
+                   "fix_pending_tasks": True}
         self.reconciler = reconciliation.BackendReconciler(self.backend,
                                                            options=options,
                                                            logger=log)
@@ -45,16 +53,16 @@ class ServerReconciliationTest(TestCase):
                                              backendjobid=1,
                                              operstate="BUILD")
         for status in ["queued", "waiting", "running"]:
-            mrapi().GetJobs.return_value = [{"id": "1", "status": status,
-                                             "end_ts": None}]
+            mrapi().GetJobStatus.return_value = {"id": 1, "status": status,
+                                                 "end_ts": None}
             with mocked_quotaholder():
                 self.reconciler.reconcile()
             vm1 = VirtualMachine.objects.get(id=vm1.id)
             self.assertFalse(vm1.deleted)
             self.assertEqual(vm1.operstate, "BUILD")
 
-        mrapi().GetJobs.return_value = [{"id": "1", "status": "error",
-                                         "end_ts": [44123, 1]}]
+        mrapi().GetJobStatus.return_value = {"id": 1, "status": "error",
+                                             "end_ts": [44123, 1]}
         with mocked_quotaholder():
             self.reconciler.reconcile()
         vm1 = VirtualMachine.objects.get(id=vm1.id)
@@ -65,14 +73,43 @@ class ServerReconciliationTest(TestCase):
             vm1.operstate = "BUILD"
             vm1.deleted = False
             vm1.save()
-            mrapi().GetJobs.return_value = [{"id": "1", "status": status,
-                                            "end_ts": [44123, 1]}]
+            mrapi().GetJobStatus.return_value = {"id": 1, "status": status,
+                                                 "end_ts": [44123, 1]}
             with mocked_quotaholder():
                 self.reconciler.reconcile()
             vm1 = VirtualMachine.objects.get(id=vm1.id)
             self.assertFalse(vm1.deleted)
             self.assertEqual(vm1.operstate, "ERROR")
 
+    def test_job_cache(self, mrapi):
+        tmpdir = mkdtemp()
+        try:
+            with override_settings(django_settings,
+                                   RECONCILIATION_JOB_CACHE_DIR=tmpdir):
+                mrapi().GetJobStatus.return_value = {"id": 1,
+                                                     "status": "running",
+                                                     "end_ts": None}
+                jobs = reconciliation.get_ganeti_jobs(self.backend, [1])
+                self.assertEqual(jobs[1]["status"], "running")
+                mrapi().GetJobStatus.return_value = {"id": 1,
+                                                     "status": "success",
+                                                     "end_ts": [44123, 1]}
+                jobs = reconciliation.get_ganeti_jobs(self.backend, [1])
+                self.assertEqual(jobs[1]["status"], "success")
+                self.assertEqual(mrapi().GetJobStatus.call_count, 2)
+                # Finalized jobs are not requested again
+                jobs = reconciliation.get_ganeti_jobs(self.backend, [1])
+                self.assertEqual(jobs[1], {"status": "success",
+                                           "end_ts": [44123, 1]})
+                self.assertEqual(mrapi().GetJobStatus.call_count, 2)
+                # Missing jobs are skipped
+                mrapi().GetJobStatus.side_effect = \
+                    GanetiApiError("Not found", code=404)
+                jobs = reconciliation.get_ganeti_jobs(self.backend, [1, 2])
+                self.assertEqual(jobs.keys(), [1])
+        finally:
+            shutil.rmtree(tmpdir)
+
     def test_stale_server(self, mrapi):
         mrapi.GetInstances = []
         vm1 = mfactory.VirtualMachineFactory(backend=self.backend,
@@ -145,6 +182,87 @@ class ServerReconciliationTest(TestCase):
         vm1 = VirtualMachine.objects.get(id=vm1.id)
         self.assertEqual(vm1.operstate, "STARTED")
 
+    def test_incremental(self, mrapi):
+        vm1 = mfactory.VirtualMachineFactory(backend=self.backend,
+                                             deleted=False,
+                                             operstate="STOPPED")
+        last_run = datetime.now() - timedelta(hours=1)
+        VirtualMachine.objects.filter(id=vm1.id)\
+                              .update(updated=last_run - timedelta(hours=1))
+        self.backend.reconciled = last_run
+        self.reconciler.options["incremental"] = True
+        instance = {"name": vm1.backend_vm_id,
+                    "beparams": {"maxmem": 1024,
+                                 "minmem": 1024,
+                                 "vcpus": 4},
+                    "oper_state": True,
+                    "mtime": time() - 3 * 3600,
+                    "disk.sizes": [],
+                    "disk.names": [],
+                    "disk.uuids": [],
+                    "nic.ips": [],
+                    "nic.names": [],
+                    "nic.macs": [],
+                    "nic.networks.names": [],
+                    "tags": []}
+        mrapi().GetInstances.return_value = [instance]
+        with mocked_quotaholder():
+            self.reconciler.reconcile()
+        # Unchanged servers are not checked
+        vm1 = VirtualMachine.objects.get(id=vm1.id)
+        self.assertEqual(vm1.operstate, "STOPPED")
+        self.assertEqual(self.backend.reconciled,
+                         self.reconciler.event_time)
+
+        instance["mtime"] = time()
+        with mocked_quotaholder():
+            self.reconciler.reconcile()
+        vm1 = VirtualMachine.objects.get(id=vm1.id)
+        self.assertEqual(vm1.operstate, "STARTED")
+
+        # Runs that do not fix everything are not reconciliations
+        reconciled = self.backend.reconciled
+        self.reconciler.options["fix_unsynced"] = False
+        with mocked_quotaholder():
+            self.reconciler.reconcile()
+        self.assertEqual(self.backend.reconciled, reconciled)
+        backend = Backend.objects.get(id=self.backend.id)
+        self.assertEqual(backend.reconciled, reconciled)
+
+    def test_server_changed_during_run(self, mrapi):
+        vm1 = mfactory.VirtualMachineFactory(backend=self.backend,
+                                             deleted=False,
+                                             operstate="STOPPED",
+                                             task="START",
+                                             task_job_id=42)
+        # The task started after Ganeti was queried
+        VirtualMachine.objects.filter(id=vm1.id)\
+                              .update(updated=datetime.now() +
+                                      timedelta(hours=1))
+        mrapi().GetInstances.return_value = \
+            [{"name": vm1.backend_vm_id,
+              "beparams": {"maxmem": 1024,
+                           "minmem": 1024,
+                           "vcpus": 4},
+              "oper_state": True,
+              "mtime": time(),
+              "disk.sizes": [],
+              "disk.names": [],
+              "disk.uuids": [],
+              "nic.ips": [],
+              "nic.names": [],
+              "nic.macs": [],
+              "nic.networks.names": [],
+              "tags": []}]
+        mrapi().GetJobStatus.side_effect = GanetiApiError("Not found",
+                                                          code=404)
+        with mocked_quotaholder():
+            self.reconciler.reconcile()
+        vm1 = VirtualMachine.objects.get(id=vm1.id)
+        self.assertEqual(vm1.operstate, "STOPPED")
+        self.assertEqual(vm1.task, "START")
+        self.assertEqual(vm1.task_job_id, 42)
+
     def test_unsynced_flavor(self, mrapi):
         flavor1 = mfactory.FlavorFactory(cpu=2, ram=1024, disk=1,
                                          disk_template="drbd")
@@ -47,7 +47,9 @@ from django.conf import settings
 from django.utils import importlib
 from django.utils.encoding import smart_unicode, smart_str
 from pithos.backends.base import NotAllowedError, VersionNotExists, QuotaError
+from pithos.backends.modular import add_object_change_listener
 from snf_django.lib.api import faults
+from synnefo.lib.cache import LRUCache
 
 Location = namedtuple("ObjectLocation", ["account", "container", "path"])
 
@@ -80,6 +82,65 @@ def get_pithos_backend():
     return _pithos_backend_pool.pool_get()
 
 
+# The image listings of the users, and the public images (key None)
+if settings.PLANKTON_IMAGE_INDEX_TIMEOUT > 0:
+    _image_index = LRUCache(maxsize=settings.PLANKTON_IMAGE_INDEX_SIZE,
+                            timeout=settings.PLANKTON_IMAGE_INDEX_TIMEOUT)
+else:
+    _image_index = None
+
+
+def invalidate_image_index(account=None, path=None):
+    """Drop the cached image listings."""
+    if _image_index is not None:
+        _image_index.clear()
+
+
+add_object_change_listener(invalidate_image_index)
+
+
+# Images by id, shared between the users that may read them
+if settings.PLANKTON_IMAGE_CACHE_TIMEOUT > 0:
+    _image_cache = LRUCache(maxsize=settings.PLANKTON_IMAGE_CACHE_SIZE,
+                            timeout=settings.PLANKTON_IMAGE_CACHE_TIMEOUT)
+else:
+    _image_cache = None
+
+
+def get_cached_image(uuid, user):
+    """Return the cached image, if the user is allowed to read it.
+
+    Only the owner, the public read permission and the users given read
+    permission explicitly are considered, so that permissions granted
+    through groups are always checked by Pithos.
+
+    """
+    if _image_cache is None:
+        return None
+    image = _image_cache.get(uuid)
+    if image is None:
+        return None
+    if (image["owner"] == user or image["is_public"] or
+            user in image["users"]):
+        return image
+    return None
+
+
+def cache_image(image):
+    """Cache an image returned by PlanktonBackend.get_image."""
+    if _image_cache is not None:
+        _image_cache.set(image["id"], image)
+
+
+def invalidate_image_cache(account=None, path=None):
+    """Drop the cached images."""
+    if _image_cache is not None:
+        _image_cache.clear()
+
+
+add_object_change_listener(invalidate_image_cache)
+
+
 def format_timestamp(t):
     return strftime('%Y-%m-%d %H:%M:%S', gmtime(t))
 
@@ -394,36 +455,33 @@ class PlanktonBackend(object):
         logger.debug("User '%s' unregistered image '%s'", self.user, uuid)
 
     # List functions
-    def _list_images(self, user=None, filters=None, params=None):
-        filters = filters or {}
-
-        # TODO: Use filters
-        # # Fix keys
-        # keys = [PLANKTON_PREFIX + 'name']
-        # size_range = (None, None)
-        # for key, val in filters.items():
-        #     if key == 'size_min':
-        #         size_range = (val, size_range[1])
-        #     elif key == 'size_max':
-        #         size_range = (size_range[0], val)
-        #     else:
-        #         keys.append('%s = %s' % (PLANKTON_PREFIX + key, val))
+    def _get_image_index(self, user=None):
+        """Return the images that are visible to the user."""
+        if _image_index is not None:
+            images = _image_index.get(user)
+            if images is not None:
+                return images
+
         _images = self.backend.get_domain_objects(domain=PLANKTON_DOMAIN,
                                                   user=user)
-
         images = []
         for (location, metadata, permissions) in _images:
             location = Location(*location.split("/", 2))
             images.append(image_to_dict(location, metadata, permissions))
 
-        if params is None:
-            params = {}
-
-        key = itemgetter(params.get('sort_key', 'created_at'))
-        reverse = params.get('sort_dir', 'desc') == 'desc'
-        images.sort(key=key, reverse=reverse)
+        if _image_index is not None:
+            _image_index.set(user, images)
         return images
 
+    def _list_images(self, user=None, filters=None, params=None,
+                     select=None):
+        images = self._get_image_index(user)
+        if select is not None:
+            images = filter(select, images)
+        images = filter_images(images, filters)
+        # The index is shared, return copies of the images
+        return deepcopy(sort_images(images, params))
+
     @handle_pithos_backend
     def list_images(self, filters=None, params=None):
         return self._list_images(user=self.user, filters=filters,
@@ -431,15 +489,14 @@ class PlanktonBackend(object):
 
     @handle_pithos_backend
     def list_shared_images(self, member, filters=None, params=None):
-        images = self._list_images(user=self.user, filters=filters,
-                                   params=params)
         is_shared = lambda img: not img["is_public"] and img["owner"] == member
-        return filter(is_shared, images)
+        return self._list_images(user=self.user, filters=filters,
+                                 params=params, select=is_shared)
 
     @handle_pithos_backend
     def list_public_images(self, filters=None, params=None):
-        images = self._list_images(user=None, filters=filters, params=params)
-        return filter(lambda img: img["is_public"], images)
+        return self._list_images(user=None, filters=filters, params=params,
+                                 select=lambda img: img["is_public"])
 
     # Snapshots
     def list_snapshots(self, user=None):
@@ -536,6 +593,50 @@ def image_to_dict(location, metadata, permissions):
     return image
 
 
+def filter_images(images, filters=None):
+    """Return the images that match the Glance filters"""
+    filters = filters or {}
+
+    def match(image):
+        for key, val in filters.items():
+            if key == "size_min":
+                if image["size"] < val:
+                    return False
+            elif key == "size_max":
+                if image["size"] > val:
+                    return False
+            elif key == "status":
+                if image.get("status", "").upper() != val.upper():
+                    return False
+            elif image.get(key) != val:
+                return False
+        return True
+
+    return filter(match, images)
+
+
+def sort_images(images, params=None):
+    """Sort the images and return the page specified by marker and limit"""
+    params = params or {}
+
+    key = itemgetter(params.get('sort_key', 'created_at'))
+    reverse = params.get('sort_dir', 'desc') == 'desc'
+    images = sorted(images, key=key, reverse=reverse)
+
+    marker = params.get('marker')
+    if marker is not None:
+        ids = [image["id"] for image in images]
+        try:
+            images = images[ids.index(marker) + 1:]
+        except ValueError:
+            raise faults.BadRequest("Invalid marker")
+
+    limit = params.get('limit')
+    if limit is not None:
+        images = images[:limit]
+    return images
+
+
 class JSONFileBackend(object):
     """
     A dummy image backend that loads available images from a file with json
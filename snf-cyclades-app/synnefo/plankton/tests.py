@@ -16,7 +16,7 @@
 import json
 import urllib
 
-from mock import patch
+from mock import patch, Mock
 from functools import wraps
 from copy import deepcopy
 from decimal import Decimal
@@ -24,6 +24,11 @@ from snf_django.utils.testing import BaseAPITest
 from synnefo.cyclades_settings import cyclades_services
 from synnefo.lib.services import get_service_path
 from synnefo.lib import join_urls
+from synnefo.lib.cache import LRUCache
+from synnefo.plankton import backend as plankton_backend
+from synnefo.api.util import get_image_dict
+from pithos.backends.modular import ModularBackend
+from django.test import TestCase
 
 PLANKTON_URL = get_service_path(cyclades_services, 'image',
                                 version='v1.0')
@@ -294,6 +299,90 @@ class PlanktonTest(BaseAPITest):
         except ValueError:
             self.assertTrue(False)
 
+    def test_list_images_filters(self, backend):
+        images = []
+        for i, (name, size) in enumerate([("img1", 10), ("img2", 20),
+                                          ("img3", 30), ("img1", 40)]):
+            meta = {"uuid": "uuid%d" % i,
+                    "bytes": size,
+                    "hash": "hash%d" % i,
+                    "version_timestamp": Decimal(1392487853 + i),
+                    "plankton:name": name,
+                    "plankton:status": u"AVAILABLE"}
+            images.append(("img_owner/images/%s" % i, meta, {"read": ["*"]}))
+        backend().get_domain_objects.return_value = images
+
+        def ids(query):
+            response = self.get(join_urls(IMAGES_URL, "detail" + query))
+            self.assertSuccess(response)
+            return [image["id"] for image in json.loads(response.content)]
+
+        self.assertEqual(ids(""), ["uuid3", "uuid2", "uuid1", "uuid0"])
+        self.assertEqual(ids("?name=img1"), ["uuid3", "uuid0"])
+        self.assertEqual(ids("?size_min=20&size_max=30"), ["uuid2", "uuid1"])
+        self.assertEqual(ids("?status=available&sort_dir=asc&limit=2"),
+                         ["uuid0", "uuid1"])
+        self.assertEqual(ids("?sort_key=size&marker=uuid2&limit=1"),
+                         ["uuid1"])
+        response = self.get(join_urls(IMAGES_URL, "detail?marker=foo"))
+        self.assertBadRequest(response)
+        response = self.get(join_urls(IMAGES_URL, "detail?limit=foo"))
+        self.assertBadRequest(response)
+
     def test_list_images_filters_error_1(self, backend):
         response = self.get(join_urls(IMAGES_URL, "?size_max="))
         self.assertBadRequest(response)
+
+
+class ImageCacheTest(TestCase):
+    def setUp(self):
+        patcher = patch("synnefo.plankton.backend._image_cache",
+                        LRUCache(maxsize=10, timeout=60))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.image = {"id": "uuid1", "owner": "owner", "is_public": False,
+                      "users": ["user1", "owner:group"], "name": "img",
+                      "disk_format": "diskdump", "location": "location",
+                      "is_snapshot": False, "status": "AVAILABLE",
+                      "size": 10, "mapfile": "mapfile"}
+        plankton_backend.cache_image(self.image)
+
+    def test_allowed(self):
+        for user in ("owner", "user1"):
+            self.assertTrue(plankton_backend.get_cached_image("uuid1", user)
+                            is self.image)
+        self.image["is_public"] = True
+        self.assertTrue(plankton_backend.get_cached_image("uuid1", "user2")
+                        is self.image)
+
+    def test_not_allowed(self):
+        # Group members are not resolved from the cache
+        for user in ("user2", "member"):
+            self.assertEqual(
+                plankton_backend.get_cached_image("uuid1", user), None)
+        self.assertEqual(
+            plankton_backend.get_cached_image("uuid2", "owner"), None)
+
+    @patch("synnefo.api.util.get_image")
+    def test_get_image_dict(self, get_image):
+        get_image.return_value = dict(self.image)
+        self.assertEqual(get_image_dict("uuid1", "user1")["id"], "uuid1")
+        self.assertFalse(get_image.called)
+        # Everyone else falls through to Pithos
+        self.assertEqual(get_image_dict("uuid1", "member")["id"], "uuid1")
+        get_image.assert_called_once_with("uuid1", "member")
+
+    def post_exec(self, success_status):
+        backend = Mock(serials=[], commission_resolver=None, messages=[
+            ("key", "owner", "instance", "object", "owner/images/img", {})])
+        backend._notify_object_changes = \
+            lambda: ModularBackend._notify_object_changes.im_func(backend)
+        ModularBackend.post_exec.im_func(backend, success_status)
+
+    def test_invalidate(self):
+        self.post_exec(False)
+        self.assertTrue(plankton_backend.get_cached_image("uuid1", "owner")
+                        is self.image)
+        self.post_exec(True)
+        self.assertEqual(
+            plankton_backend.get_cached_image("uuid1", "owner"), None)
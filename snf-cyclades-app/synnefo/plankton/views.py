@@ -33,7 +33,7 @@ from synnefo.plankton.backend import split_url
 FILTERS = ('name', 'container_format', 'disk_format', 'status', 'size_min',
            'size_max')
 
-PARAMS = ('sort_key', 'sort_dir')
+PARAMS = ('sort_key', 'sort_dir', 'marker', 'limit')
 
 SORT_KEY_OPTIONS = ('id', 'name', 'status', 'size', 'disk_format',
                     'container_format', 'created_at', 'updated_at')
@@ -339,6 +339,14 @@ def list_images(request, detail=False):
         except ValueError:
             raise faults.BadRequest("Malformed request.")
 
+    if 'limit' in params:
+        try:
+            params['limit'] = int(params['limit'])
+        except ValueError:
+            raise faults.BadRequest("Malformed request.")
+        if params['limit'] < 0:
+            raise faults.BadRequest("Malformed request.")
+
     with PlanktonBackend(request.user_uniq) as backend:
         images = backend.list_images(filters, params)
 
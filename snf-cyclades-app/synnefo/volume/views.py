@@ -149,6 +149,7 @@ def list_volumes(request, detail=False):
     volumes = Volume.objects.filter(userid=request.user_uniq).order_by("id")
 
     volumes = utils.filter_modified_since(request, objects=volumes)
+    volumes = utils.paginate(request, volumes)
 
     volumes = [volume_to_dict(v, detail) for v in volumes]
 
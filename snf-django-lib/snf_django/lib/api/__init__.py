@@ -29,12 +29,58 @@ from astakosclient import AstakosClient
 from astakosclient.errors import AstakosClientException
 from django.conf import settings
 from snf_django.lib.api import faults
+from snf_django.lib.astakos import TokenCache
 
 import itertools
 
 log = getLogger(__name__)
 django_logger = getLogger("django.request")
 
+# Seconds to cache the result of a token authentication. Zero disables the
+# cache.
+AUTH_TOKEN_CACHE_TIMEOUT = 0
+# Maximum number of tokens cached in each process
+AUTH_TOKEN_CACHE_SIZE = 10000
+# Optional Django cache backend to share cached tokens between processes
+AUTH_TOKEN_CACHE_BACKEND = None
+
+_token_cache = None
+
+
+def get_token_cache():
+    """Return the process-wide token cache, or None if it is disabled."""
+    global _token_cache
+    if _token_cache is None:
+        timeout = getattr(settings, "AUTH_TOKEN_CACHE_TIMEOUT",
+                          AUTH_TOKEN_CACHE_TIMEOUT)
+        if not timeout:
+            _token_cache = False
+        else:
+            size = getattr(settings, "AUTH_TOKEN_CACHE_SIZE",
+                           AUTH_TOKEN_CACHE_SIZE)
+            backend = getattr(settings, "AUTH_TOKEN_CACHE_BACKEND",
+                              AUTH_TOKEN_CACHE_BACKEND)
+            _token_cache = TokenCache(timeout, size=size,
+                                      cache_backend=backend, logger=log)
+    return _token_cache or None
+
+
+def authenticate_token(token, astakos_auth_url, logger=None):
+    """Authenticate a token against Astakos, going through the token cache."""
+    kwargs = {"use_pool": True, "retry": 2, "logger": logger}
+    token_cache = get_token_cache()
+    if token_cache is None:
+        return AstakosClient(token, astakos_auth_url, **kwargs).authenticate()
+    return token_cache.authenticate(token, astakos_auth_url, **kwargs)
+
+
+def invalidate_token(request, astakos_auth_url):
+    """Drop the token of a request from the token cache."""
+    token = getattr(request, "x_auth_token", None)
+    token_cache = get_token_cache()
+    if token and token_cache is not None:
+        token_cache.invalidate(token, astakos_auth_url)
+
 
 def get_token(request):
     """Get the Authentication Token of a request."""
@@ -56,6 +102,7 @@ def api_method(http_method=None, token_required=True, user_required=True,
     def decorator(func):
         @wraps(func)
         def wrapper(request, *args, **kwargs):
+            astakos_url = astakos_auth_url
             try:
                 # Explicitly set request encoding to UTF-8 instead of relying
                 # to the DEFAULT_CHARSET setting. See:
@@ -93,7 +140,6 @@ def api_method(http_method=None, token_required=True, user_required=True,
                 # Authenticate
                 if user_required:
                     assert(token_required), "Can not get user without token"
-                    astakos_url = astakos_auth_url
                     if astakos_url is None:
                         try:
                             astakos_url = settings.ASTAKOS_AUTH_URL
@@ -101,11 +147,8 @@ def api_method(http_method=None, token_required=True, user_required=True,
                             logger.error("Cannot authenticate without having"
                                          " an Astakos Authentication URL")
                             raise
-                    astakos = AstakosClient(token, astakos_url,
-                                            use_pool=True,
-                                            retry=2,
-                                            logger=logger)
-                    user_info = astakos.authenticate()
+                    user_info = authenticate_token(token, astakos_url,
+                                                   logger=logger)
                     request.user_uniq = user_info["access"]["user"]["id"]
                     request.user = user_info
 
@@ -116,6 +159,8 @@ def api_method(http_method=None, token_required=True, user_required=True,
                 update_response_headers(request, response)
                 return response
             except faults.Fault as fault:
+                if fault.code == 401 and user_required:
+                    invalidate_token(request, astakos_url)
                 if fault.code >= 500:
                     django_logger.error("Unexpected API Error: %s",
                                         request.path,
@@ -128,6 +173,8 @@ def api_method(http_method=None, token_required=True, user_required=True,
                 fault = faults.Fault(message=err.message,
                                      details=err.details,
                                      code=err.status)
+                if fault.code == 401 and user_required:
+                    invalidate_token(request, astakos_url)
                 if fault.code >= 500:
                     django_logger.error("Unexpected AstakosClient Error: %s",
                                         request.path,
@@ -199,7 +246,9 @@ def update_response_headers(request, response):
     if settings.DEBUG or getattr(settings, "TEST", False):
         response["Date"] = format_date_time(time())
 
-    if not response.has_header("Content-Length"):
+    # Streaming responses are sent with chunked transfer encoding
+    if not (response.has_header("Content-Length") or
+            getattr(response, "streaming", False)):
         _base_content_is_iter = getattr(response, '_base_content_is_iter',
                                         None)
         if (_base_content_is_iter is not None and not _base_content_is_iter):
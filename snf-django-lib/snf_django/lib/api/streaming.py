@@ -0,0 +1,132 @@
+# Copyright (C) 2010-2014 GRNET S.A.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Incremental serialization of API list responses.
+
+Instead of building the whole list of items and serializing it to a single
+string, views can pass a generator of items to `json_list` or `xml_list`
+and return the resulting chunks with a `StreamingResponse`. The response
+has no Content-Length, so it is sent with chunked transfer encoding and
+only one buffer of output is kept in memory at a time.
+"""
+
+from django.http import HttpResponse
+from django.utils import simplejson as json
+from django.utils.encoding import smart_str
+
+# Size of the chunks written to the client
+BUFFER_SIZE = 64 * 1024
+
+# Number of rows fetched from the database at a time
+QUERYSET_CHUNK_SIZE = 500
+
+
+def queryset_chunks(queryset, chunk_size=QUERYSET_CHUNK_SIZE, limit=None):
+    """Evaluate a queryset in lists of at most `chunk_size` objects.
+
+    The queryset must be ordered by id. Each chunk is fetched with a separate
+    query for the objects following the last id of the previous chunk, so
+    related objects requested with `prefetch_related` are still fetched in
+    bulk and the database does not have to skip over the previous rows. If
+    `limit` is set, at most `limit` objects are returned in total.
+    """
+    last_id = None
+    while limit is None or limit > 0:
+        size = chunk_size if limit is None else min(chunk_size, limit)
+        if last_id is not None:
+            chunk = list(queryset.filter(id__gt=last_id)[:size])
+        else:
+            chunk = list(queryset[:size])
+        if chunk:
+            yield chunk
+        if len(chunk) < size:
+            return
+        last_id = chunk[-1].id
+        if limit is not None:
+            limit -= size
+
+
+def iterate_queryset(queryset, chunk_size=QUERYSET_CHUNK_SIZE, limit=None):
+    """Iterate over a queryset, fetching `chunk_size` rows at a time."""
+    for chunk in queryset_chunks(queryset, chunk_size, limit):
+        for obj in chunk:
+            yield obj
+
+
+def json_list(items, key=None, default=None):
+    """Serialize an iterable of items to a JSON list, one item at a time.
+
+    If `key` is given, the list is wrapped in an object, as in
+    `{key: [...]}`. The output is identical to that of `json.dumps`.
+    """
+    if key is not None:
+        yield "{%s: " % json.dumps(key)
+    yield "["
+    separator = ""
+    for item in items:
+        yield separator + json.dumps(item, default=default)
+        separator = ", "
+    yield "]"
+    if key is not None:
+        yield "}"
+
+
+def xml_list(items, render, header, footer):
+    """Serialize an iterable of items to XML, one item at a time.
+
+    `render` is called to get the XML of each item and the result is
+    enclosed between `header` and `footer`.
+    """
+    yield header
+    for item in items:
+        yield render(item)
+    yield footer
+
+
+def buffer_chunks(chunks, size=BUFFER_SIZE):
+    """Join small chunks of output into strings of about `size` bytes."""
+    buf = []
+    buf_size = 0
+    for chunk in chunks:
+        chunk = smart_str(chunk)
+        buf.append(chunk)
+        buf_size += len(chunk)
+        if buf_size >= size:
+            yield "".join(buf)
+            buf = []
+            buf_size = 0
+    if buf:
+        yield "".join(buf)
+
+
+class StreamingResponse(HttpResponse):
+    """HTTP response that writes out chunks of content as they come.
+
+    Reading `content` consumes the chunks and keeps the result, so that
+    tests and middleware can still inspect the response.
+    """
+
+    streaming = True
+
+    def __init__(self, chunks, status=200):
+        super(StreamingResponse, self).__init__(buffer_chunks(chunks),
+                                                status=status)
+
+    def _get_content(self):
+        content = super(StreamingResponse, self)._get_content()
+        self._container = [content]
+        return content
+
+    content = property(_get_content, HttpResponse.content.fset)
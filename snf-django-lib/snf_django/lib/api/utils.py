@@ -113,13 +113,49 @@ def filter_modified_since(request, objects):
     since = isoparse(request.GET.get("changes-since"))
     if since:
         modified_objs = objects.filter(updated__gte=since)
-        if not modified_objs:
+        if not modified_objs.exists():
             raise faults.NotModified()
         return modified_objs
     else:
         return objects.filter(deleted=False)
 
 
+def get_limit(request):
+    """Return the 'limit' request parameter, or None if it is not set."""
+    limit = request.GET.get("limit")
+    if limit is not None:
+        try:
+            limit = int(limit)
+        except ValueError:
+            raise faults.BadRequest("Invalid limit parameter.")
+        if limit < 0:
+            raise faults.BadRequest("Invalid limit parameter.")
+    return limit
+
+
+def paginate(request, objects, apply_limit=True):
+    """Paginate DB objects based on 'marker' and 'limit' request parameters.
+
+    The objects must be ordered by their id. Return only the objects that
+    follow the object whose id is 'marker', and at most 'limit' of them.
+    If 'apply_limit' is False, the caller is left to apply the limit, e.g.
+    while fetching the objects in chunks.
+
+    """
+    marker = request.GET.get("marker")
+    if marker is not None:
+        try:
+            marker = int(marker)
+        except ValueError:
+            raise faults.BadRequest("Invalid marker parameter.")
+        objects = objects.filter(id__gt=marker)
+
+    limit = get_limit(request)
+    if apply_limit and limit is not None:
+        objects = objects[:limit]
+    return objects
+
+
 def get_attribute(request, attribute, attr_type=None, required=True):
     value = request.get(attribute, None)
     if required and value is None:
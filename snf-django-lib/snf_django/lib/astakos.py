@@ -14,10 +14,16 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 import logging
+from calendar import timegm
+from hashlib import sha1
+from time import time
+
+from dateutil.parser import parse as date_parse
 
 from astakosclient import AstakosClient
 from astakosclient.errors import (Unauthorized, NoUUID, NoUserName,
                                   AstakosClientException)
+from synnefo.lib.cache import LRUCache
 
 
 def user_for_token(token, astakos_auth_url, logger=None):
@@ -129,3 +135,106 @@ class UserCache(object):
                 self.users[uuid] = name
 
         return self.users[uuid]
+
+
+class TokenCache(object):
+    """token->user_info cache for Astakos authentication.
+
+    Entries are kept in a bounded per-process LRU and, if a Django cache
+    backend is given, in that backend too, so that all workers of a host
+    share them. An entry never outlives the 'expires' field that Astakos
+    returned for the token.
+
+    """
+
+    def __init__(self, timeout, size=1000, cache_backend=None,
+                 key_prefix="snf_token", logger=None):
+        if logger is None:
+            logger = logging.getLogger(__name__)
+        self.logger = logger
+
+        assert(timeout > 0), "timeout must be positive"
+        self.timeout = timeout
+        self.local = LRUCache(maxsize=size, timeout=timeout)
+        self.key_prefix = key_prefix
+
+        self.backend = None
+        if cache_backend is not None:
+            from django.core.cache import get_cache
+            self.backend = get_cache(cache_backend)
+
+        self.hits = 0
+        self.misses = 0
+
+    def get_key(self, token, astakos_auth_url):
+        # Do not use the raw token as a key, since keys of a shared backend
+        # may end up in logs or dumps.
+        digest = sha1("%s:%s" % (astakos_auth_url, token)).hexdigest()
+        return "%s_%s" % (self.key_prefix, digest)
+
+    def get_timeout(self, user_info):
+        """Return how long user_info may be cached, in seconds."""
+        try:
+            expires = user_info["access"]["token"]["expires"]
+            expires = timegm(date_parse(expires).utctimetuple())
+        except (KeyError, TypeError, ValueError):
+            return self.timeout
+        return min(self.timeout, expires - int(time()))
+
+    def get(self, key):
+        user_info = self.local.get(key)
+        if user_info is None and self.backend is not None:
+            user_info = self.backend.get(key)
+            if user_info is not None:
+                timeout = self.get_timeout(user_info)
+                if timeout > 0:
+                    self.local.set(key, user_info, timeout=timeout)
+        if user_info is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return user_info
+
+    def set(self, key, user_info):
+        timeout = self.get_timeout(user_info)
+        if timeout <= 0:
+            return
+        self.local.set(key, user_info, timeout=timeout)
+        if self.backend is not None:
+            self.backend.set(key, user_info, timeout)
+
+    def delete(self, key):
+        self.local.delete(key)
+        if self.backend is not None:
+            self.backend.delete(key)
+
+    def authenticate(self, token, astakos_auth_url, **kwargs):
+        """Return the user_info of a token, asking Astakos on a miss.
+
+        Any extra keyword arguments are passed to AstakosClient. An
+        Unauthorized error from Astakos evicts the token before it is
+        propagated.
+
+        """
+        key = self.get_key(token, astakos_auth_url)
+        user_info = self.get(key)
+        if user_info is not None:
+            return user_info
+
+        astakos = AstakosClient(token, astakos_auth_url, **kwargs)
+        try:
+            user_info = astakos.authenticate()
+        except Unauthorized:
+            self.delete(key)
+            raise
+        self.set(key, user_info)
+        return user_info
+
+    def invalidate(self, token, astakos_auth_url):
+        self.delete(self.get_key(token, astakos_auth_url))
+
+    def stats(self):
+        """Return a dictionary with the cache counters."""
+        return {"hits": self.hits,
+                "misses": self.misses,
+                "local": self.local.stats()}
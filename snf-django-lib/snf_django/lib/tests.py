@@ -0,0 +1,163 @@
+# Copyright (C) 2010-2014 GRNET S.A.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import unittest
+from datetime import datetime, timedelta
+from time import time
+
+from mock import patch, Mock
+
+from django.utils import simplejson as json
+
+from astakosclient.errors import Unauthorized
+from snf_django.lib.astakos import TokenCache
+from snf_django.lib.api import streaming
+
+AUTH_URL = "http://accounts.example.synnefo.org/astakos/identity/v2.0"
+
+
+def user_info(user, expires):
+    return {"access": {
+        "token": {"id": "token", "expires": expires.isoformat() + "+00:00"},
+        "user": {"id": user}}}
+
+
+class TokenCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.cache = TokenCache(60, size=2)
+        self.future = datetime.utcnow() + timedelta(hours=1)
+
+    @patch("astakosclient.AstakosClient.authenticate")
+    def test_hit(self, authenticate):
+        authenticate.return_value = user_info("user1", self.future)
+        for i in range(3):
+            info = self.cache.authenticate("token", AUTH_URL)
+            self.assertEqual(info["access"]["user"]["id"], "user1")
+        self.assertEqual(authenticate.call_count, 1)
+        stats = self.cache.stats()
+        self.assertEqual((stats["hits"], stats["misses"]), (2, 1))
+
+    @patch("astakosclient.AstakosClient.authenticate")
+    def test_expired(self, authenticate):
+        past = datetime.utcnow() - timedelta(hours=1)
+        authenticate.return_value = user_info("user1", past)
+        self.cache.authenticate("token", AUTH_URL)
+        self.cache.authenticate("token", AUTH_URL)
+        self.assertEqual(authenticate.call_count, 2)
+
+    @patch("astakosclient.AstakosClient.authenticate")
+    def test_bounded(self, authenticate):
+        authenticate.return_value = user_info("user1", self.future)
+        for token in ["token1", "token2", "token3", "token1"]:
+            self.cache.authenticate(token, AUTH_URL)
+        self.assertEqual(authenticate.call_count, 4)
+        self.assertEqual(len(self.cache.local), 2)
+
+    @patch("astakosclient.AstakosClient.authenticate")
+    def test_invalidate(self, authenticate):
+        authenticate.return_value = user_info("user1", self.future)
+        self.cache.authenticate("token", AUTH_URL)
+        self.cache.invalidate("token", AUTH_URL)
+        authenticate.side_effect = Unauthorized("Invalid token")
+        self.assertRaises(Unauthorized, self.cache.authenticate,
+                          "token", AUTH_URL)
+
+    def test_backend_hit(self):
+        self.cache.backend = Mock()
+        soon = datetime.utcnow() + timedelta(seconds=10)
+        self.cache.backend.get.return_value = user_info("user1", soon)
+        key = self.cache.get_key("token1", AUTH_URL)
+        self.assertEqual(self.cache.get(key)["access"]["user"]["id"], "user1")
+        self.assertTrue(key in self.cache.local)
+        # The local copy expires with the token, not after the full timeout
+        with patch("synnefo.lib.cache.time") as mock_time:
+            mock_time.return_value = time() + 30
+            self.assertFalse(key in self.cache.local)
+
+        past = datetime.utcnow() - timedelta(hours=1)
+        self.cache.backend.get.return_value = user_info("user2", past)
+        key = self.cache.get_key("token2", AUTH_URL)
+        self.cache.get(key)
+        self.assertFalse(key in self.cache.local)
+
+
+class FakeQuerySet(object):
+    """List of objects ordered by id, recording the queries made."""
+    def __init__(self, ids, queries, min_id=None):
+        self.ids = ids
+        self.queries = queries
+        self.min_id = min_id
+
+    def filter(self, id__gt):
+        return FakeQuerySet([i for i in self.ids if i > id__gt],
+                            self.queries, id__gt)
+
+    def __getitem__(self, key):
+        self.queries.append((self.min_id, key.start, key.stop))
+        return [Object(id=i) for i in self.ids[key]]
+
+
+class Object(object):
+    def __init__(self, id):
+        self.id = id
+
+
+class StreamingTest(unittest.TestCase):
+    def test_queryset_chunks(self):
+        queries = []
+        queryset = FakeQuerySet(range(1, 12), queries)
+        chunks = streaming.queryset_chunks(queryset, chunk_size=5)
+        self.assertEqual([[o.id for o in c] for c in chunks],
+                         [range(1, 6), range(6, 11), [11]])
+        # Every chunk is a keyset query, not an OFFSET
+        self.assertEqual(queries, [(None, None, 5), (5, None, 5),
+                                   (10, None, 5)])
+
+        queries = []
+        queryset = FakeQuerySet(range(1, 12), queries)
+        objs = streaming.iterate_queryset(queryset, chunk_size=5, limit=7)
+        self.assertEqual([o.id for o in objs], range(1, 8))
+        self.assertEqual(queries, [(None, None, 5), (5, None, 2)])
+
+        queries = []
+        queryset = FakeQuerySet(range(1, 11), queries)
+        chunks = streaming.queryset_chunks(queryset, chunk_size=5, limit=10)
+        self.assertEqual(len(list(chunks)), 2)
+        self.assertEqual(len(queries), 2)
+        chunks = streaming.queryset_chunks(queryset, chunk_size=5, limit=0)
+        self.assertEqual(list(chunks), [])
+
+    def test_json_list(self):
+        items = [{"id": 1, "name": u"\u03b1"}, {"id": 2, "name": "b"}]
+        for data in ([], items):
+            chunks = streaming.json_list(iter(data), key="servers")
+            self.assertEqual("".join(chunks), json.dumps({"servers": data}))
+            chunks = streaming.json_list(iter(data))
+            self.assertEqual("".join(chunks), json.dumps(data))
+
+    def test_xml_list(self):
+        chunks = streaming.xml_list(iter([1, 2]), lambda i: "<i>%d</i>" % i,
+                                    "<list>", "</list>")
+        self.assertEqual("".join(chunks), "<list><i>1</i><i>2</i></list>")
+
+    def test_buffer_chunks(self):
+        chunks = list(streaming.buffer_chunks(["ab", "c", "de", "f"], size=3))
+        self.assertEqual(chunks, ["abc", "def"])
+        chunks = list(streaming.buffer_chunks([u"\u03b1", "b"], size=10))
+        self.assertEqual(chunks, ["\xce\xb1b"])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -20,12 +20,13 @@ from django.template.loader import render_to_string
 from django.utils import simplejson as json
 from django.utils.http import parse_etags
 from django.utils.encoding import smart_str
+from django.utils.html import escape
 from django.views.decorators.csrf import csrf_exempt
 
 from astakosclient import AstakosClient
 
 from snf_django.lib import api
-from snf_django.lib.api import faults
+from snf_django.lib.api import faults, streaming
 
 from pithos.api.util import (
     json_encode_decimal, rename_meta_key, format_header_key,
@@ -36,13 +37,15 @@ from pithos.api.util import (
     validate_matching_preconditions, split_container_object_string,
     copy_or_move_object, get_int_parameter, get_content_length,
     get_content_range, socket_read_iterator, SaveToBackendHandler,
-    object_data_response, put_object_block, hashmap_md5, simple_list_response,
+    object_data_response, get_object_read_hashmap, put_object_block,
+    hashmap_md5, simple_list_response,
     api_method, is_uuid, retrieve_uuid, retrieve_uuids,
-    retrieve_displaynames, Checksum, NoChecksum
+    retrieve_displaynames, Checksum, NoChecksum, BlockUploader
 )
 
 from pithos.api.settings import (UPDATE_MD5, TRANSLATE_UUIDS,
-                                 SERVICE_TOKEN, ASTAKOS_AUTH_URL)
+                                 SERVICE_TOKEN, ASTAKOS_AUTH_URL,
+                                 UPLOAD_IN_FLIGHT_BLOCKS)
 
 from pithos.api import settings
 
@@ -731,15 +734,20 @@ def object_list(request, v_account, v_container):
     except ItemNotExists:
         raise faults.ItemNotFound('Container does not exist')
 
+    displaynames = {}
+    if TRANSLATE_UUIDS:
+        modifiers = set(meta['modified_by'] for meta in objects
+                        if meta.get('modified_by'))
+        if modifiers:
+            displaynames = retrieve_displaynames(
+                getattr(request, 'token', None), list(modifiers),
+                return_dict=True)
+
     object_meta = []
     for meta in objects:
-        if TRANSLATE_UUIDS:
-            modified_by = meta.get('modified_by')
-            if modified_by:
-                l = retrieve_displaynames(
-                    getattr(request, 'token', None), [meta['modified_by']])
-                if l is not None and len(l) == 1:
-                    meta['modified_by'] = l[0]
+        modified_by = meta.get('modified_by')
+        if modified_by in displaynames:
+            meta['modified_by'] = displaynames[modified_by]
 
         if len(meta) == 1:
             # Virtual objects/directories.
@@ -770,12 +778,18 @@ def object_list(request, v_account, v_container):
             object_meta.append(printable_header_dict(meta))
 
     if request.serialization == 'xml':
-        data = render_to_string(
-            'objects.xml', {'container': v_container, 'objects': object_meta})
+        header = ('<?xml version="1.0" encoding="UTF-8"?>\n'
+                  '<container name="%s">' % escape(v_container))
+        render = lambda o: render_to_string('object.xml', {'object': o})
+        data = streaming.xml_list(object_meta, render, header,
+                                  '</container>')
     elif request.serialization == 'json':
-        data = json.dumps(object_meta, default=json_encode_decimal)
-    response.status_code = 200
-    response.content = data
+        data = streaming.json_list(object_meta, default=json_encode_decimal)
+    # Keep the container headers set above
+    headers = response.items()
+    response = streaming.StreamingResponse(data, status=200)
+    for header, value in headers:
+        response[header] = value
     return response
 
 
@@ -943,9 +957,13 @@ def _object_read(request, v_account, v_container, v_object):
             raise faults.Forbidden(str(e))
     else:
         try:
-            s, h = request.backend.get_object_hashmap(
-                request.user_uniq, v_account,
-                v_container, v_object, version)
+            if hashmap_reply:
+                s, h = request.backend.get_object_hashmap(
+                    request.user_uniq, v_account,
+                    v_container, v_object, version)
+            else:
+                s, h = get_object_read_hashmap(
+                    request, v_account, v_container, v_object, version, meta)
             sizes.append(s)
             hashmaps.append(h)
         except NotAllowedError:
@@ -1095,16 +1113,17 @@ def object_write(request, v_account, v_container, v_object):
     else:
         etag = request.META.get('HTTP_ETAG')
         checksum_compute = Checksum() if etag or UPDATE_MD5 else NoChecksum()
+        uploader = BlockUploader(request.backend, checksum_compute,
+                                 UPLOAD_IN_FLIGHT_BLOCKS)
         size = 0
-        hashmap = []
         for data in socket_read_iterator(request, content_length,
                                          request.backend.block_size):
             # TODO: Raise 408 (Request Timeout) if this takes too long.
             # TODO: Raise 499 (Client Disconnect) if a length is defined
             #       and we stop before getting this much data.
             size += len(data)
-            hashmap.append(request.backend.put_block(data))
-            checksum_compute.update(data)
+            uploader.put(data)
+        hashmap = uploader.finish()
 
         checksum = checksum_compute.hexdigest()
         if etag and parse_etags(etag)[0].lower() != checksum:
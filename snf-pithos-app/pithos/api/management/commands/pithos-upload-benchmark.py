@@ -0,0 +1,181 @@
+# Copyright (C) 2010-2014 GRNET S.A.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import time
+
+from django.core.management.base import CommandError
+
+from optparse import make_option
+
+from snf_django.management.commands import SynnefoCommand
+from snf_django.management import utils
+
+from pithos.api.settings import BACKEND_BLOCK_SIZE
+from pithos.api.util import socket_read_iterator, BlockAssembler
+
+MB = 1024 * 1024
+
+
+class ChunkedInput(object):
+    """Generate a chunked request body of the given size."""
+
+    def __init__(self, size, chunk_size):
+        self.remaining = size
+        self.chunk = os.urandom(chunk_size)
+        self.left = 0
+
+    def readline(self):
+        n = min(self.remaining, len(self.chunk))
+        self.remaining -= n
+        self.left = n
+        return '%x\r\n' % n
+
+    def read(self, size):
+        if self.left == 0:
+            return '\r\n'[:size]
+        n = min(size, self.left)
+        self.left -= n
+        return self.chunk[:n]
+
+
+class Request(object):
+    def __init__(self, stream):
+        self.environ = {'wsgi.input': stream}
+        self.META = {'SERVER_SOFTWARE': 'pithos-upload-benchmark'}
+
+
+def concat_read_iterator(sock, blocksize):
+    """De-chunk by growing and reslicing a string."""
+    data = ''
+    while True:
+        chunk_length = int(sock.readline(), 16)
+        if chunk_length == 0:
+            if data:
+                yield data
+            return
+        while chunk_length > 0:
+            chunk = sock.read(min(chunk_length, blocksize))
+            chunk_length -= len(chunk)
+            data += chunk
+            if len(data) >= blocksize:
+                ret = data[:blocksize]
+                data = data[blocksize:]
+                yield ret
+        sock.read(2)
+
+
+def assembler_read_iterator(sock, blocksize):
+    """De-chunk with socket_read_iterator."""
+    return socket_read_iterator(Request(sock), -1, blocksize)
+
+
+class ConcatBuffer(object):
+    def __init__(self):
+        self.data = ''
+
+
+def form_concat_read_iterator(sock, blocksize):
+    """Assemble blocks by growing and reslicing a string attribute."""
+    buf = ConcatBuffer()
+    while True:
+        chunk_length = int(sock.readline(), 16)
+        if chunk_length == 0:
+            if buf.data:
+                yield buf.data
+            return
+        buf.data += sock.read(chunk_length)
+        if len(buf.data) >= blocksize:
+            block = buf.data[:blocksize]
+            buf.data = buf.data[blocksize:]
+            yield block
+        sock.read(2)
+
+
+def form_read_iterator(sock, blocksize):
+    """Assemble blocks the way form uploads do."""
+    assembler = BlockAssembler(blocksize)
+    while True:
+        chunk_length = int(sock.readline(), 16)
+        if chunk_length == 0:
+            if len(assembler) > 0:
+                yield assembler.flush()
+            return
+        for block in assembler.feed(sock.read(chunk_length)):
+            yield block
+        sock.read(2)
+
+
+METHODS = (
+    ('concat', concat_read_iterator),
+    ('socket_read_iterator', assembler_read_iterator),
+    ('form-concat', form_concat_read_iterator),
+    ('form', form_read_iterator),
+)
+
+
+class Command(SynnefoCommand):
+    help = """Measure the throughput of assembling blocks from chunked uploads
+
+    No data is stored; the blocks are only assembled in memory and dropped.
+    The 'concat' and 'form-concat' methods are the string concatenation
+    approaches that were used before by chunked and form uploads, kept for
+    comparison."""
+
+    option_list = SynnefoCommand.option_list + (
+        make_option("--size", dest="size", type="int", default=1024,
+                    help="Size of each upload, in MB (default: 1024)"),
+        make_option("--chunk-size", dest="chunk_size", type="int",
+                    default=8192,
+                    help="Size of each chunk of the uploads, in bytes"
+                         " (default: 8192)"),
+        make_option("--block-size", dest="block_size", type="int",
+                    default=BACKEND_BLOCK_SIZE,
+                    help="Size of the assembled blocks, in bytes"
+                         " (default: %d)" % BACKEND_BLOCK_SIZE),
+        make_option("--method", dest="methods", action="append",
+                    choices=[name for name, _ in METHODS],
+                    help="Benchmark only this method (may be repeated)"),
+    )
+
+    def handle(self, *args, **options):
+        if args:
+            raise CommandError("Command doesn't accept any arguments")
+        size = options['size'] * MB
+        chunk_size = options['chunk_size']
+        block_size = options['block_size']
+        if size <= 0 or chunk_size <= 0 or block_size <= 0:
+            raise CommandError("Sizes must be positive")
+
+        selected = options['methods']
+        table = []
+        for name, read_iterator in METHODS:
+            if selected and name not in selected:
+                continue
+            sock = ChunkedInput(size, chunk_size)
+            received = 0
+            start = time.time()
+            for block in read_iterator(sock, block_size):
+                received += len(block)
+            elapsed = time.time() - start
+            if received != size:
+                raise CommandError("%s: received %d bytes instead of %d" %
+                                   (name, received, size))
+            table.append((name, options['size'], "%.2f" % elapsed,
+                          "%.1f" % (size / MB / elapsed if elapsed else 0)))
+
+        headers = ("method", "size (MB)", "time (s)", "throughput (MB/s)")
+        utils.pprint_table(self.stdout, table, headers,
+                           options["output_format"])
@@ -0,0 +1,97 @@
+# Copyright (C) 2010-2014 GRNET S.A.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from django.core.management.base import CommandError
+
+from optparse import make_option
+
+from pithos.api.util import get_backend
+from pithos.backends.modular import (CLUSTER_NORMAL, CLUSTER_HISTORY,
+                                     CLUSTER_DELETED)
+
+from snf_django.management import utils
+from snf_django.management.commands import SynnefoCommand
+
+CLUSTERS = ((CLUSTER_NORMAL, 'normal'),
+            (CLUSTER_HISTORY, 'history'),
+            (CLUSTER_DELETED, 'deleted'))
+
+
+class Command(SynnefoCommand):
+    args = "[<account> ...]"
+    help = """Reconcile the account and container statistics of Pithos DB.
+
+    Recompute the population and size of every account and container from
+    the object versions and compare them with the incrementally maintained
+    statistics, which are used for quota checks. Rebuild the statistics if
+    specified so.
+
+    """
+    option_list = SynnefoCommand.option_list + (
+        make_option("--fix", dest="fix",
+                    default=False,
+                    action="store_true",
+                    help="Rebuild the unsynchronized statistics."),
+    )
+
+    def handle(self, *args, **options):
+        write = self.stdout.write
+        backend = get_backend()
+        try:
+            backend.pre_exec()
+            node = backend.node
+
+            unsynced = []
+            for account, account_node in node.node_accounts(args):
+                nodes = [(account, account_node)]
+                marker = None
+                while True:
+                    containers = backend.list_containers(account, account,
+                                                         marker=marker)
+                    if not containers:
+                        break
+                    nodes.extend(backend._lookup_container(account, c)
+                                 for c in containers)
+                    marker = containers[-1]
+                for path, n in nodes:
+                    computed = node.statistics_compute(n) or {}
+                    for cluster, name in CLUSTERS:
+                        stored = node.statistics_get(n, cluster) or (0, 0, 0)
+                        actual = computed.get(cluster, (0, 0, 0))
+                        if tuple(stored[:2]) == tuple(actual[:2]):
+                            continue
+                        unsynced.append((path, name, stored[0], actual[0],
+                                         stored[1], actual[1]))
+                        if options["fix"]:
+                            node.statistics_update(
+                                n, actual[0] - stored[0],
+                                actual[1] - stored[1],
+                                max(stored[2], actual[2]), cluster)
+
+            if unsynced:
+                headers = ("Path", "Cluster", "Population", "Actual",
+                           "Size", "Actual")
+                utils.pprint_table(self.stdout, unsynced, headers)
+                if options["fix"]:
+                    write("Fixed unsynced statistics\n")
+            else:
+                write("Everything in sync.\n")
+        except BaseException as e:
+            backend.post_exec(False)
+            raise CommandError(e)
+        else:
+            backend.post_exec(True)
+        finally:
+            backend.close()
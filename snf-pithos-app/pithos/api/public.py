@@ -20,10 +20,13 @@ from snf_django.lib import api
 from snf_django.lib.api import faults
 
 from pithos.api.settings import UNSAFE_DOMAIN, UPDATE_MD5
+from pithos.backends.base import (NotAllowedError, ItemNotExists,
+                                  VersionNotExists)
 from pithos.api.util import (put_object_headers, update_manifest_meta,
                              validate_modification_preconditions,
                              validate_matching_preconditions,
-                             object_data_response, api_method,
+                             object_data_response, get_object_read_hashmap,
+                             api_method,
                              split_container_object_string, restrict_to_host)
 
 import logging
@@ -132,11 +135,10 @@ def public_read(request, v_public):
             raise faults.ItemNotFound('Object does not exist')
     else:
         try:
-            s, h = request.backend.get_object_hashmap(
-                request.user_uniq, v_account,
-                v_container, v_object)
+            s, h = get_object_read_hashmap(request, v_account, v_container,
+                                           v_object, None, meta)
             sizes.append(s)
             hashmaps.append(h)
-        except:
+        except (ItemNotExists, VersionNotExists, NotAllowedError):
             raise faults.ItemNotFound('Object does not exist')
     return object_data_response(request, sizes, hashmaps, meta, True)
@@ -112,6 +112,42 @@ BACKEND_DB_MODULE = getattr(
 BACKEND_DB_CONNECTION = getattr(settings, 'PITHOS_BACKEND_DB_CONNECTION',
                                 'sqlite:////tmp/pithos-backend.db')
 
+# Size of the process-wide pool of database connections, shared by all
+# backend instances. Set to 0 to open a dedicated connection for each backend
+# instance instead.
+BACKEND_DB_POOL_SIZE = getattr(settings, 'PITHOS_BACKEND_DB_POOL_SIZE', 0)
+
+# Number of connections that may be opened temporarily beyond the pool size
+BACKEND_DB_POOL_MAX_OVERFLOW = getattr(
+    settings, 'PITHOS_BACKEND_DB_POOL_MAX_OVERFLOW', 10)
+
+# Seconds after which a pooled connection is replaced with a new one
+BACKEND_DB_POOL_RECYCLE = getattr(
+    settings, 'PITHOS_BACKEND_DB_POOL_RECYCLE', 3600)
+
+# Seconds to wait for a connection when the pool is exhausted
+BACKEND_DB_POOL_TIMEOUT = getattr(
+    settings, 'PITHOS_BACKEND_DB_POOL_TIMEOUT', 30)
+
+# Check that a pooled connection is alive before using it
+BACKEND_DB_POOL_PRE_PING = getattr(
+    settings, 'PITHOS_BACKEND_DB_POOL_PRE_PING', True)
+
+# Seconds after which the commissions of the requests are accepted by a
+# background thread of each process, in batches. Set to 0 to accept them
+# at the end of every request instead.
+BACKEND_COMMISSION_RESOLVE_INTERVAL = getattr(
+    settings, 'PITHOS_BACKEND_COMMISSION_RESOLVE_INTERVAL', 0)
+
+# Maximum number of commissions accepted at once
+BACKEND_COMMISSION_RESOLVE_BATCH_SIZE = getattr(
+    settings, 'PITHOS_BACKEND_COMMISSION_RESOLVE_BATCH_SIZE', 100)
+
+# Number of times to retry accepting a batch before leaving it to
+# reconcile-commissions-pithos
+BACKEND_COMMISSION_RESOLVE_RETRIES = getattr(
+    settings, 'PITHOS_BACKEND_COMMISSION_RESOLVE_RETRIES', 5)
+
 # Block storage.
 BACKEND_BLOCK_MODULE = getattr(
     settings, 'PITHOS_BACKEND_BLOCK_MODULE', 'pithos.backends.lib.hashfiler')
@@ -155,6 +191,13 @@ RADOS_POOL_MAPS = getattr(settings, 'PITHOS_RADOS_POOL_MAPS', 'maps')
 # identity management.  WARNING: Setting to True will break your installation.
 TRANSLATE_UUIDS = getattr(settings, 'PITHOS_TRANSLATE_UUIDS', False)
 
+# Maximum number of uuid<->displayname pairs kept in the per process user
+# catalog cache, and for how many seconds each of them is valid
+USER_CATALOG_CACHE_SIZE = getattr(settings, 'PITHOS_USER_CATALOG_CACHE_SIZE',
+                                  10000)
+USER_CATALOG_CACHE_TIMEOUT = getattr(settings,
+                                     'PITHOS_USER_CATALOG_CACHE_TIMEOUT', 300)
+
 # Set how many random bytes to use for constructing the URL
 # of Pithos public files
 PUBLIC_URL_SECURITY = getattr(settings, 'PITHOS_PUBLIC_URL_SECURITY', 16)
@@ -171,6 +214,20 @@ API_LIST_LIMIT = getattr(settings, 'PITHOS_API_LIST_LIMIT', 10000)
 BACKEND_BLOCK_SIZE = getattr(
     settings, 'PITHOS_BACKEND_BLOCK_SIZE', 4 * 1024 * 1024)
 
+# Number of blocks to fetch ahead of the one being sent, when serving object
+# data. Set to 0 to fetch each block only when it is needed.
+READ_AHEAD_BLOCKS = getattr(settings, 'PITHOS_READ_AHEAD_BLOCKS', 0)
+
+# Number of worker threads of each process that perform block I/O in the
+# background
+BLOCK_IO_WORKERS = getattr(settings, 'PITHOS_BLOCK_IO_WORKERS', 8)
+
+# Number of received blocks that may be hashed and stored in the background,
+# while the rest of the upload is being received. Set to 0 to store each block
+# before receiving the next one.
+UPLOAD_IN_FLIGHT_BLOCKS = getattr(settings, 'PITHOS_UPLOAD_IN_FLIGHT_BLOCKS',
+                                  0)
+
 # The backend block hash algorithm
 BACKEND_HASH_ALGORITHM = getattr(
     settings, 'PITHOS_BACKEND_HASH_ALGORITHM', 'sha256')
@@ -193,6 +250,21 @@ BACKEND_ARCHIPELAGO_CONF = getattr(settings, 'PITHOS_BACKEND_ARCHIPELAGO_CONF',
 # Archipelagp xseg pool size
 BACKEND_XSEG_POOL_SIZE = getattr(settings, 'PITHOS_BACKEND_XSEG_POOL_SIZE', 8)
 
+# Maximum number of xseg requests kept in flight by multi-block reads, writes
+# and existence checks. Set to 1 to issue them one after the other.
+BACKEND_XSEG_PIPELINE_DEPTH = getattr(settings,
+                                      'PITHOS_BACKEND_XSEG_PIPELINE_DEPTH', 1)
+
+# Bytes of recently read blocks to cache in the memory of each process.
+# Set to 0 to disable the block cache.
+BACKEND_BLOCK_CACHE_SIZE = getattr(settings, 'PITHOS_BACKEND_BLOCK_CACHE_SIZE',
+                                   0)
+
+# Number of hashes of blocks known to exist in the storage, remembered by each
+# process to avoid checking for them again
+BACKEND_KNOWN_BLOCKS_SIZE = getattr(settings,
+                                    'PITHOS_BACKEND_KNOWN_BLOCKS_SIZE', 65536)
+
 # The maximum interval (in seconds) for consequent backend object map checks
 BACKEND_MAP_CHECK_INTERVAL = getattr(settings,
                                      'PITHOS_BACKEND_MAP_CHECK_INTERVAL', 5)
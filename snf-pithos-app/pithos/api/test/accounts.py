@@ -18,9 +18,20 @@
 
 from pithos.api.test import (PithosAPITest, AssertMappingInvariant,
                              DATE_FORMATS)
+from pithos.api.test.util import get_random_name
+from pithos.api.util import get_backend
+from pithos.backends.modular import (CLUSTER_NORMAL, CLUSTER_HISTORY,
+                                     CLUSTER_DELETED)
+from pithos.backends.lib import sqlalchemy as sqlalchemy_db
 
 from synnefo.lib import join_urls
 
+from django.core.management import call_command
+
+from StringIO import StringIO
+
+import os
+import tempfile
 import time as _time
 import datetime
 
@@ -512,3 +523,177 @@ class AccountPost(PithosAPITest):
             account_groups = self.get_account_groups()
             self.assertTrue('Pithosdev' not in account_groups)
             self.assertTrue('Clientsdev' not in account_groups)
+
+
+class AccountStatistics(PithosAPITest):
+    def get_statistics(self, *paths):
+        """Return the stored and the computed statistics of each path."""
+        backend = get_backend()
+        try:
+            backend.pre_exec()
+            node = backend.node
+            result = []
+            for path in paths:
+                n = node.node_lookup(path)
+                computed = node.statistics_compute(n)
+                stored = {}
+                for cluster in (CLUSTER_NORMAL, CLUSTER_HISTORY,
+                                CLUSTER_DELETED):
+                    s = node.statistics_get(n, cluster) or (0, 0, 0)
+                    stored[cluster] = tuple(s[:2])
+                    c = computed.get(cluster, (0, 0, 0))
+                    computed[cluster] = tuple(c[:2])
+                result.append((stored, computed))
+            return result
+        finally:
+            backend.post_exec(False)
+            backend.close()
+
+    def test_statistics_compute(self):
+        cname = self.create_container()[0]
+        path = '/'.join((self.user, cname))
+        stored, computed = self.get_statistics(path)[0]
+        self.assertEqual(computed[CLUSTER_NORMAL], (0, 0))
+
+        sizes = [len(self.upload_object(cname)[1]) for i in range(3)]
+        oname = self.create_folder(cname)[0]
+        sizes.append(len(self.upload_object(
+            cname, '%s/%s' % (oname, get_random_name()))[1]))
+        stored, computed = self.get_statistics(path)[0]
+        self.assertEqual(computed[CLUSTER_NORMAL][1], sum(sizes))
+        self.assertEqual(computed[CLUSTER_NORMAL][0], len(sizes) + 1)
+        self.assertEqual(stored, computed)
+
+    def test_account_bytes(self):
+        c1 = self.create_container()[0]
+        c2 = self.create_container()[0]
+        paths = [self.user, '/'.join((self.user, c1)),
+                 '/'.join((self.user, c2))]
+        before = self.get_statistics(self.user)[0]
+
+        o1, d1, r = self.upload_object(c1)
+        o2, d2, r = self.upload_object(c2)
+        url = join_urls(self.pithos_path, self.user, c1, o1)
+        r = self.copy(url, HTTP_DESTINATION='/%s/%s' % (c2, o1))
+        self.assertEqual(r.status_code, 201)
+        self.delete_object(c2, o2)
+
+        statistics = self.get_statistics(*paths)
+        account, containers = statistics[0], statistics[1:]
+
+        # Object bytes are accounted for in the account statistics.
+        deltas = []
+        for b, a in zip(before, account):
+            deltas.append(dict((k, (a[k][0] - b[k][0], a[k][1] - b[k][1]))
+                               for k in a))
+        stored, computed = deltas
+        self.assertEqual(stored, computed)
+        self.assertEqual(stored[CLUSTER_NORMAL], (2, 2 * len(d1)))
+
+        for stored, computed in containers:
+            self.assertEqual(stored, computed)
+        self.assertEqual(containers[0][0][CLUSTER_NORMAL], (1, len(d1)))
+        self.assertEqual(containers[1][0][CLUSTER_NORMAL], (1, len(d1)))
+
+    def test_reconcile_statistics(self):
+        cname = self.create_container()[0]
+        data = self.upload_object(cname)[1]
+
+        # Drop the object bytes from the account statistics.
+        backend = get_backend()
+        try:
+            backend.pre_exec()
+            node = backend.node
+            n = node.node_lookup(self.user)
+            mtime = node.statistics_get(n, CLUSTER_NORMAL)[2]
+            node.statistics_update(n, 0, -len(data), mtime, CLUSTER_NORMAL)
+        except:
+            backend.post_exec(False)
+            raise
+        else:
+            backend.post_exec(True)
+        finally:
+            backend.close()
+        stored, computed = self.get_statistics(self.user)[0]
+        self.assertNotEqual(stored, computed)
+
+        out = StringIO()
+        call_command('reconcile-statistics-pithos', self.user, stdout=out)
+        self.assertTrue(self.user in out.getvalue())
+        self.assertEqual(self.get_statistics(self.user)[0][0], stored)
+
+        out = StringIO()
+        call_command('reconcile-statistics-pithos', self.user, fix=True,
+                     stdout=out)
+        self.assertTrue('Fixed unsynced statistics' in out.getvalue())
+        stored, computed = self.get_statistics(self.user)[0]
+        self.assertEqual(stored, computed)
+
+        out = StringIO()
+        call_command('reconcile-statistics-pithos', self.user, stdout=out)
+        self.assertEqual(out.getvalue(), 'Everything in sync.\n')
+
+    def test_batch_statistics(self):
+        results = []
+        for batch_statistics in (False, True):
+            fd, name = tempfile.mkstemp()
+            os.close(fd)
+            wrapper = sqlalchemy_db.DBWrapper('sqlite:///%s' % name)
+            try:
+                node = sqlalchemy_db.Node(wrapper=wrapper,
+                                          batch_statistics=batch_statistics)
+                wrapper.execute()
+                account = node.node_create(sqlalchemy_db.ROOTNODE, 'account')
+                container = node.node_create(account, 'account/container')
+                node.version_create(container, None, 0, '', None, 'user',
+                                    'uuid', '', CLUSTER_NORMAL,
+                                    update_statistics_ancestors_depth=1)
+                for i in range(10):
+                    obj = node.node_create(container, 'account/container/%d'
+                                           % i)
+                    serial, mtime = node.version_create(
+                        obj, 'hash', 100 * i, '', None, 'user', 'uuid', '',
+                        i % 3, update_statistics_ancestors_depth=2)
+                node.statistics_update_ancestors(obj, -1, -900, mtime, 0, 2)
+
+                keys = [(n, c) for n in (account, container)
+                        for c in (CLUSTER_NORMAL, CLUSTER_HISTORY,
+                                  CLUSTER_DELETED)]
+                # Pending changes are included in the statistics
+                pending = [tuple(node.statistics_get(*k)[:2]) for k in keys]
+                node.statistics_flush()
+                self.assertEqual(node._statistics_deltas, {})
+                wrapper.commit()
+                wrapper.execute()
+                flushed = [tuple(node.statistics_get(*k)[:2]) for k in keys]
+                wrapper.rollback()
+                self.assertEqual(pending, flushed)
+                results.append(flushed)
+            finally:
+                wrapper.close()
+                os.remove(name)
+        # Flushed statistics are the same as those written per call
+        self.assertEqual(results[0], results[1])
+
+    def test_batch_statistics_rollback(self):
+        cname = self.create_container()[0]
+        backend = get_backend()
+        try:
+            backend.pre_exec()
+            node = backend.node
+            account = node.node_lookup(self.user)
+            container = node.node_lookup('/'.join((self.user, cname)))
+            before = tuple(node.statistics_get(account, CLUSTER_NORMAL)[:2])
+            node.statistics_update_ancestors(container, 1, 1000, _time.time(),
+                                             CLUSTER_NORMAL, 1)
+            after = tuple(node.statistics_get(account, CLUSTER_NORMAL)[:2])
+            self.assertEqual(after, (before[0] + 1, before[1] + 1000))
+            backend.post_exec(False)
+            self.assertEqual(getattr(node, '_statistics_deltas', {}), {})
+
+            backend.pre_exec()
+            after = tuple(node.statistics_get(account, CLUSTER_NORMAL)[:2])
+            self.assertEqual(after, before)
+            backend.post_exec(False)
+        finally:
+            backend.close()
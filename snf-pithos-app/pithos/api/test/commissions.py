@@ -0,0 +1,118 @@
+#!/usr/bin/env python
+#coding=utf8
+
+# Copyright (C) 2010-2014 GRNET S.A.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from mock import Mock, patch
+
+from pithos.api.test import PithosAPITest, pithos_settings
+from pithos.api.util import get_backend
+from pithos.backends.modular import CommissionResolver
+
+import time
+import random
+
+
+class TestCommissionResolver(PithosAPITest):
+    def setUp(self):
+        PithosAPITest.setUp(self)
+        self.backend = get_backend()
+        self.db_module = self.backend.db_module
+        self.connection = pithos_settings.BACKEND_DB_CONNECTION
+        self.serials = random.sample(xrange(10 ** 9, 2 * 10 ** 9), 3)
+
+    def tearDown(self):
+        self.backend.pre_exec()
+        self.backend.commission_serials.delete_many(self.serials)
+        self.backend.post_exec(True)
+        self.backend.close()
+        PithosAPITest.tearDown(self)
+
+    def lookup(self):
+        """Return the serials registered, as seen by a new connection."""
+        wrapper = self.db_module.DBWrapper(self.connection)
+        try:
+            serials = self.db_module.QuotaholderSerial(wrapper=wrapper)
+            return sorted(serials.lookup(self.serials))
+        finally:
+            wrapper.close()
+
+    def register(self):
+        self.backend.pre_exec()
+        self.backend.commission_serials.insert_many(self.serials)
+        self.backend.post_exec(True)
+
+    def get_resolver(self, astakosclient, **params):
+        params.setdefault('interval', 60)
+        return CommissionResolver(astakosclient, self.db_module,
+                                  self.connection, **params)
+
+    def test_post_exec_registers_serials(self):
+        registered = []
+        resolver = Mock()
+        resolver.add.side_effect = lambda serials: registered.extend(
+            self.lookup())
+        with patch.object(self.backend, 'commission_resolver', resolver):
+            self.backend.pre_exec()
+            self.backend.serials = list(self.serials)
+            self.backend.post_exec(True)
+        resolver.add.assert_called_once_with(self.serials)
+        # The serials are committed before the resolver gets them
+        self.assertEqual(registered, sorted(self.serials))
+
+    def test_resolve(self):
+        self.register()
+        astakosclient = Mock()
+        astakosclient.resolve_commissions.return_value = {
+            'accepted': self.serials[:2], 'rejected': [],
+            'failed': [(self.serials[2], 'error')]}
+        resolver = self.get_resolver(astakosclient, batch_size=3)
+        resolver.add(self.serials)
+        for i in range(100):
+            if len(self.lookup()) < len(self.serials):
+                break
+            time.sleep(0.1)
+        astakosclient.resolve_commissions.assert_called_once_with(
+            accept_serials=self.serials, reject_serials=[])
+        # Only the accepted serials are deleted
+        self.assertEqual(self.lookup(), [self.serials[2]])
+
+    @patch('pithos.backends.modular.sleep')
+    def test_resolve_failure(self, sleep):
+        self.register()
+        astakosclient = Mock()
+        astakosclient.resolve_commissions.side_effect = Exception('error')
+        resolver = self.get_resolver(astakosclient, retries=2)
+        resolver._resolve(self.serials)
+        self.assertEqual(astakosclient.resolve_commissions.call_count, 3)
+        self.assertEqual(sleep.call_count, 2)
+        # The serials are left for reconcile-commissions-pithos
+        self.assertEqual(self.lookup(), sorted(self.serials))
+
+    def test_post_exec_failure_rejects(self):
+        resolver = Mock()
+        astakosclient = Mock()
+        astakosclient.resolve_commissions.return_value = {
+            'accepted': [], 'rejected': self.serials, 'failed': []}
+        with patch.object(self.backend, 'commission_resolver', resolver):
+            with patch.object(self.backend, 'astakosclient', astakosclient):
+                self.backend.pre_exec()
+                self.backend.serials = list(self.serials)
+                self.backend.post_exec(False)
+        astakosclient.resolve_commissions.assert_called_once_with(
+            accept_serials=[], reject_serials=self.serials)
+        self.assertFalse(resolver.add.called)
+        self.assertEqual(self.lookup(), [])
@@ -29,8 +29,11 @@ from xml.dom import minidom
 from urllib import quote
 import time as _time
 
+import os
+import sys
 import random
 import datetime
+import tempfile
 
 
 class ContainerHead(PithosAPITest):
@@ -395,6 +398,54 @@ class ContainerGet(PithosAPITest):
         self.assertTrue(folder in objects)
         self.assertTrue(descendant not in objects)
 
+    def test_list_public_with_limit_marker(self):
+        cname = self.cnames[0]
+        onames = sorted(self.objects[cname].keys())[:4]
+        for o in onames:
+            url = join_urls(self.pithos_path, self.user, cname, o)
+            r = self.post(url, content_type='', HTTP_X_OBJECT_PUBLIC='true')
+            self.assertEqual(r.status_code, 202)
+
+        url = join_urls(self.pithos_path, self.user, cname)
+        r = self.get('%s?public=&limit=2&marker=%s' % (url, quote(onames[0])))
+        self.assertEqual(r.status_code, 200)
+        objects = r.content.split('\n')
+        if '' in objects:
+            objects.remove('')
+        self.assertEqual(objects, onames[1:3])
+
+    def test_public_list_db_modules(self):
+        paths = ['user/c/d', 'user/c/a', 'user/c/b/x', 'user/c/b',
+                 'user/c%/z', 'user/d/a']
+        for module, connection in (
+                ('pithos.backends.lib.sqlalchemy', 'sqlite:///%s'),
+                ('pithos.backends.lib.sqlite', '%s')):
+            __import__(module)
+            db_module = sys.modules[module]
+            fd, name = tempfile.mkstemp()
+            os.close(fd)
+            wrapper = db_module.DBWrapper(connection % name)
+            try:
+                permissions = db_module.Permissions(wrapper=wrapper)
+                wrapper.execute()
+                for path in paths:
+                    permissions.public_set(path, 8, 'abcdefgh')
+
+                def public_list(*args):
+                    return [p for p, url in permissions.public_list(*args)]
+
+                self.assertEqual(sorted(public_list('user/c')),
+                                 sorted(paths[:5]))
+                self.assertEqual(public_list('user/c/', None, 1),
+                                 ['user/c/a'])
+                self.assertEqual(public_list('user/c/', 'user/c/a', 2),
+                                 ['user/c/b', 'user/c/b/x'])
+                self.assertEqual(public_list('user/c/', 'user/c/d', 2), [])
+                wrapper.rollback()
+            finally:
+                wrapper.close()
+                os.remove(name)
+
     def test_list_shared_public(self):
         cname = self.cnames[0]
         container_url = join_urls(self.pithos_path, self.user, cname)
@@ -616,6 +667,31 @@ class ContainerGet(PithosAPITest):
             objects.remove('')
         self.assertEquals(['photos/me.jpg'], objects)
 
+    def test_list_folders_with_adjacent_object(self):
+        # 'photos0' sorts right after every path under 'photos/'
+        self.upload_object('apples', 'photos0')
+        url = join_urls(self.pithos_path, self.user, 'apples')
+        r = self.get('%s?delimiter=/' % url)
+        self.assertEqual(r.status_code, 200)
+        objects = r.content.split('\n')
+        if '' in objects:
+            objects.remove('')
+        self.assertEquals(['photos/', 'photos0'], objects)
+
+    def test_list_path_after_many_folders(self):
+        # the folders that sort before the objects exceed the limit
+        self.create_container('dirs')
+        for o in ['dir/a/1', 'dir/b/1', 'dir/c/1', 'dir/d', 'dir/e',
+                  'dir/f/1']:
+            self.upload_object('dirs', o)
+        url = join_urls(self.pithos_path, self.user, 'dirs')
+        r = self.get('%s?path=dir&limit=2' % url)
+        self.assertEqual(r.status_code, 200)
+        objects = r.content.split('\n')
+        if '' in objects:
+            objects.remove('')
+        self.assertEquals(['dir/d', 'dir/e'], objects)
+
     def test_extended_list_json(self):
         url = join_urls(self.pithos_path, self.user, 'apples')
         params = {'format': 'json', 'limit': 2, 'prefix': 'photos/animals',
@@ -628,6 +704,8 @@ class ContainerGet(PithosAPITest):
             self.fail('json format expected')
         self.assertEqual(objects[0]['subdir'], 'photos/animals/cats/')
         self.assertEqual(objects[1]['subdir'], 'photos/animals/dogs/')
+        self.assertTrue('X-Container-Object-Count' in r)
+        self.assertTrue('X-Container-Block-Size' in r)
 
     def test_extended_list_xml(self):
         url = join_urls(self.pithos_path, self.user, 'apples')
@@ -13,7 +13,10 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+from mock import patch
+
 from pithos.api.test import PithosAPITest
+from pithos.api.util import user_catalog
 
 from synnefo.lib import join_urls
 
@@ -212,3 +215,26 @@ class ListSharing(PithosAPITest):
         shared_objects = [i.get('name', i.get('subdir')) for i in
                           json.loads(r.content)]
         self.assertEqual(shared_objects, ['f1/f2/f3/obj'])
+
+
+class ListTranslateUUIDs(PithosAPITest):
+    def tearDown(self):
+        user_catalog.clear()
+        super(ListTranslateUUIDs, self).tearDown()
+
+    @patch('pithos.api.functions.TRANSLATE_UUIDS', True)
+    @patch('astakosclient.AstakosClient.get_usernames')
+    def test_list_displaynames(self, get_usernames):
+        get_usernames.return_value = {self.user: 'User Name'}
+        cname = self.create_container()[0]
+        for i in range(3):
+            self.upload_object(cname)
+
+        for i in range(2):
+            objects = self.list_objects(cname)
+            self.assertEqual(len(objects), 3)
+            self.assertEqual(set(o['x_object_modified_by'] for o in objects),
+                             set(['User Name']))
+
+        # one bulk lookup, served from the user catalog cache afterwards
+        get_usernames.assert_called_once_with([self.user])
@@ -19,6 +19,7 @@
 from collections import defaultdict
 from urllib import quote, unquote
 from functools import partial
+from mock import patch
 
 from pithos.api.test import (PithosAPITest, pithos_settings,
                              AssertMappingInvariant, AssertUUidInvariant,
@@ -318,6 +319,27 @@ class ObjectGet(PithosAPITest):
             self.assertEquals(fdata, sdata)
             i += 1
 
+    @patch('pithos.api.util.READ_AHEAD_BLOCKS', 2)
+    def test_read_ahead(self):
+        cname = self.containers[0]
+        length = 5 * TEST_BLOCK_SIZE + TEST_BLOCK_SIZE / 2
+        oname, odata = self.upload_object(cname, length=length)[:-1]
+        url = join_urls(self.pithos_path, self.user, cname, oname)
+
+        r = self.get(url)
+        self.assertEqual(r.status_code, 200)
+        self.assertEqual(r.content, odata)
+
+        r = self.get(url, HTTP_RANGE='bytes=1000-4500')
+        self.assertEqual(r.status_code, 206)
+        self.assertEqual(r.content, odata[1000:4501])
+
+        # adjacent ranges within the same block
+        r = self.get(url, HTTP_RANGE='bytes=0-9,10-19,-100')
+        self.assertEqual(r.status_code, 206)
+        for data in (odata[0:10], odata[10:20], odata[-100:]):
+            self.assertTrue(data in r.content)
+
     def test_multiple_range_not_satisfiable(self):
         # perform get with multiple range
         cname = self.containers[0]
@@ -651,6 +673,28 @@ class ObjectPut(PithosAPITest):
         r = self.put(url, data=data, HTTP_ETAG='123')
         self.assertEqual(r.status_code, 422)
 
+    @patch('pithos.api.functions.UPLOAD_IN_FLIGHT_BLOCKS', 2)
+    def test_upload_in_flight_blocks(self):
+        cname = self.container
+        oname = get_random_name()
+        block_size = TEST_BLOCK_SIZE
+        data = get_random_data(5 * block_size + block_size / 2)
+        url = join_urls(self.pithos_path, self.user, cname, oname)
+        r = self.put(url, data=data, HTTP_ETAG=md5_hash(data))
+        self.assertEqual(r.status_code, 201)
+
+        r = self.get('%s?hashmap=&format=json' % url)
+        self.assertEqual(r.status_code, 200)
+        hashes = json.loads(r.content)['hashes']
+        self.assertEqual(len(hashes), 6)
+        for i, h in enumerate(hashes):
+            block = data[i * block_size:(i + 1) * block_size]
+            self.assertEqual(h, merkle(block))
+
+        r = self.get(url)
+        self.assertEqual(r.status_code, 200)
+        self.assertEqual(r.content, data)
+
     def test_upload_if_none_match(self):
         cname = self.container
         oname = get_random_name()
@@ -18,6 +18,7 @@
 
 from pithos.api.test import PithosAPITest
 from pithos.api.test.util import get_random_data, get_random_name
+from pithos.api.util import get_backend
 
 from synnefo.lib import join_urls
 
@@ -326,6 +327,33 @@ class TestPermissions(PithosAPITest):
         r = self.delete(url, user='chuck')
         self.assertEqual(r.status_code, 403)
 
+    def test_access_get_bulk(self):
+        url = join_urls(self.pithos_path, self.user, self.container)
+        shared = {self.object: 'read=*',
+                  self.object + '/a': 'read=alice;write=bob',
+                  self.object + 'a': 'write=%s:group1' % self.user}
+        for name, sharing in shared.items():
+            r = self.post(join_urls(url, name), content_type='',
+                          HTTP_CONTENT_RANGE='bytes */*',
+                          HTTP_X_OBJECT_SHARING=sharing)
+            self.assertEqual(r.status_code, 202)
+
+        names = shared.keys() + [self.object + '/', self.object + 'a/']
+        paths = ['/'.join((self.user, self.container, n)) for n in names]
+        backend = get_backend()
+        try:
+            backend.pre_exec()
+            permissions = backend.permissions
+            bulk = permissions.access_get_bulk(paths)
+            self.assertEqual(len(bulk), len(shared))
+            for path in paths:
+                self.assertEqual(bulk.get(path, {}),
+                                 permissions.access_get(path))
+            self.assertEqual(permissions.access_get_bulk([]), {})
+        finally:
+            backend.post_exec(False)
+            backend.close()
+
     def test_multiple_inheritance(self):
         cname = self.container
         folder = self.create_folder(cname, HTTP_X_OBJECT_SHARING='write=*')[0]
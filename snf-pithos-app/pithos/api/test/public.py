@@ -326,6 +326,21 @@ class TestPublic(PithosAPITest):
         r = self.get(public_url, HTTP_RANGE='bytes=0-%s' % offset)
         self.assertEqual(r.status_code, 416)
 
+    def test_public_get_range_beyond_size(self):
+        cname = self.create_container()[0]
+        oname, odata = self.upload_object(cname, length=512)[:-1]
+
+        # set public
+        url = join_urls(self.pithos_path, self.user, cname, oname)
+        r = self.post(url, content_type='', HTTP_X_OBJECT_PUBLIC='true')
+        self.assertEqual(r.status_code, 202)
+
+        info = self.get_object_info(cname, oname)
+        public_url = info['X-Object-Public']
+
+        r = self.get(public_url, HTTP_RANGE='bytes=%s-' % (len(odata) + 10))
+        self.assertEqual(r.status_code, 416)
+
     def test_public_multiple_range(self):
         cname = self.create_container()[0]
         oname, odata = self.upload_object(cname)[:-1]
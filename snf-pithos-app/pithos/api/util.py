@@ -15,6 +15,9 @@
 
 from functools import wraps
 from datetime import datetime
+from collections import deque
+from multiprocessing.pool import ThreadPool
+from threading import Condition
 from urllib import quote, unquote, urlencode
 from urlparse import urlunsplit, urlsplit, parse_qsl
 
@@ -34,6 +37,14 @@ from snf_django.lib import api
 from snf_django.lib.api import faults, utils
 
 from pithos.api.settings import (BACKEND_DB_MODULE, BACKEND_DB_CONNECTION,
+                                 BACKEND_DB_POOL_SIZE,
+                                 BACKEND_DB_POOL_MAX_OVERFLOW,
+                                 BACKEND_DB_POOL_RECYCLE,
+                                 BACKEND_DB_POOL_TIMEOUT,
+                                 BACKEND_DB_POOL_PRE_PING,
+                                 BACKEND_COMMISSION_RESOLVE_INTERVAL,
+                                 BACKEND_COMMISSION_RESOLVE_BATCH_SIZE,
+                                 BACKEND_COMMISSION_RESOLVE_RETRIES,
                                  BACKEND_BLOCK_MODULE, BACKEND_BLOCK_PATH,
                                  BACKEND_BLOCK_UMASK,
                                  BACKEND_QUEUE_MODULE, BACKEND_QUEUE_HOSTS,
@@ -48,9 +59,16 @@ from pithos.api.settings import (BACKEND_DB_MODULE, BACKEND_DB_CONNECTION,
                                  BACKEND_BLOCK_SIZE, BACKEND_HASH_ALGORITHM,
                                  BACKEND_ARCHIPELAGO_CONF,
                                  BACKEND_XSEG_POOL_SIZE,
+                                 BACKEND_XSEG_PIPELINE_DEPTH,
+                                 BACKEND_BLOCK_CACHE_SIZE,
+                                 BACKEND_KNOWN_BLOCKS_SIZE,
                                  BACKEND_MAP_CHECK_INTERVAL,
                                  RADOS_STORAGE, RADOS_POOL_BLOCKS,
                                  RADOS_POOL_MAPS, TRANSLATE_UUIDS,
+                                 USER_CATALOG_CACHE_SIZE,
+                                 USER_CATALOG_CACHE_TIMEOUT,
+                                 READ_AHEAD_BLOCKS, BLOCK_IO_WORKERS,
+                                 UPLOAD_IN_FLIGHT_BLOCKS,
                                  PUBLIC_URL_SECURITY, PUBLIC_URL_ALPHABET,
                                  BASE_HOST, UPDATE_MD5, VIEW_PREFIX,
                                  OAUTH2_CLIENT_CREDENTIALS, UNSAFE_DOMAIN)
@@ -61,10 +79,11 @@ from pithos.backends.base import (NotAllowedError, QuotaError, ItemNotExists,
                                   VersionNotExists, IllegalOperationError)
 
 from synnefo.lib import join_urls
+from synnefo.lib.cache import LRUCache
 from synnefo.util import text
 
 from astakosclient import AstakosClient
-from astakosclient.errors import NoUserName, NoUUID, AstakosClientException
+from astakosclient.errors import AstakosClientException
 
 import logging
 import re
@@ -300,26 +319,73 @@ def is_uuid(str):
 # USER CATALOG utilities #
 ##########################
 
+# Process-wide uuid<->displayname cache. Keys are ('uuid', uuid) and
+# ('name', displayname) tuples.
+user_catalog = LRUCache(maxsize=USER_CATALOG_CACHE_SIZE,
+                        timeout=USER_CATALOG_CACHE_TIMEOUT)
+
+
+def _get_catalog_client(token):
+    return AstakosClient(SERVICE_TOKEN or token, ASTAKOS_AUTH_URL,
+                         retry=2, use_pool=True, logger=logger)
+
+
+def _update_user_catalog(catalog, kind):
+    """Cache the pairs of an Astakos uuid->name or name->uuid catalog."""
+    other = 'name' if kind == 'uuid' else 'uuid'
+    for k, v in catalog.iteritems():
+        user_catalog.set((kind, k), v)
+        user_catalog.set((other, v), k)
+
+
+def _lookup_user_catalog(token, keys, kind):
+    """Resolve keys through the user catalog cache.
+
+    All keys missing from the cache are resolved with a single bulk
+    request to Astakos.
+
+    """
+    catalog = {}
+    missing = []
+    for k in set(keys):
+        v = user_catalog.get((kind, k))
+        if v is None:
+            missing.append(k)
+        else:
+            catalog[k] = v
+    if not missing:
+        return catalog
+
+    astakos = _get_catalog_client(token)
+    if kind == 'uuid':
+        if SERVICE_TOKEN:
+            fetched = astakos.service_get_usernames(missing)
+        else:
+            fetched = astakos.get_usernames(missing)
+    else:
+        if SERVICE_TOKEN:
+            fetched = astakos.service_get_uuids(missing)
+        else:
+            fetched = astakos.get_uuids(missing)
+    fetched = fetched or {}
+    _update_user_catalog(fetched, kind)
+    catalog.update(fetched)
+    return catalog
+
+
 def retrieve_displayname(token, uuid, fail_silently=True):
-    astakos = AstakosClient(token, ASTAKOS_AUTH_URL,
-                            retry=2, use_pool=True,
-                            logger=logger)
-    try:
-        displayname = astakos.get_username(uuid)
-    except NoUserName:
+    catalog = _lookup_user_catalog(token, [uuid], 'uuid')
+    if uuid not in catalog:
         if not fail_silently:
             raise ItemNotExists(uuid)
         else:
             # just return the uuid
             return uuid
-    return displayname
+    return catalog[uuid]
 
 
 def retrieve_displaynames(token, uuids, return_dict=False, fail_silently=True):
-    astakos = AstakosClient(token, ASTAKOS_AUTH_URL,
-                            retry=2, use_pool=True,
-                            logger=logger)
-    catalog = astakos.get_usernames(uuids) or {}
+    catalog = _lookup_user_catalog(token, uuids, 'uuid')
     missing = list(set(uuids) - set(catalog))
     if missing and not fail_silently:
         raise ItemNotExists('Unknown displaynames: %s' % ', '.join(missing))
@@ -330,21 +396,14 @@ def retrieve_uuid(token, displayname):
     if is_uuid(displayname):
         return displayname
 
-    astakos = AstakosClient(token, ASTAKOS_AUTH_URL,
-                            retry=2, use_pool=True,
-                            logger=logger)
-    try:
-        uuid = astakos.get_uuid(displayname)
-    except NoUUID:
+    catalog = _lookup_user_catalog(token, [displayname], 'name')
+    if displayname not in catalog:
         raise ItemNotExists(displayname)
-    return uuid
+    return catalog[displayname]
 
 
 def retrieve_uuids(token, displaynames, return_dict=False, fail_silently=True):
-    astakos = AstakosClient(token, ASTAKOS_AUTH_URL,
-                            retry=2, use_pool=True,
-                            logger=logger)
-    catalog = astakos.get_uuids(displaynames) or {}
+    catalog = _lookup_user_catalog(token, displaynames, 'name')
     missing = list(set(displaynames) - set(catalog))
     if missing and not fail_silently:
         raise ItemNotExists('Unknown uuids: %s' % ', '.join(missing))
@@ -728,7 +787,7 @@ def socket_read_iterator(request, length=0, blocksize=4096):
             raise faults.BadRequest('Maximum size is reached')
 
         # Long version (do the dechunking).
-        data = ''
+        assembler = BlockAssembler(blocksize)
         while length < MAX_UPLOAD_SIZE:
             # Get chunk size.
             if hasattr(sock, 'readline'):
@@ -748,8 +807,8 @@ def socket_read_iterator(request, length=0, blocksize=4096):
                                  # TODO: Change to something more appropriate.
             # Check if done.
             if chunk_length == 0:
-                if len(data) > 0:
-                    yield data
+                if len(assembler) > 0:
+                    yield assembler.flush()
                 return
             # Get the actual data.
             while chunk_length > 0:
@@ -757,11 +816,8 @@ def socket_read_iterator(request, length=0, blocksize=4096):
                 chunk_length -= len(chunk)
                 if length > 0:
                     length += len(chunk)
-                data += chunk
-                if len(data) >= blocksize:
-                    ret = data[:blocksize]
-                    data = data[blocksize:]
-                    yield ret
+                for block in assembler.feed(chunk):
+                    yield block
             sock.read(2)  # CRLF
         raise faults.BadRequest('Maximum size is reached')
     else:
@@ -775,6 +831,55 @@ def socket_read_iterator(request, length=0, blocksize=4096):
             yield data
 
 
+class BlockAssembler(object):
+    """Assemble blocks of blocksize bytes out of data received in pieces.
+
+    Data is copied into a preallocated buffer, instead of growing and
+    reslicing a string, and each block is copied out once, when complete.
+    """
+
+    def __init__(self, blocksize):
+        self.blocksize = blocksize
+        self.buffer = bytearray(blocksize)
+        self.view = memoryview(self.buffer)
+        self.filled = 0
+
+    def __len__(self):
+        return self.filled
+
+    def feed(self, data):
+        """Add data and return the list of the blocks completed by it."""
+        blocks = []
+        offset = 0
+        size = len(data)
+        source = None
+        while offset < size:
+            if self.filled == 0 and size - offset >= self.blocksize:
+                # A whole block is available, bypass the buffer.
+                blocks.append(data[offset:offset + self.blocksize])
+                offset += self.blocksize
+                continue
+            n = min(size - offset, self.blocksize - self.filled)
+            if n == size:
+                self.view[self.filled:self.filled + n] = data
+            else:
+                if source is None:
+                    source = memoryview(data)
+                self.view[self.filled:self.filled + n] = \
+                    source[offset:offset + n]
+            self.filled += n
+            offset += n
+            if self.filled == self.blocksize:
+                blocks.append(self.flush())
+        return blocks
+
+    def flush(self):
+        """Return the data buffered so far and empty the buffer."""
+        block = self.view[:self.filled].tobytes()
+        self.filled = 0
+        return block
+
+
 class SaveToBackendHandler(FileUploadHandler):
     """Handle a file from an HTML form the django way."""
 
@@ -782,44 +887,141 @@ class SaveToBackendHandler(FileUploadHandler):
         super(SaveToBackendHandler, self).__init__(request)
         self.backend = request.backend
 
-    def put_data(self, length):
-        if len(self.data) >= length:
-            block = self.data[:length]
-            self.file.hashmap.append(self.backend.put_block(block))
-            self.checksum_compute.update(block)
-            self.data = self.data[length:]
-
     def new_file(self, field_name, file_name, content_type,
                  content_length, charset=None):
         self.checksum_compute = NoChecksum() if not UPDATE_MD5 else Checksum()
-        self.data = ''
+        self.uploader = BlockUploader(self.backend, self.checksum_compute,
+                                      UPLOAD_IN_FLIGHT_BLOCKS)
+        self.assembler = BlockAssembler(self.backend.block_size)
         self.file = UploadedFile(
             name=file_name, content_type=content_type, charset=charset)
         self.file.size = 0
         self.file.hashmap = []
 
     def receive_data_chunk(self, raw_data, start):
-        self.data += raw_data
         self.file.size += len(raw_data)
-        self.put_data(self.request.backend.block_size)
+        for block in self.assembler.feed(raw_data):
+            self.uploader.put(block)
         return None
 
     def file_complete(self, file_size):
-        l = len(self.data)
-        if l > 0:
-            self.put_data(l)
+        if len(self.assembler) > 0:
+            self.uploader.put(self.assembler.flush())
+        self.file.hashmap = self.uploader.finish()
         self.file.etag = self.checksum_compute.hexdigest()
         return self.file
 
 
+_block_io_pool = None
+
+
+def get_block_io_pool():
+    """Return the process-wide thread pool for background block I/O."""
+    global _block_io_pool
+    if _block_io_pool is None:
+        _block_io_pool = ThreadPool(BLOCK_IO_WORKERS)
+    return _block_io_pool
+
+
+class BlockPrefetcher(object):
+    """Fetch blocks in the background, ahead of their consumption.
+
+    Blocks must be requested with get() in the order of the given hashes.
+    Up to `depth` blocks after the requested one are being fetched at
+    any time.
+    """
+
+    def __init__(self, backend, hashes, depth):
+        self.backend = backend
+        self.hashes = iter(hashes)
+        self.depth = depth
+        self.pending = deque()
+        self.closed = False
+
+    def _fill(self):
+        pool = get_block_io_pool()
+        while len(self.pending) <= self.depth:
+            try:
+                h = self.hashes.next()
+            except StopIteration:
+                break
+            self.pending.append(
+                (h, pool.apply_async(self.backend.get_block, (h,))))
+
+    def get(self, block_hash):
+        assert not self.closed, "Prefetcher is closed"
+        self._fill()
+        h, result = self.pending.popleft()
+        assert(h == block_hash), "Blocks requested out of order"
+        return result.get()
+
+    def close(self):
+        # Blocks already being fetched cannot be cancelled, but nothing
+        # more is fetched and their data is dropped.
+        self.closed = True
+        self.pending.clear()
+
+
+class BlockUploader(object):
+    """Store blocks in the background, while more data is being received.
+
+    Blocks are hashed and stored by the block I/O pool, at most `depth` of
+    them at a time; put() waits for the oldest one when the limit is
+    reached. The checksum is updated with the blocks in the order they were
+    given. If depth is 0, every block is stored before put() returns.
+    """
+
+    def __init__(self, backend, checksum_compute, depth):
+        self.backend = backend
+        self.checksum_compute = checksum_compute
+        self.depth = depth
+        self.hashmap = []
+        self.pending = deque()
+        self.count = 0
+        self.turn = 0
+        self.cond = Condition()
+
+    def _store(self, index, block):
+        # The pool runs tasks in submission order, so the block whose turn
+        # it is has always been picked up by a worker.
+        with self.cond:
+            while self.turn != index:
+                self.cond.wait()
+            try:
+                self.checksum_compute.update(block)
+            finally:
+                self.turn += 1
+                self.cond.notify_all()
+        return self.backend.put_block(block)
+
+    def put(self, block):
+        if self.depth <= 0:
+            self.checksum_compute.update(block)
+            self.hashmap.append(self.backend.put_block(block))
+            return
+        while len(self.pending) >= self.depth:
+            self.hashmap.append(self.pending.popleft().get())
+        self.pending.append(get_block_io_pool().apply_async(
+            self._store, (self.count, block)))
+        self.count += 1
+
+    def finish(self):
+        """Wait for the pending blocks and return the hashmap."""
+        while self.pending:
+            self.hashmap.append(self.pending.popleft().get())
+        return self.hashmap
+
+
 class ObjectWrapper(object):
     """Return the object's data block-per-block in each iteration.
 
     Read from the object using the offset and length provided
-    in each entry of the range list.
+    in each entry of the range list. If read_ahead is set, that many
+    blocks are fetched in the background ahead of the one being read.
     """
 
-    def __init__(self, backend, ranges, sizes, hashmaps, boundary):
+    def __init__(self, backend, ranges, sizes, hashmaps, boundary,
+                 read_ahead=0):
         self.backend = backend
         self.ranges = ranges
         self.sizes = sizes
@@ -835,9 +1037,58 @@ class ObjectWrapper(object):
         self.range_index = -1
         self.offset, self.length = self.ranges[0]
 
+        if read_ahead > 0:
+            self.prefetcher = BlockPrefetcher(backend, self.block_hashes(),
+                                              read_ahead)
+        else:
+            self.prefetcher = None
+
     def __iter__(self):
         return self
 
+    def block_hashes(self):
+        """Generate the hashes of the blocks to be read, in order.
+
+        This walks the ranges the same way part_iterator() does. A block
+        needed by consecutive reads, e.g. by adjacent ranges of a multipart
+        response, is only generated once, as it is only fetched once.
+        """
+        block_size = self.backend.block_size
+        last_hash = None
+        for offset, length in self.ranges:
+            file_index = 0
+            while length > 0:
+                file_size = self.sizes[file_index]
+                while offset >= file_size:
+                    offset -= file_size
+                    file_index += 1
+                    file_size = self.sizes[file_index]
+
+                hashmap = self.hashmaps[file_index]
+                block_index = int(offset / block_size)
+                if hashmap[block_index] != last_hash:
+                    last_hash = hashmap[block_index]
+                    yield last_hash
+
+                bs = block_size
+                if (block_index == len(hashmap) - 1 and
+                        file_size % block_size):
+                    bs = file_size % block_size
+                bl = min(length, bs - offset % block_size)
+                offset += bl
+                length -= bl
+
+    def get_block(self, block_hash):
+        if self.prefetcher is not None:
+            return self.prefetcher.get(block_hash)
+        return self.backend.get_block(block_hash)
+
+    def close(self):
+        """Called by the WSGI server when the response is done or the
+        client has disconnected."""
+        if self.prefetcher is not None:
+            self.prefetcher.close()
+
     def part_iterator(self):
         if self.length > 0:
             # Get the file for the current offset.
@@ -854,7 +1105,7 @@ class ObjectWrapper(object):
                 self.block_hash = self.hashmaps[
                     self.file_index][self.block_index]
                 try:
-                    self.block = self.backend.get_block(self.block_hash)
+                    self.block = self.get_block(self.block_hash)
                 except ItemNotExists:
                     raise faults.ItemNotFound('Block does not exist')
 
@@ -905,42 +1156,90 @@ class ObjectWrapper(object):
                 return '\r\n'.join(out)
 
 
+def get_object_ranges(request, size, meta):
+    """Return the (offset, length) ranges of the object to reply with,
+    along with the status code of the reply."""
+
+    ranges = get_range(request, size)
+    if ranges is None:
+        return [(0, size)], 200
+
+    check = [True for offset, length in ranges if
+             length <= 0 or length > size or
+             offset < 0 or offset >= size or
+             offset + length > size]
+    if len(check) > 0:
+        raise faults.RangeNotSatisfiable(
+            'Requested range exceeds object limits')
+    if_range = request.META.get('HTTP_IF_RANGE')
+    if if_range:
+        try:
+            # Modification time has passed instead.
+            last_modified = parse_http_date(if_range)
+            if last_modified != meta['modified']:
+                return [(0, size)], 200
+        except ValueError:
+            if if_range != meta['checksum']:
+                return [(0, size)], 200
+    return ranges, 206
+
+
+class HashmapPart(object):
+    """Part of the hashmap of an object, holding the hashes of the blocks
+    from blkoff on. It is indexed by the block index in the object and its
+    length is the number of blocks of the whole object.
+    """
+
+    def __init__(self, hashes, blkoff, size, block_size):
+        self.hashes = hashes
+        self.blkoff = blkoff
+        self.length = (size + block_size - 1) // block_size
+
+    def __len__(self):
+        return self.length
+
+    def __getitem__(self, idx):
+        i = idx - self.blkoff
+        if not 0 <= i < len(self.hashes):
+            raise IndexError('block %d is not in the hashmap part' % idx)
+        return self.hashes[i]
+
+
+def get_object_read_hashmap(request, v_account, v_container, v_object,
+                            version, meta):
+    """Return the size and the hashmap of an object that is read.
+
+    For a range request, only the hashes of the blocks in the requested
+    ranges are fetched from the backend.
+    """
+
+    backend = request.backend
+    ranges, ret = get_object_ranges(request, meta['bytes'], meta)
+    if ret != 206:
+        return backend.get_object_hashmap(request.user_uniq, v_account,
+                                          v_container, v_object, version)
+    block_size = backend.block_size
+    blkoff = min(offset for offset, length in ranges) // block_size
+    last = max(offset + length - 1 for offset, length in ranges) // block_size
+    size, hashes = backend.get_object_hashmap(request.user_uniq, v_account,
+                                              v_container, v_object, version,
+                                              blkoff, last - blkoff + 1)
+    return size, HashmapPart(hashes, blkoff, size, block_size)
+
+
 def object_data_response(request, sizes, hashmaps, meta, public=False):
     """Get the HttpResponse object for replying with the object's data."""
 
     # Range handling.
     size = sum(sizes)
-    ranges = get_range(request, size)
-    if ranges is None:
-        ranges = [(0, size)]
-        ret = 200
-    else:
-        check = [True for offset, length in ranges if
-                 length <= 0 or length > size or
-                 offset < 0 or offset >= size or
-                 offset + length > size]
-        if len(check) > 0:
-            raise faults.RangeNotSatisfiable(
-                'Requested range exceeds object limits')
-        ret = 206
-        if_range = request.META.get('HTTP_IF_RANGE')
-        if if_range:
-            try:
-                # Modification time has passed instead.
-                last_modified = parse_http_date(if_range)
-                if last_modified != meta['modified']:
-                    ranges = [(0, size)]
-                    ret = 200
-            except ValueError:
-                if if_range != meta['checksum']:
-                    ranges = [(0, size)]
-                    ret = 200
+    ranges, ret = get_object_ranges(request, size, meta)
 
     if ret == 206 and len(ranges) > 1:
         boundary = uuid.uuid4().hex
     else:
         boundary = ''
-    wrapper = ObjectWrapper(request.backend, ranges, sizes, hashmaps, boundary)
+    wrapper = ObjectWrapper(request.backend, ranges, sizes, hashmaps, boundary,
+                            read_ahead=READ_AHEAD_BLOCKS)
     response = HttpResponse(wrapper, status=ret)
     put_object_headers(
         response, meta, restricted=public,
@@ -1009,6 +1308,25 @@ if RADOS_STORAGE:
 else:
     BLOCK_PARAMS = {'mappool': None,
                     'blockpool': None, }
+BLOCK_PARAMS.update({'block_cache_size': BACKEND_BLOCK_CACHE_SIZE,
+                     'known_blocks_size': BACKEND_KNOWN_BLOCKS_SIZE, })
+
+if BACKEND_DB_POOL_SIZE > 0:
+    DB_POOL_PARAMS = {'pool_size': BACKEND_DB_POOL_SIZE,
+                      'max_overflow': BACKEND_DB_POOL_MAX_OVERFLOW,
+                      'pool_recycle': BACKEND_DB_POOL_RECYCLE,
+                      'pool_timeout': BACKEND_DB_POOL_TIMEOUT,
+                      'pre_ping': BACKEND_DB_POOL_PRE_PING, }
+else:
+    DB_POOL_PARAMS = None
+
+if BACKEND_COMMISSION_RESOLVE_INTERVAL > 0:
+    COMMISSION_RESOLVE_PARAMS = {
+        'interval': BACKEND_COMMISSION_RESOLVE_INTERVAL,
+        'batch_size': BACKEND_COMMISSION_RESOLVE_BATCH_SIZE,
+        'retries': BACKEND_COMMISSION_RESOLVE_RETRIES, }
+else:
+    COMMISSION_RESOLVE_PARAMS = None
 
 BACKEND_KWARGS = dict(
     db_module=BACKEND_DB_MODULE,
@@ -1033,7 +1351,10 @@ BACKEND_KWARGS = dict(
     container_versioning_policy=BACKEND_VERSIONING,
     archipelago_conf_file=BACKEND_ARCHIPELAGO_CONF,
     xseg_pool_size=BACKEND_XSEG_POOL_SIZE,
-    map_check_interval=BACKEND_MAP_CHECK_INTERVAL)
+    map_check_interval=BACKEND_MAP_CHECK_INTERVAL,
+    xseg_pipeline_depth=BACKEND_XSEG_PIPELINE_DEPTH,
+    db_pool_params=DB_POOL_PARAMS,
+    commission_resolve_params=COMMISSION_RESOLVE_PARAMS)
 
 _pithos_backend_pool = PithosBackendPool(size=BACKEND_POOL_SIZE,
                                          **BACKEND_KWARGS)
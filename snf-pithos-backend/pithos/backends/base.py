@@ -512,9 +512,13 @@ class BaseBackend(object):
         """
         return
 
-    def get_object_hashmap(self, user, account, container, name, version=None):
+    def get_object_hashmap(self, user, account, container, name, version=None,
+                           blkoff=0, nr=None):
         """Return the object's size and a list with partial hashes.
 
+        If nr is given, return only the hashes of the nr blocks starting
+        at block blkoff.
+
         Raises:
             NotAllowedError: Operation not permitted
 
@@ -15,6 +15,7 @@
 
 from hashlib import new as newhasher
 from binascii import hexlify
+from collections import deque
 import os
 import re
 import ConfigParser
@@ -30,18 +31,29 @@ from pithos.workers import (
     glue,
     monkey,
     )
+from synnefo.lib.cache import RecentSet
 
 monkey.patch_Request()
 
+# Number of block hashes per generation of the known blocks set
+KNOWN_BLOCKS_SIZE = 65536
+
 
 class ArchipelagoBlocker(object):
     """Blocker.
        Required constructor parameters: blocksize, hashtype.
+       Optional pipeline_depth, the maximum number of xseg requests
+       kept in flight by multi-block operations, and known_blocks_size.
     """
 
     blocksize = None
     blockpool = None
     hashtype = None
+    pipeline_depth = 1
+    # Hashes of blocks known to exist in block storage, shared by all
+    # blockers of the process. Blocks are never removed from the storage,
+    # so entries never become stale.
+    known_blocks = None
 
     def __init__(self, **params):
         cfg = {}
@@ -65,6 +77,10 @@ class ArchipelagoBlocker(object):
         self.hashtype = hashtype
         self.hashlen = len(emptyhash)
         self.emptyhash = emptyhash
+        self.pipeline_depth = max(1, params.get('pipeline_depth') or 1)
+        if ArchipelagoBlocker.known_blocks is None:
+            size = params.get('known_blocks_size') or KNOWN_BLOCKS_SIZE
+            ArchipelagoBlocker.known_blocks = RecentSet(size=size)
 
     def _pad(self, block):
         return block + ('\x00' * (self.blocksize - len(block)))
@@ -87,6 +103,66 @@ class ArchipelagoBlocker(object):
         else:
             return False
 
+    def _pipeline(self, ioctx, items, new_request):
+        """Submit a request for each item and yield (item, request) pairs,
+           in submission order, as the requests complete.
+           Up to pipeline_depth requests are kept in flight. The caller
+           must put() each yielded request.
+        """
+        depth = self.pipeline_depth
+        inflight = deque()
+        try:
+            for item in items:
+                req = new_request(ioctx, item)
+                req.submit()
+                inflight.append((item, req))
+                if len(inflight) >= depth:
+                    item, req = inflight.popleft()
+                    req.wait()
+                    yield item, req
+            while inflight:
+                item, req = inflight.popleft()
+                req.wait()
+                yield item, req
+        finally:
+            # Reap whatever is still in flight if the caller bailed out
+            for item, req in inflight:
+                req.wait()
+                req.put()
+
+    def _get_info_request(self, ioctx, blkhash):
+        return Request.get_info_request(ioctx, self.dst_port,
+                                        hexlify(blkhash))
+
+    def _get_read_request(self, ioctx, blkhash):
+        return Request.get_read_request(ioctx, self.dst_port,
+                                        hexlify(blkhash),
+                                        size=self.blocksize, offset=0)
+
+    def _check_rear_blocks(self, hashes):
+        """Return the subset of hashes missing from block storage.
+           Each distinct hash is checked once and hashes of blocks known
+           to exist are not checked at all.
+        """
+        known = self.known_blocks
+        unknown = set(h for h in hashes if h not in known)
+        missing = set()
+        if not unknown:
+            return missing
+
+        ioctx = self.ioctx_pool.pool_get()
+        try:
+            for h, req in self._pipeline(ioctx, unknown,
+                                         self._get_info_request):
+                if req.success():
+                    known.add(h)
+                else:
+                    missing.add(h)
+                req.put()
+        finally:
+            self.ioctx_pool.pool_put(ioctx)
+        return missing
+
     def block_hash(self, data):
         """Hash a block of data"""
         hasher = newhasher(self.hashtype)
@@ -97,35 +173,50 @@ class ArchipelagoBlocker(object):
         """Check hashes for existence and
            return those missing from block storage.
         """
+        missing = self._check_rear_blocks(hashes)
+        if not missing:
+            return []
+
         notfound = []
         append = notfound.append
-
         for h in hashes:
-            if h not in notfound and not self._check_rear_block(h):
+            if h in missing:
                 append(h)
+                missing.discard(h)
 
         return notfound
 
     def block_retr(self, hashes):
         """Retrieve blocks from storage by their hashes."""
         blocksize = self.blocksize
-        blocks = []
-        append = blocks.append
-        block = None
+        blocks = [None] * len(hashes)
+        emptyblock = None
+        pending = []
 
-        for h in hashes:
+        for i, h in enumerate(hashes):
             if h == self.emptyhash:
-                append(self._pad(''))
-                continue
-            with self._get_rear_block(h, 0) as rbl:
-                if not rbl:
-                    break
-                for block in rbl.sync_read_chunks(blocksize, 1, 0):
-                    break  # there should be just one block there
-            if not block:
-                break
-            append(self._pad(block))
+                if emptyblock is None:
+                    emptyblock = self._pad('')
+                blocks[i] = emptyblock
+            else:
+                pending.append(i)
+
+        read_block = lambda ioctx, i: self._get_read_request(ioctx, hashes[i])
+        ioctx = self.ioctx_pool.pool_get()
+        try:
+            for i, req in self._pipeline(ioctx, pending, read_block):
+                if req.success():
+                    block = string_at(req.get_data(), blocksize)
+                    if block:
+                        blocks[i] = self._pad(block)
+                        self.known_blocks.add(hashes[i])
+                req.put()
+        finally:
+            self.ioctx_pool.pool_put(ioctx)
 
+        # Stop at the first block that could not be retrieved
+        if None in blocks:
+            blocks = blocks[:blocks.index(None)]
         return blocks
 
     def block_retr_archipelago(self, hashes):
@@ -176,11 +267,37 @@ class ArchipelagoBlocker(object):
         """
         block_hash = self.block_hash
         hashlist = [block_hash(b) for b in blocklist]
-        missing = [i for i, h in enumerate(hashlist) if not
-                   self._check_rear_block(h)]
+        absent = self._check_rear_blocks(hashlist)
+        missing = [i for i, h in enumerate(hashlist) if h in absent]
+
+        def write_block(ioctx, i):
+            block = blocklist[i]
+            return Request.get_write_request(ioctx, self.dst_port,
+                                             hexlify(hashlist[i]),
+                                             data=block, offset=0,
+                                             datalen=len(block))
+
+        # Identical blocks of the list need to be written only once
+        written = set()
+        towrite = []
         for i in missing:
-            with self._get_rear_block(hashlist[i], 1) as rbl:
-                rbl.sync_write(blocklist[i])  # XXX: verify?
+            if hashlist[i] not in written:
+                written.add(hashlist[i])
+                towrite.append(i)
+
+        failed = False
+        ioctx = self.ioctx_pool.pool_get()
+        try:
+            for i, req in self._pipeline(ioctx, towrite, write_block):
+                if req.success():
+                    self.known_blocks.add(hashlist[i])
+                else:
+                    failed = True
+                req.put()
+        finally:
+            self.ioctx_pool.pool_put(ioctx)
+        if failed:
+            raise IOError("archipelago: Write request error")
 
         return hashlist, missing
 
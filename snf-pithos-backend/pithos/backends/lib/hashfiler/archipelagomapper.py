@@ -38,6 +38,45 @@ monkey.patch_Request()
 
 logger = logging.getLogger(__name__)
 
+
+class HashList(object):
+    """Read-only sequence of the hashes stored in a map buffer.
+       Hashes are sliced out of the buffer when accessed, so building
+       the sequence, or a slice of it, does not copy the buffer.
+    """
+
+    __slots__ = ('data', 'namelen')
+
+    def __init__(self, data, namelen):
+        self.data = data
+        self.namelen = namelen
+
+    def __len__(self):
+        return len(self.data) // self.namelen
+
+    def __getitem__(self, idx):
+        namelen = self.namelen
+        if isinstance(idx, slice):
+            start, stop, step = idx.indices(len(self))
+            if step != 1:
+                return [self[i] for i in xrange(start, stop, step)]
+            count = max(0, stop - start)
+            return HashList(buffer(self.data, start * namelen,
+                                   count * namelen), namelen)
+        if idx < 0:
+            idx += len(self)
+        if not 0 <= idx < len(self):
+            raise IndexError("hash index out of range")
+        offset = idx * namelen
+        return self.data[offset:offset + namelen]
+
+    def __iter__(self):
+        data = self.data
+        namelen = self.namelen
+        for offset in xrange(0, len(self) * namelen, namelen):
+            yield data[offset:offset + namelen]
+
+
 class ArchipelagoMapper(object):
     """Mapper.
        Required constructor parameters: namelen.
@@ -76,12 +115,11 @@ class ArchipelagoMapper(object):
             return False
 
     def map_retr(self, maphash, blkoff=0, nr=100000000000000):
-        """Return as a list, part of the hashes map of an object
+        """Return as a sequence, part of the hashes map of an object
            at the given block offset.
            By default, return the whole hashes map.
         """
         namelen = self.namelen
-        hashes = ()
         ioctx = self.ioctx_pool.pool_get()
         req = Request.get_info_request(ioctx, self.dst_port,
                                        hexlify(maphash))
@@ -97,8 +135,15 @@ class ArchipelagoMapper(object):
             self.ioctx_pool.pool_put(ioctx)
             raise RuntimeError("Hashmap '%s' doesn't exists" %
                                hexlify(maphash))
+        # Fetch only the requested part of the map
+        offset = min(blkoff * namelen, size)
+        size = min(nr * namelen, size - offset)
+        if size <= 0:
+            self.ioctx_pool.pool_put(ioctx)
+            return HashList('', namelen)
         req = Request.get_read_request(ioctx, self.dst_port,
-                                       hexlify(maphash), size=size)
+                                       hexlify(maphash), size=size,
+                                       offset=offset)
         req.submit()
         req.wait()
         ret = req.success()
@@ -106,15 +151,12 @@ class ArchipelagoMapper(object):
             data = string_at(req.get_data(), size)
             req.put()
             self.ioctx_pool.pool_put(ioctx)
-            for idx in xrange(0, len(data), namelen):
-                hashes = hashes + (data[idx:idx + namelen],)
-            hashes = list(hashes)
         else:
             req.put()
             self.ioctx_pool.pool_put(ioctx)
             raise RuntimeError("Hashmap '%s' doesn't exists" %
                                hexlify(maphash))
-        return hashes
+        return HashList(data, namelen)
 
     def map_retr_archipelago(self, maphash, size):
         """Retrieve Archipelago mapfile"""
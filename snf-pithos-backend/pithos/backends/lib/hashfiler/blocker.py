@@ -19,12 +19,13 @@ from archipelagoblocker import ArchipelagoBlocker
 class Blocker(object):
     """Blocker.
        Required constructor parameters: blocksize, blockpath, hashtype.
-       Optional blockpool.
+       Optional blockpool, pipeline_depth, known_blocks_size.
     """
 
     def __init__(self, **params):
         self.archip_blocker = ArchipelagoBlocker(**params)
         self.hashlen = self.archip_blocker.hashlen
+        self.known_blocks = self.archip_blocker.known_blocks
         self.blocksize = params['blocksize']
 
     def block_hash(self, data):
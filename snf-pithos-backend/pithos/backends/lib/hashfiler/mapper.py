@@ -26,7 +26,7 @@ class Mapper(object):
         self.archip_map = ArchipelagoMapper(**params)
 
     def map_retr(self, maphash, blkoff=0, nr=100000000000000):
-        """Return as a list, part of the hashes map of an object
+        """Return as a sequence, part of the hashes map of an object
            at the given block offset.
            By default, return the whole hashes map.
         """
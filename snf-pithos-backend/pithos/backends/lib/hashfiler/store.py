@@ -17,14 +17,23 @@ import os
 
 from blocker import Blocker
 from mapper import Mapper
+from synnefo.lib.cache import LRUCache
 
 
 class Store(object):
     """Store.
        Required constructor parameters: path, block_size, hash_algorithm,
        umask, blockpool, mappool.
+       Optional pipeline_depth, known_blocks_size, block_cache_size.
+
+       If block_cache_size is set, up to that many bytes of recently read
+       block payloads are cached in memory, shared by all stores of the
+       process. Blocks are content addressed and never change, so cached
+       payloads never need to be invalidated.
     """
 
+    block_cache = None
+
     def __init__(self, **params):
         umask = params['umask']
         if umask is not None:
@@ -32,14 +41,19 @@ class Store(object):
 
         pb = {'blocksize': params['block_size'],
               'hashtype': params['hash_algorithm'],
+              'pipeline_depth': params.get('pipeline_depth'),
+              'known_blocks_size': params.get('known_blocks_size'),
               }
         self.blocker = Blocker(**pb)
+        block_cache_size = params.get('block_cache_size')
+        if block_cache_size and Store.block_cache is None:
+            Store.block_cache = LRUCache(maxsize=block_cache_size, weigh=len)
         pm = {'namelen': self.blocker.hashlen,
               }
         self.mapper = Mapper(**pm)
 
-    def map_get(self, name):
-        return self.mapper.map_retr(name)
+    def map_get(self, name, blkoff=0, nr=100000000000000):
+        return self.mapper.map_retr(name, blkoff, nr)
 
     def map_get_archipelago(self, name, size):
         return self.mapper.map_retr_archipelago(name, size)
@@ -51,9 +65,15 @@ class Store(object):
         pass
 
     def block_get(self, hash):
+        if self.block_cache is not None:
+            block = self.block_cache.get(hash)
+            if block is not None:
+                return block
         blocks = self.blocker.block_retr((hash,))
         if not blocks:
             return None
+        if self.block_cache is not None:
+            self.block_cache.set(hash, blocks[0])
         return blocks[0]
 
     def block_get_archipelago(self, hash):
@@ -72,3 +92,18 @@ class Store(object):
 
     def block_search(self, map):
         return self.blocker.block_ping(map)
+
+    def cache_stats(self):
+        """Return the counters and hit ratios of the block caches."""
+        def ratio(stats):
+            total = stats['hits'] + stats['misses']
+            return float(stats['hits']) / total if total else 0.0
+
+        known = self.blocker.known_blocks.stats()
+        known['hit_ratio'] = ratio(known)
+        stats = {'known_blocks': known}
+        if self.block_cache is not None:
+            blocks = self.block_cache.stats()
+            blocks['hit_ratio'] = ratio(blocks)
+            stats['block_cache'] = blocks
+        return stats
@@ -0,0 +1,121 @@
+"""rebuild account and container statistics
+
+Revision ID: 3c1f6a7b9d2e
+Revises: e6edec1b499
+Create Date: 2026-10-18 12:00:00.000000
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '3c1f6a7b9d2e'
+down_revision = 'e6edec1b499'
+
+from alembic import op
+from sqlalchemy.sql import table, column, and_, func
+
+import sqlalchemy as sa
+
+ROOTNODE = 0
+
+n = table(
+    'nodes',
+    column('node', sa.Integer),
+    column('parent', sa.Integer)
+)
+
+v = table(
+    'versions',
+    column('serial', sa.Integer),
+    column('node', sa.Integer),
+    column('size', sa.BigInteger),
+    column('mtime', sa.DECIMAL(precision=16, scale=6)),
+    column('cluster', sa.Integer)
+)
+
+st = table(
+    'statistics',
+    column('node', sa.Integer),
+    column('population', sa.Integer),
+    column('size', sa.BigInteger),
+    column('mtime', sa.DECIMAL(precision=16, scale=6)),
+    column('cluster', sa.Integer)
+)
+
+
+def _max(a, b):
+    if a is None:
+        return b
+    if b is None:
+        return a
+    return max(a, b)
+
+
+def upgrade():
+    """Recompute the statistics of accounts and containers.
+
+    Object operations used to update the container statistics only, so
+    account rows did not include object bytes.
+    """
+
+    connection = op.get_bind()
+
+    # Population, size and mtime of the direct children of every node.
+    s = sa.select([n.c.parent, v.c.cluster, func.count(v.c.serial),
+                   func.sum(v.c.size), func.max(v.c.mtime)])
+    s = s.where(v.c.node == n.c.node)
+    s = s.group_by(n.c.parent, v.c.cluster)
+    children = {}
+    for parent, cluster, population, size, mtime in \
+            connection.execute(s).fetchall():
+        children[(parent, cluster)] = (population, long(size or 0), mtime)
+
+    s = sa.select([n.c.node]).where(and_(n.c.parent == ROOTNODE,
+                                         n.c.node != ROOTNODE))
+    accounts = set(r[0] for r in connection.execute(s).fetchall())
+    s = sa.select([n.c.node, n.c.parent])
+    s = s.where(n.c.parent.in_(sa.select([n.c.node]).where(
+        and_(n.c.parent == ROOTNODE, n.c.node != ROOTNODE))))
+    containers = dict(connection.execute(s).fetchall())
+
+    computed = {}
+    for (parent, cluster), stats in children.iteritems():
+        if parent in containers:
+            computed[(parent, cluster)] = stats
+        if parent in accounts:
+            population, size, mtime = computed.get((parent, cluster),
+                                                   (0, 0, None))
+            computed[(parent, cluster)] = (population + stats[0],
+                                           size + stats[1],
+                                           _max(mtime, stats[2]))
+        elif parent in containers:
+            account = containers[parent]
+            population, size, mtime = computed.get((account, cluster),
+                                                   (0, 0, None))
+            computed[(account, cluster)] = (population,
+                                            size + stats[1],
+                                            _max(mtime, stats[2]))
+
+    s = sa.select([st.c.node, st.c.cluster, st.c.mtime])
+    existing = dict(((node, cluster), mtime) for node, cluster, mtime in
+                    connection.execute(s).fetchall()
+                    if node in accounts or node in containers)
+
+    inserts = []
+    for key in set(computed) | set(existing):
+        node, cluster = key
+        population, size, mtime = computed.get(key, (0, 0, None))
+        values = {'population': population, 'size': size,
+                  'mtime': _max(existing.get(key), mtime)}
+        if key in existing:
+            u = st.update().where(and_(st.c.node == node,
+                                       st.c.cluster == cluster))
+            connection.execute(u.values(values))
+        else:
+            values.update({'node': node, 'cluster': cluster})
+            inserts.append(values)
+    if inserts:
+        op.bulk_insert(st, inserts)
+
+
+def downgrade():
+    pass
@@ -13,16 +13,60 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+from threading import Lock
+
 from sqlalchemy import create_engine
 #from sqlalchemy.event import listen
-from sqlalchemy.pool import NullPool
+from sqlalchemy.exc import DisconnectionError
+from sqlalchemy.pool import NullPool, QueuePool
 from sqlalchemy.interfaces import PoolListener
 
 
+class PingListener(PoolListener):
+    """Check that a pooled connection is alive, before handing it out."""
+
+    def checkout(self, dbapi_con, con_record, con_proxy):
+        try:
+            cursor = dbapi_con.cursor()
+            cursor.execute('SELECT 1')
+            cursor.close()
+        except Exception:
+            # The pool will discard the connection and retry with a new one.
+            raise DisconnectionError()
+
+
+_engines = {}
+_engines_lock = Lock()
+
+
+def get_pooled_engine(db, pool_size=5, max_overflow=10, pool_recycle=3600,
+                      pool_timeout=30, pre_ping=True):
+    """Return the pooled engine for db, shared by the whole process."""
+    key = (db, pool_size, max_overflow, pool_recycle, pool_timeout, pre_ping)
+    with _engines_lock:
+        engine = _engines.get(key)
+        if engine is None:
+            listeners = [PingListener()] if pre_ping else []
+            engine = create_engine(
+                db, poolclass=QueuePool,
+                pool_size=pool_size, max_overflow=max_overflow,
+                pool_recycle=pool_recycle, pool_timeout=pool_timeout,
+                listeners=listeners, isolation_level='READ COMMITTED')
+            _engines[key] = engine
+        return engine
+
+
 class DBWrapper(object):
-    """Database connection wrapper."""
+    """Database connection wrapper.
+
+    If pool_params are given, the engine and its connection pool are shared
+    by all wrappers of the process with the same parameters. A connection is
+    then checked out on demand and returned to the pool at the end of each
+    transaction, instead of being held for the lifetime of the wrapper.
+    """
 
-    def __init__(self, db):
+    def __init__(self, db, pool_params=None):
+        self.pooled = False
         if db.startswith('sqlite://'):
             class ForeignKeysListener(PoolListener):
                 def connect(self, dbapi_con, con_record):
@@ -35,18 +79,33 @@ class DBWrapper(object):
         #elif db.startswith('mysql://'):
         #    db = '%s?charset=utf8&use_unicode=0' %db
         #    self.engine = create_engine(db, convert_unicode=True)
+        elif pool_params:
+            self.engine = get_pooled_engine(db, **pool_params)
+            self.pooled = True
         else:
             #self.engine = create_engine(db, pool_size=0, max_overflow=-1)
             self.engine = create_engine(
                 db, poolclass=NullPool, isolation_level='READ COMMITTED')
         self.engine.echo = False
         self.engine.echo_pool = False
-        self.conn = self.engine.connect()
+        self._conn = None if self.pooled else self.engine.connect()
         self.trans = None
 
+    @property
+    def conn(self):
+        if self._conn is None:
+            self._conn = self.engine.connect()
+        return self._conn
+
+    def _release(self):
+        if self.pooled and self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
     def close(self):
-        self.conn.close()
-        self.conn = None
+        if self._conn is not None:
+            self._conn.close()
+        self._conn = None
 
     def execute(self):
         self.trans = self.conn.begin()
@@ -54,7 +113,19 @@ class DBWrapper(object):
     def commit(self):
         self.trans.commit()
         self.trans = None
+        self._release()
 
     def rollback(self):
         self.trans.rollback()
         self.trans = None
+        self._release()
+
+    def pool_status(self):
+        """Return the gauges of the connection pool, if there is one."""
+        if not self.pooled:
+            return None
+        pool = self.engine.pool
+        return {'size': pool.size(),
+                'checked_out': pool.checkedout(),
+                'idle': pool.checkedin(),
+                'overflow': max(pool.overflow(), 0)}
@@ -22,7 +22,7 @@ from sqlalchemy import (Table, Integer, BigInteger, DECIMAL, Boolean,
                         Column, String, MetaData, ForeignKey)
 from sqlalchemy.schema import Index
 from sqlalchemy.sql import func, and_, or_, not_, select, bindparam, exists
-from sqlalchemy.sql.expression import true
+from sqlalchemy.sql.expression import true, literal_column, case
 from sqlalchemy.exc import NoSuchTableError
 
 from dbworker import DBWorker, ESCAPE_CHAR
@@ -188,6 +188,11 @@ class Node(DBWorker):
 
     def __init__(self, **params):
         DBWorker.__init__(self, **params)
+        # If set, statistics changes are accumulated per (node, cluster)
+        # and written by statistics_flush(), at the end of the transaction.
+        self.batch_statistics = params.get('batch_statistics', False)
+        self._statistics_deltas = {}
+        self._parents = {}
         try:
             metadata = MetaData(self.engine)
             self.nodes = Table('nodes', metadata, autoload=True)
@@ -354,7 +359,7 @@ class Node(DBWorker):
             return (), 0, ()
         nr, size = row[0], row[1] if row[1] else 0
         mtime = time()
-        self.statistics_update(parent, -nr, -size, mtime, cluster)
+        self._statistics_add(parent, -nr, -size, mtime, cluster)
         self.statistics_update_ancestors(parent, -nr, -size, mtime, cluster,
                                          update_statistics_ancestors_depth)
 
@@ -596,6 +601,10 @@ class Node(DBWorker):
         r = self.conn.execute(s)
         row = r.fetchone()
         r.close()
+        delta = self._statistics_deltas.get((node, cluster))
+        if delta is not None:
+            population, size, mtime = row or (0, 0, 0)
+            row = (max(population + delta[0], 0), size + delta[1], delta[2])
         return row
 
     def statistics_update(self, node, population, size, mtime, cluster=0):
@@ -646,15 +655,95 @@ class Node(DBWorker):
                 break
             if recursion_depth and recursion_depth <= i:
                 break
-            props = self.node_get_properties(node)
-            if props is None:
+            parent = self._node_parent(node)
+            if parent is None:
                 break
-            parent, path = props
-            self.statistics_update(parent, population, size, mtime, cluster)
+            self._statistics_add(parent, population, size, mtime, cluster)
             node = parent
             population = 0  # Population isn't recursive
             i += 1
 
+    def _node_parent(self, node):
+        if not self.batch_statistics:
+            props = self.node_get_properties(node)
+            return props[0] if props is not None else None
+        # Nodes never move, so parents can be remembered
+        # for the duration of the transaction.
+        if node not in self._parents:
+            props = self.node_get_properties(node)
+            self._parents[node] = props[0] if props is not None else None
+        return self._parents[node]
+
+    def _statistics_add(self, node, population, size, mtime, cluster=0):
+        if not self.batch_statistics:
+            self.statistics_update(node, population, size, mtime, cluster)
+            return
+        delta = self._statistics_deltas.get((node, cluster))
+        if delta is None:
+            self._statistics_deltas[(node, cluster)] = [population, size,
+                                                        mtime]
+        else:
+            delta[0] += population
+            delta[1] += size
+            delta[2] = mtime
+
+    def statistics_flush(self):
+        """Write the accumulated statistics changes
+           with one statement per kind of change.
+        """
+
+        deltas = self._statistics_deltas
+        self.statistics_discard()
+        if not deltas:
+            return
+
+        # Skip nodes removed in the meantime.
+        s = select([self.nodes.c.node],
+                   self.nodes.c.node.in_(set(n for n, c in deltas)))
+        rp = self.conn.execute(s)
+        nodes = set(row[0] for row in rp.fetchall())
+        rp.close()
+
+        s = select([self.statistics.c.node, self.statistics.c.cluster],
+                   self.statistics.c.node.in_(nodes))
+        rp = self.conn.execute(s)
+        existing = set((row[0], row[1]) for row in rp.fetchall())
+        rp.close()
+
+        updates = []
+        inserts = []
+        for (node, cluster), (population, size, mtime) in deltas.iteritems():
+            if node not in nodes:
+                continue
+            if (node, cluster) in existing:
+                updates.append({'b_node': node, 'b_cluster': cluster,
+                                'b_population': population, 'b_size': size,
+                                'b_mtime': mtime})
+            else:
+                inserts.append({'node': node, 'cluster': cluster,
+                                'population': max(population, 0),
+                                'size': size, 'mtime': mtime})
+
+        if updates:
+            population = self.statistics.c.population + bindparam(
+                'b_population')
+            u = self.statistics.update().where(and_(
+                self.statistics.c.node == bindparam('b_node'),
+                self.statistics.c.cluster == bindparam('b_cluster')))
+            u = u.values(population=case([(population < 0, 0)],
+                                         else_=population),
+                         size=self.statistics.c.size + bindparam('b_size'),
+                         mtime=bindparam('b_mtime'))
+            self.conn.execute(u, updates).close()
+        if inserts:
+            self.conn.execute(self.statistics.insert(), inserts).close()
+
+    def statistics_discard(self):
+        """Forget the accumulated statistics changes."""
+
+        self._statistics_deltas = {}
+        self._parents = {}
+
     def statistics_latest(self, node, before=inf, except_cluster=0):
         """Return population, total size and last mtime
            for all latest versions under node that
@@ -762,6 +851,42 @@ class Node(DBWorker):
         mtime = max(mtime, r[2])
         return (count, size, mtime)
 
+    def statistics_compute(self, node):
+        """Return a dict with the population, total size and last mtime
+           of all versions under node, per cluster, computed from the
+           versions table instead of the statistics table.
+        """
+
+        props = self.node_get_properties(node)
+        if props is None:
+            return None
+        parent, path = props
+
+        # First level, just under node (get population).
+        c = select([self.nodes.c.node], self.nodes.c.parent == node)
+        s = select([self.versions.c.cluster,
+                    func.count(self.versions.c.serial)])
+        s = s.where(self.versions.c.node.in_(c))
+        s = s.group_by(self.versions.c.cluster)
+        rp = self.conn.execute(s)
+        population = dict(rp.fetchall())
+        rp.close()
+
+        # All children (get size and mtime).
+        c = select([self.nodes.c.node],
+                   self.nodes.c.path.like(self.escape_like(path) + '/%',
+                                          escape=ESCAPE_CHAR))
+        s = select([self.versions.c.cluster,
+                    func.sum(self.versions.c.size),
+                    func.max(self.versions.c.mtime)])
+        s = s.where(self.versions.c.node.in_(c))
+        s = s.group_by(self.versions.c.cluster)
+        rp = self.conn.execute(s)
+        rows = rp.fetchall()
+        rp.close()
+        return dict((cluster, (population.get(cluster, 0), long(size), mtime))
+                    for cluster, size, mtime in rows)
+
     def nodes_set_latest_version(self, node, serial):
         s = self.nodes.update().where(self.nodes.c.node == node)
         s = s.values(latest_version=serial)
@@ -1236,52 +1361,82 @@ class Node(DBWorker):
                              self.attributes.c.value.op(o)(val)))
                     s = s.where(exists(subs))
 
-        s = s.order_by(self.nodes.c.path)
-
         if not delimiter:
+            s = s.order_by(self.nodes.c.path)
             s = s.limit(limit)
             rp = self.conn.execute(s, start=start)
             r = rp.fetchall()
             rp.close()
             return r, ()
 
+        # The paths with no delimiter after the prefix, or with the first
+        # one at their end, are matches. The rest are aggregated to the
+        # common prefix up to their first delimiter, in a single query.
         pfz = len(prefix)
         dz = len(delimiter)
+        path = self.nodes.c.path
+        pos = self._strpos(func.substr(path, pfz + 1), delimiter)
+        pf = func.substr(path, 1, pfz + pos + dz - 1)
+
+        ms = s.where(or_(pos == 0, path == pf))
+        ms = ms.order_by(path).limit(limit + 1)
+        mrows = self._paged_rows(ms, start, lambda row: row[0], limit)
+
+        # Every path under a prefix sorts before the next ling of the prefix
+        ps = s.with_only_columns([pf.label('prefix')])
+        ps = ps.where(and_(pos > 0, path != pf))
+        ps = ps.order_by(literal_column('prefix')).limit(limit + 1)
+        prows = self._paged_rows(ps, start,
+                                 lambda row: strnextling(row[0]), limit)
+
+        # Merge them in path order, stopping where a scan of the paths
+        # would. Both lists are fetched one page at a time, as needed.
         count = 0
         prefixes = []
         pappend = prefixes.append
         matches = []
         mappend = matches.append
-
-        rp = self.conn.execute(s, start=start)
-        while True:
-            props = rp.fetchone()
-            if props is None:
-                break
-            path = props[0]
-            idx = path.find(delimiter, pfz)
-
-            if idx < 0:
+        mrow = next(mrows, None)
+        prow = next(prows, None)
+        while mrow is not None or prow is not None:
+            if mrow is not None and (prow is None or mrow[0] <= prow[0]):
+                props = mrow
+                mrow = next(mrows, None)
                 mappend(props)
                 count += 1
+                if props[0].find(delimiter, pfz) >= 0:
+                    continue  # Get one more, in case there is a path.
                 if count >= limit:
                     break
                 continue
 
-            if idx + dz == len(path):
-                mappend(props)
-                count += 1
-                continue  # Get one more, in case there is a path.
-            pf = path[:idx + dz]
-            pappend(pf)
+            pappend(prow[0])
+            prow = next(prows, None)
             if count >= limit:
                 break
 
-            rp = self.conn.execute(s, start=strnextling(pf))  # New start.
-        rp.close()
-
         return matches, prefixes
 
+    def _paged_rows(self, s, start, key, limit):
+        """Yield the rows of query s, which is limited to limit + 1 rows,
+           continuing from start = key(last row) after each page."""
+        while True:
+            rp = self.conn.execute(s, start=start)
+            rows = rp.fetchall()
+            rp.close()
+            for row in rows:
+                yield row
+            if len(rows) <= limit:
+                return
+            start = key(rows[-1])
+
+    def _strpos(self, string, substring):
+        """Return the SQL position of substring in string, starting from 1,
+           or 0 if it is not found."""
+        if self.engine.name == 'postgresql':
+            return func.strpos(string, substring)
+        return func.instr(string, substring)
+
     def latest_uuid(self, uuid, cluster):
         """Return the latest version of the given uuid and cluster.
 
@@ -1325,14 +1480,13 @@ class Node(DBWorker):
         s = s.where(a.c.is_latest == true())
         if paths:
             s = s.where(n.c.path.in_(paths))
+        s = s.order_by(n.c.path, v.c.serial)
 
         r = self.conn.execute(s)
         rows = r.fetchall()
         r.close()
 
-        group_by = itemgetter(slice(12))
-        rows.sort(key=group_by)
-        groups = groupby(rows, group_by)
+        groups = groupby(rows, itemgetter(slice(12)))
         return [(k[0], k[1:], dict([i[12:] for i in data])) for
                 (k, data) in groups]
 
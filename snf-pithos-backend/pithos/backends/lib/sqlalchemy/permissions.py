@@ -13,13 +13,13 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
-from sqlalchemy.sql import select, literal, or_, and_
+from sqlalchemy.sql import select, literal, or_, and_, bindparam
 from sqlalchemy.sql.expression import join, union
 
 from xfeatures import XFeatures
 from groups import Groups
 from public import Public
-from node import Node
+from node import Node, strnextling
 from collections import defaultdict
 
 from dbworker import ESCAPE_CHAR
@@ -96,6 +96,22 @@ class Permissions(XFeatures, Groups, Public, Node):
             del(permissions[WRITE])
         return permissions
 
+    def access_get_bulk(self, paths):
+        """Get permissions for multiple paths.
+           Return a dictionary mapping the paths with
+           permissions to their permissions.
+        """
+
+        features = self.xfeature_get_bulk(paths) if paths else None
+        if not features:
+            return {}
+        feature_paths = dict(features)
+        perms = defaultdict(list)
+        for row in self.feature_list_bulk(feature_paths.keys()):
+            perms[feature_paths[row[1]]].append(row)
+        return dict((path, dict(self.access_get_for_bulk(p)[0]))
+                    for path, p in perms.iteritems())
+
     def access_members(self, path):
         feature = self.xfeature_get(path)
         if not feature:
@@ -212,19 +228,7 @@ class Permissions(XFeatures, Groups, Public, Node):
 
         """
 
-        xfeatures_xfeaturevals = self.xfeatures.join(self.xfeaturevals)
-
-        selectable = (self.groups.c.owner + ':' + self.groups.c.name)
-        member_groups = select([selectable.label('value')],
-                               self.groups.c.member == member)
-
-        members = select([literal(member).label('value')])
-        any = select([literal('*').label('value')])
-
-        u = union(member_groups, members, any).alias()
-        inner_join = join(xfeatures_xfeaturevals, u,
-                          self.xfeaturevals.c.value == u.c.value)
-        s = select([self.xfeatures.c.path], from_obj=[inner_join]).distinct()
+        s = self._access_paths_select(member)
         if prefix:
             like = lambda p: self.xfeatures.c.path.like(
                 self.escape_like(p) + '%', escape=ESCAPE_CHAR)
@@ -248,6 +252,72 @@ class Permissions(XFeatures, Groups, Public, Node):
             r.close()
         return l
 
+    def _access_paths_select(self, member):
+        xfeatures_xfeaturevals = self.xfeatures.join(self.xfeaturevals)
+
+        selectable = (self.groups.c.owner + ':' + self.groups.c.name)
+        member_groups = select([selectable.label('value')],
+                               self.groups.c.member == member)
+
+        members = select([literal(member).label('value')])
+        any = select([literal('*').label('value')])
+
+        u = union(member_groups, members, any).alias()
+        inner_join = join(xfeatures_xfeaturevals, u,
+                          self.xfeaturevals.c.value == u.c.value)
+        return select([self.xfeatures.c.path],
+                      from_obj=[inner_join]).distinct()
+
+    def _list_names(self, s, column, prefix, delimiter):
+        """Return the sorted distinct names that follow prefix, up to the
+           delimiter, in the paths selected by s.
+
+           Instead of fetching every path, fetch the first one of each
+           name and skip over the rest, issuing one query per name.
+        """
+
+        s = s.where(column.like(self.escape_like(prefix) + '%',
+                                escape=ESCAPE_CHAR))
+        s = s.where(column > bindparam('start'))
+        s = s.order_by(column.asc()).limit(1)
+        pfz = len(prefix)
+        names = set()
+        start = prefix
+        while True:
+            r = self.conn.execute(s, start=start)
+            row = r.fetchone()
+            r.close()
+            if row is None:
+                break
+            path = row[0]
+            name, sep, rest = path[pfz:].partition(delimiter)
+            if name:
+                names.add(name)
+            # Paths sharing a name may be interleaved with other names
+            # (e.g. a/b, a/b-c, a/b/d), so only skip past the subtree.
+            start = strnextling(prefix + name + sep) if sep else path
+        return sorted(names)
+
+    def access_list_names(self, member, prefix='', delimiter='/'):
+        """Return the names under prefix of the paths granted to member,
+           e.g. the accounts or the containers shared with member."""
+
+        return self._list_names(self._access_paths_select(member),
+                                self.xfeatures.c.path, prefix, delimiter)
+
+    def access_list_shared_names(self, prefix, delimiter='/'):
+        """Return the names under prefix of the shared paths."""
+
+        return self._list_names(select([self.xfeatures.c.path]),
+                                self.xfeatures.c.path, prefix, delimiter)
+
+    def public_list_names(self, prefix, delimiter='/'):
+        """Return the names under prefix of the public paths."""
+
+        s = select([self.public.c.path])
+        s = s.where(self.public.c.active == True)
+        return self._list_names(s, self.public.c.path, prefix, delimiter)
+
     def access_list_shared(self, prefix=''):
         """Return the list of shared paths."""
 
@@ -108,11 +108,19 @@ class Public(DBWorker):
             return row[0]
         return None
 
-    def public_list(self, prefix):
+    def public_list(self, prefix, start=None, limit=None):
+        """Return the (path, url) tuples of the public paths starting with
+           prefix. If limit is set, return at most limit tuples, with paths
+           greater than start, ordered by path."""
+
         s = select([self.public.c.path, self.public.c.url])
         s = s.where(self.public.c.path.like(
             self.escape_like(prefix) + '%', escape=ESCAPE_CHAR))
         s = s.where(self.public.c.active == True)
+        if start:
+            s = s.where(self.public.c.path > start)
+        if limit:
+            s = s.order_by(self.public.c.path.asc()).limit(limit)
         r = self.conn.execute(s)
         rows = r.fetchall()
         r.close()
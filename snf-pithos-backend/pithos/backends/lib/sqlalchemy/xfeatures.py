@@ -129,6 +129,18 @@ class XFeatures(DBWorker):
         r = self.conn.execute(s)
         r.close()
 
+    def feature_list_bulk(self, features):
+        """Return the (value, feature, key) tuples of the features."""
+
+        s = select([self.xfeaturevals.c.value,
+                    self.xfeaturevals.c.feature_id,
+                    self.xfeaturevals.c.key])
+        s = s.where(self.xfeaturevals.c.feature_id.in_(features))
+        r = self.conn.execute(s)
+        rows = r.fetchall()
+        r.close()
+        return rows
+
     def feature_dict(self, feature):
         """Return a dict mapping keys to list of values for feature."""
 
@@ -497,6 +497,18 @@ class Node(DBWorker):
             population = 0  # Population isn't recursive
             i += 1
 
+    def statistics_flush(self):
+        """Write the accumulated statistics changes.
+           Statistics are updated immediately here, so there are none.
+        """
+
+        pass
+
+    def statistics_discard(self):
+        """Forget the accumulated statistics changes."""
+
+        pass
+
     def statistics_latest(self, node, before=inf, except_cluster=0):
         """Return population, total size and last mtime
            for all latest versions under node that
@@ -565,6 +577,41 @@ class Node(DBWorker):
         mtime = max(mtime, r[2])
         return (count, size, mtime)
 
+    def statistics_compute(self, node):
+        """Return a dict with the population, total size and last mtime
+           of all versions under node, per cluster, computed from the
+           versions table instead of the statistics table.
+        """
+
+        execute = self.execute
+        fetchall = self.fetchall
+
+        props = self.node_get_properties(node)
+        if props is None:
+            return None
+        parent, path = props
+
+        # First level, just under node (get population).
+        q = ("select cluster, count(serial) "
+             "from versions "
+             "where node in (select node "
+             "from nodes "
+             "where parent = ?) "
+             "group by cluster")
+        execute(q, (node,))
+        population = dict(fetchall())
+
+        # All children (get size and mtime).
+        q = ("select cluster, sum(size), max(mtime) "
+             "from versions "
+             "where node in (select node "
+             "from nodes "
+             "where path like ? escape '\\') "
+             "group by cluster")
+        execute(q, (self.escape_like(path) + '/%',))
+        return dict((cluster, (population.get(cluster, 0), long(size), mtime))
+                    for cluster, size, mtime in fetchall())
+
     def nodes_set_latest_version(self, node, serial):
         q = ("update nodes set latest_version = ? where node = ?")
         props = (serial, node)
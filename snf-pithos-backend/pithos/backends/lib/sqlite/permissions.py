@@ -16,7 +16,7 @@
 from xfeatures import XFeatures
 from groups import Groups
 from public import Public
-from node import Node
+from node import Node, strnextling
 from collections import defaultdict
 
 
@@ -92,6 +92,22 @@ class Permissions(XFeatures, Groups, Public, Node):
             del(permissions[WRITE])
         return permissions
 
+    def access_get_bulk(self, paths):
+        """Get permissions for multiple paths.
+           Return a dictionary mapping the paths with
+           permissions to their permissions.
+        """
+
+        features = self.xfeature_get_bulk(paths) if paths else None
+        if not features:
+            return {}
+        feature_paths = dict(features)
+        perms = defaultdict(list)
+        for row in self.feature_list_bulk(feature_paths.keys()):
+            perms[feature_paths[row[1]]].append(row)
+        return dict((path, dict(self.access_get_for_bulk(p)[0]))
+                    for path, p in perms.iteritems())
+
     def access_members(self, path):
         feature = self.xfeature_get(path)
         if not feature:
@@ -199,13 +215,7 @@ class Permissions(XFeatures, Groups, Public, Node):
 
         """
 
-        q = ("select distinct path from xfeatures inner join "
-             "  (select distinct feature_id, key from xfeaturevals inner join "
-             "     (select owner || ':' || name as value from groups "
-             "      where member = ? union select ? union select '*') "
-             "   using (value)) "
-             "using (feature_id)")
-        p = (member, member)
+        q, p = self._access_paths_query(member)
         if prefix:
             q += " where "
             paths = self.access_inherit(prefix) or [prefix]
@@ -227,6 +237,62 @@ class Permissions(XFeatures, Groups, Public, Node):
             l += [r[0] for r in self.fetchall() if r[0] not in l]
         return l
 
+    def _access_paths_query(self, member):
+        q = ("select distinct path from xfeatures inner join "
+             "  (select distinct feature_id, key from xfeaturevals inner join "
+             "     (select owner || ':' || name as value from groups "
+             "      where member = ? union select ? union select '*') "
+             "   using (value)) "
+             "using (feature_id)")
+        return q, (member, member)
+
+    def _list_names(self, q, p, prefix, delimiter):
+        """Return the sorted distinct names that follow prefix, up to the
+           delimiter, in the paths selected by query q with arguments p.
+
+           Instead of fetching every path, fetch the first one of each
+           name and skip over the rest, issuing one query per name.
+        """
+
+        q = ("select path from (%s) where path like ? escape '\\' "
+             "and path > ? order by path limit 1" % q)
+        like = self.escape_like(prefix) + '%'
+        pfz = len(prefix)
+        names = set()
+        start = prefix
+        while True:
+            self.execute(q, p + (like, start))
+            row = self.fetchone()
+            if row is None:
+                break
+            path = row[0]
+            name, sep, rest = path[pfz:].partition(delimiter)
+            if name:
+                names.add(name)
+            # Paths sharing a name may be interleaved with other names
+            # (e.g. a/b, a/b-c, a/b/d), so only skip past the subtree.
+            start = strnextling(prefix + name + sep) if sep else path
+        return sorted(names)
+
+    def access_list_names(self, member, prefix='', delimiter='/'):
+        """Return the names under prefix of the paths granted to member,
+           e.g. the accounts or the containers shared with member."""
+
+        q, p = self._access_paths_query(member)
+        return self._list_names(q, p, prefix, delimiter)
+
+    def access_list_shared_names(self, prefix, delimiter='/'):
+        """Return the names under prefix of the shared paths."""
+
+        return self._list_names("select path from xfeatures", (),
+                                prefix, delimiter)
+
+    def public_list_names(self, prefix, delimiter='/'):
+        """Return the names under prefix of the public paths."""
+
+        return self._list_names("select path from public where active = 1",
+                                (), prefix, delimiter)
+
     def access_list_shared(self, prefix=''):
         """Return the list of shared paths."""
 
@@ -79,10 +79,21 @@ class Public(DBWorker):
             return row[0]
         return None
 
-    def public_list(self, prefix):
+    def public_list(self, prefix, start=None, limit=None):
+        """Return the (path, url) tuples of the public paths starting with
+           prefix. If limit is set, return at most limit tuples, with paths
+           greater than start, ordered by path."""
+
         q = ("select path, url from public where "
              "path like ? escape '\\' and active = 1")
-        self.execute(q, (self.escape_like(prefix) + '%',))
+        args = [self.escape_like(prefix) + '%']
+        if start:
+            q += " and path > ?"
+            args.append(start)
+        if limit:
+            q += " order by path limit ?"
+            args.append(limit)
+        self.execute(q, args)
         return self.fetchall()
 
     def public_path(self, public):
@@ -102,6 +102,15 @@ class XFeatures(DBWorker):
         q = "delete from xfeatures where path in (%s)" % placeholders
         self.execute(q, paths)
 
+    def feature_list_bulk(self, features):
+        """Return the (value, feature, key) tuples of the features."""
+
+        features = list(features)
+        q = ("select value, feature_id, key from xfeaturevals "
+             "where feature_id in (%s)") % ','.join('?' for _ in features)
+        self.execute(q, features)
+        return self.fetchall()
+
     def feature_dict(self, feature):
         """Return a dict mapping keys to list of values for feature."""
 
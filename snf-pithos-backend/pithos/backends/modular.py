@@ -22,7 +22,8 @@ import binascii
 from collections import defaultdict
 from functools import wraps, partial
 from traceback import format_exc
-from time import time
+from time import time, sleep
+from threading import Thread, Condition, Lock
 
 from pithos.workers import glue
 from archipelago.common import Segment, Xseg_ctx
@@ -53,6 +54,95 @@ class DisabledAstakosClient(object):
         raise AssertionError(m)
 
 
+class CommissionResolver(object):
+    """Accept commissions in batches, from a background thread.
+
+    The serials must already be registered in QuotaholderSerial, so that
+    the ones that fail to be resolved are left for
+    reconcile-commissions-pithos.
+    """
+
+    def __init__(self, astakosclient, db_module, db_connection, interval,
+                 batch_size=100, retries=5):
+        self.astakosclient = astakosclient
+        self.wrapper = db_module.DBWrapper(db_connection)
+        self.commission_serials = db_module.QuotaholderSerial(
+            wrapper=self.wrapper)
+        self.interval = interval
+        self.batch_size = batch_size
+        self.retries = retries
+        self.pending = []
+        self.cond = Condition()
+        self.thread = Thread(target=self._run,
+                             name='pithos-commission-resolver')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def add(self, serials):
+        with self.cond:
+            self.pending.extend(serials)
+            if len(self.pending) >= self.batch_size:
+                self.cond.notify()
+
+    def _run(self):
+        while True:
+            with self.cond:
+                if len(self.pending) < self.batch_size:
+                    self.cond.wait(self.interval)
+                serials = self.pending[:self.batch_size]
+                del self.pending[:self.batch_size]
+            if serials:
+                self._resolve(serials)
+
+    def _resolve(self, serials):
+        for attempt in xrange(self.retries + 1):
+            if attempt:
+                sleep(self.interval * attempt)
+            try:
+                r = self.astakosclient.resolve_commissions(
+                    accept_serials=serials, reject_serials=[])
+                self.wrapper.execute()
+                try:
+                    self.commission_serials.delete_many(r['accepted'])
+                except:
+                    self.wrapper.rollback()
+                    raise
+                self.wrapper.commit()
+                return
+            except Exception:
+                logger.exception("Failed to resolve commissions %s",
+                                 serials)
+        logger.error("Giving up resolving commissions %s", serials)
+
+
+_commission_resolvers = {}
+_commission_resolvers_lock = Lock()
+
+
+def get_commission_resolver(astakosclient, db_module, db_connection,
+                            **params):
+    """Return the resolver of the process for the given database."""
+
+    with _commission_resolvers_lock:
+        resolver = _commission_resolvers.get(db_connection)
+        if resolver is None:
+            resolver = CommissionResolver(astakosclient, db_module,
+                                          db_connection, **params)
+            _commission_resolvers[db_connection] = resolver
+        return resolver
+
+
+# Callables notified as listener(account, path) of the object and sharing
+# changes committed by the backends of the process.
+_object_change_listeners = []
+
+
+def add_object_change_listener(listener):
+    """Register a listener for the object changes of the process."""
+
+    _object_change_listeners.append(listener)
+
+
 # Stripped-down version of the HashMap class found in tools.
 
 class HashMap(list):
@@ -106,6 +196,9 @@ QUEUE_INSTANCE_ID = '1'
 
 (CLUSTER_NORMAL, CLUSTER_HISTORY, CLUSTER_DELETED) = range(3)
 
+# Object versions update the statistics of their container and account.
+OBJECT_STATS_DEPTH = 2
+
 QUOTA_POLICY = 'quota'
 VERSIONING_POLICY = 'versioning'
 PROJECT = 'project'
@@ -118,6 +211,8 @@ DEFAULT_DISKSPACE_RESOURCE = 'pithos.diskspace'
 
 DEFAULT_MAP_CHECK_INTERVAL = 5  # set to 5 secs
 
+DEFAULT_XSEG_PIPELINE_DEPTH = 1  # no pipelining
+
 logger = logging.getLogger(__name__)
 
 
@@ -227,7 +322,10 @@ class ModularBackend(BaseBackend):
                  container_versioning_policy=None,
                  archipelago_conf_file=None,
                  xseg_pool_size=8,
-                 map_check_interval=None):
+                 map_check_interval=None,
+                 xseg_pipeline_depth=None,
+                 db_pool_params=None,
+                 commission_resolve_params=None):
         db_module = db_module or DEFAULT_DB_MODULE
         db_connection = db_connection or DEFAULT_DB_CONNECTION
         block_module = block_module or DEFAULT_BLOCK_MODULE
@@ -246,6 +344,8 @@ class ModularBackend(BaseBackend):
             or DEFAULT_ARCHIPELAGO_CONF_FILE
         map_check_interval = map_check_interval \
             or DEFAULT_MAP_CHECK_INTERVAL
+        xseg_pipeline_depth = xseg_pipeline_depth \
+            or DEFAULT_XSEG_PIPELINE_DEPTH
 
         self.default_account_policy = {}
         self.default_container_policy = {
@@ -271,14 +371,18 @@ class ModularBackend(BaseBackend):
             return sys.modules[m]
 
         self.db_module = load_module(db_module)
-        self.wrapper = self.db_module.DBWrapper(db_connection)
+        if db_pool_params:
+            self.wrapper = self.db_module.DBWrapper(
+                db_connection, pool_params=db_pool_params)
+        else:
+            self.wrapper = self.db_module.DBWrapper(db_connection)
         params = {'wrapper': self.wrapper}
         self.permissions = self.db_module.Permissions(**params)
         self.config = self.db_module.Config(**params)
         self.commission_serials = self.db_module.QuotaholderSerial(**params)
         for x in ['READ', 'WRITE']:
             setattr(self, x, getattr(self.db_module, x))
-        self.node = self.db_module.Node(**params)
+        self.node = self.db_module.Node(batch_statistics=True, **params)
         for x in ['ROOTNODE', 'SERIAL', 'NODE', 'HASH', 'SIZE', 'TYPE',
                   'MTIME', 'MUSER', 'UUID', 'CHECKSUM', 'CLUSTER',
                   'MATCH_PREFIX', 'MATCH_EXACT',
@@ -295,7 +399,8 @@ class ModularBackend(BaseBackend):
         params = {'path': block_path,
                   'block_size': self.block_size,
                   'hash_algorithm': self.hash_algorithm,
-                  'umask': block_umask}
+                  'umask': block_umask,
+                  'pipeline_depth': xseg_pipeline_depth}
         params.update(self.block_params)
         self.store = self.block_module.Store(**params)
 
@@ -329,6 +434,13 @@ class ModularBackend(BaseBackend):
                 use_pool=True,
                 pool_size=astakosclient_poolsize)
 
+        if commission_resolve_params:
+            self.commission_resolver = get_commission_resolver(
+                self.astakosclient, self.db_module, db_connection,
+                **commission_resolve_params)
+        else:
+            self.commission_resolver = None
+
         self.serials = []
         self.messages = []
 
@@ -343,12 +455,17 @@ class ModularBackend(BaseBackend):
     def pre_exec(self, lock_container_path=False):
         self.lock_container_path = lock_container_path
         self.wrapper.execute()
+        self.node.statistics_discard()
         self.serials = []
+        self.messages = []
         self._reset_allowed_paths()
         self.in_transaction = True
 
     def post_exec(self, success_status=True):
         if success_status:
+            # write the accumulated statistics
+            self.node.statistics_flush()
+
             # send messages produced
             for m in self.messages:
                 self.queue.send(*m)
@@ -358,6 +475,7 @@ class ModularBackend(BaseBackend):
                 self.commission_serials.insert_many(
                     self.serials)
 
+            if self.serials and self.commission_resolver is None:
                 # commit to ensure that the serials are registered
                 # even if resolve commission fails
                 self.wrapper.commit()
@@ -372,6 +490,13 @@ class ModularBackend(BaseBackend):
                     r['accepted'])
 
             self.wrapper.commit()
+
+            # the serials are accepted in the background,
+            # after they have been registered
+            if self.serials and self.commission_resolver is not None:
+                self.commission_resolver.add(self.serials)
+
+            self._notify_object_changes()
         else:
             if self.serials:
                 r = self.astakosclient.resolve_commissions(
@@ -379,6 +504,7 @@ class ModularBackend(BaseBackend):
                     reject_serials=self.serials)
                 self.commission_serials.delete_many(
                     r['rejected'])
+            self.node.statistics_discard()
             self.wrapper.rollback()
         self.in_transaction = False
 
@@ -386,6 +512,18 @@ class ModularBackend(BaseBackend):
         self.wrapper.close()
         self.queue.close()
 
+    def _notify_object_changes(self):
+        if not _object_change_listeners:
+            return
+        for key, account, instance, resource, path, details in self.messages:
+            if resource not in ('object', 'sharing'):
+                continue
+            for listener in _object_change_listeners:
+                try:
+                    listener(account, path)
+                except Exception:
+                    logger.exception("Object change listener failed")
+
     @property
     def using_external_quotaholder(self):
         return not isinstance(self.astakosclient, DisabledAstakosClient)
@@ -560,11 +698,11 @@ class ModularBackend(BaseBackend):
         if shared or public:
             allowed = set()
             if shared:
-                allowed.update([x.split('/', 2)[1] for x in
-                               self.permissions.access_list_shared(account)])
+                allowed.update(
+                    self.permissions.access_list_shared_names(account + '/'))
             if public:
-                allowed.update([x[0].split('/', 2)[1] for x in
-                               self.permissions.public_list(account)])
+                allowed.update(
+                    self.permissions.public_list_names(account + '/'))
             return sorted(allowed)
         node = self.node.node_lookup(account)
         return [x[0] for x in self._list_object_properties(
@@ -698,7 +836,7 @@ class ModularBackend(BaseBackend):
         path = '/'.join((account, container))
         node = self._put_path(
             user, self._lookup_account(account, True)[1], path,
-            update_statistics_ancestors_depth=-1)
+            update_statistics_ancestors_depth=1)
         self._put_policy(node, policy, True, is_account_policy=False,
                          default_project=account,
                          check=True if policy else False)
@@ -766,10 +904,10 @@ class ModularBackend(BaseBackend):
                 src_version_id, dest_version_id = self._put_version_duplicate(
                     user, node, size=0, type='', hash=None, checksum='',
                     cluster=CLUSTER_DELETED,
-                    update_statistics_ancestors_depth=1)
+                    update_statistics_ancestors_depth=OBJECT_STATS_DEPTH)
                 del_size = self._apply_versioning(
                     account, container, src_version_id,
-                    update_statistics_ancestors_depth=1)
+                    update_statistics_ancestors_depth=OBJECT_STATS_DEPTH)
                 self._report_size_change(
                     user, account, -del_size, project, {
                         'action': 'object delete',
@@ -804,13 +942,13 @@ class ModularBackend(BaseBackend):
 
             # get public
             objects |= set(self._list_public_object_properties(
-                user, account, container, prefix, all_props))
+                user, account, container, prefix, all_props, marker, limit))
             objects = list(objects)
 
             objects.sort(key=lambda x: x[0])
         elif public:
             objects = self._list_public_object_properties(
-                user, account, container, prefix, all_props)
+                user, account, container, prefix, all_props, marker, limit)
         else:
             allowed = self._list_object_permissions(
                 user, account, container, prefix, shared, public=False)
@@ -827,9 +965,10 @@ class ModularBackend(BaseBackend):
         return objects[start:start + limit]
 
     def _list_public_object_properties(self, user, account, container, prefix,
-                                       all_props):
+                                       all_props, marker=None, limit=None):
         public = self._list_object_permissions(
-            user, account, container, prefix, shared=False, public=True)
+            user, account, container, prefix, shared=False, public=True,
+            marker=marker, limit=limit)
         paths, nodes = self._lookup_objects(public)
         path = '/'.join((account, container))
         cont_prefix = path + '/'
@@ -857,7 +996,7 @@ class ModularBackend(BaseBackend):
         return objects
 
     def _list_object_permissions(self, user, account, container, prefix,
-                                 shared, public):
+                                 shared, public, marker=None, limit=None):
         allowed = []
         path = '/'.join((account, container, prefix)).rstrip('/')
         if user != account:
@@ -869,8 +1008,11 @@ class ModularBackend(BaseBackend):
             if shared:
                 allowed.update(self.permissions.access_list_shared(path))
             if public:
+                start = '/'.join((account, container, marker)) \
+                    if marker else None
                 allowed.update(
-                    [x[0] for x in self.permissions.public_list(path)])
+                    [x[0] for x in self.permissions.public_list(
+                        path, start, limit)])
             allowed = sorted(allowed)
             if not allowed:
                 return []
@@ -1005,9 +1147,14 @@ class ModularBackend(BaseBackend):
                                          lock_container=True)
         src_version_id, dest_version_id = self._put_metadata(
             user, node, domain, meta, replace,
-            update_statistics_ancestors_depth=1)
-        self._apply_versioning(account, container, src_version_id,
-                               update_statistics_ancestors_depth=1)
+            update_statistics_ancestors_depth=OBJECT_STATS_DEPTH)
+        self._apply_versioning(
+            account, container, src_version_id,
+            update_statistics_ancestors_depth=OBJECT_STATS_DEPTH)
+        self._report_object_change(
+            user, account, path,
+            details={'version': dest_version_id,
+                     'action': 'object meta update'})
         return dest_version_id
 
     @debug_method
@@ -1126,6 +1273,7 @@ class ModularBackend(BaseBackend):
             # Raising an exception results in db transaction rollback
             # However we have to force the update of the database
             self.wrapper.rollback()  # rollback existing transaction
+            self.node.statistics_discard()
             self.wrapper.execute()  # start new transaction
             self.node.version_put_property(props[self.SERIAL],
                                            'map_check_timestamp', time())
@@ -1142,7 +1290,8 @@ class ModularBackend(BaseBackend):
 
     @debug_method
     @backend_method
-    def get_object_hashmap(self, user, account, container, name, version=None):
+    def get_object_hashmap(self, user, account, container, name, version=None,
+                           blkoff=0, nr=None):
         """Return the object's size and a list with partial hashes."""
 
         self._can_read_object(user, account, container, name)
@@ -1152,10 +1301,15 @@ class ModularBackend(BaseBackend):
             return 0, ()
         if props[self.HASH].startswith('archip:'):
             hashmap = self._update_available(props)
+            if nr is not None:
+                hashmap = hashmap[blkoff:blkoff + nr]
             return props[self.SIZE], [x for x in hashmap]
         else:
-            hashmap = self.store.map_get(self._unhexlify_hash(
-                props[self.HASH]))
+            maphash = self._unhexlify_hash(props[self.HASH])
+            if nr is None:
+                hashmap = self.store.map_get(maphash)
+            else:
+                hashmap = self.store.map_get(maphash, blkoff, nr)
             return props[self.SIZE], [binascii.hexlify(x) for x in hashmap]
 
     def _update_object_hash(self, user, account, container, name, size, type,
@@ -1180,7 +1334,7 @@ class ModularBackend(BaseBackend):
         pre_version_id, dest_version_id = self._put_version_duplicate(
             user, node, src_node=src_node, size=size, type=type, hash=hash,
             checksum=checksum, is_copy=is_copy,
-            update_statistics_ancestors_depth=1,
+            update_statistics_ancestors_depth=OBJECT_STATS_DEPTH,
             available=available, keep_available=False)
 
         # Handle meta.
@@ -1189,16 +1343,16 @@ class ModularBackend(BaseBackend):
         self._put_metadata_duplicate(
             src_version_id, dest_version_id, domain, node, meta, replace_meta)
 
-        del_size = self._apply_versioning(account, container, pre_version_id,
-                                          update_statistics_ancestors_depth=1)
+        del_size = self._apply_versioning(
+            account, container, pre_version_id,
+            update_statistics_ancestors_depth=OBJECT_STATS_DEPTH)
         size_delta = size - del_size
         if size_delta > 0:
             # Check account quota.
             if not self.using_external_quotaholder:
                 account_quota = long(self._get_policy(
                     account_node, is_account_policy=True)[QUOTA_POLICY])
-                account_usage = self._get_statistics(account_node,
-                                                     compute=True)[1]
+                account_usage = self._get_statistics(account_node)[1]
                 if (account_quota > 0 and account_usage > account_quota):
                     raise QuotaError(
                         'Account quota exceeded: limit: %s, usage: %s' % (
@@ -1479,21 +1633,24 @@ class ModularBackend(BaseBackend):
             hashes = []
             size = 0
             serials = []
-            h, s, v = self.node.node_purge(node, until, CLUSTER_NORMAL,
-                                           update_statistics_ancestors_depth=1)
+            h, s, v = self.node.node_purge(
+                node, until, CLUSTER_NORMAL,
+                update_statistics_ancestors_depth=OBJECT_STATS_DEPTH)
             hashes += h
             size += s
             serials += v
-            h, s, v = self.node.node_purge(node, until, CLUSTER_HISTORY,
-                                           update_statistics_ancestors_depth=1)
+            h, s, v = self.node.node_purge(
+                node, until, CLUSTER_HISTORY,
+                update_statistics_ancestors_depth=OBJECT_STATS_DEPTH)
             hashes += h
             if not self.free_versioning:
                 size += s
             serials += v
             for h in hashes:
                 self.store.map_delete(h)
-            self.node.node_purge(node, until, CLUSTER_DELETED,
-                                 update_statistics_ancestors_depth=1)
+            self.node.node_purge(
+                node, until, CLUSTER_DELETED,
+                update_statistics_ancestors_depth=OBJECT_STATS_DEPTH)
             try:
                 self._get_version(node)
             except NameError:
@@ -1512,9 +1669,11 @@ class ModularBackend(BaseBackend):
 
         src_version_id, dest_version_id = self._put_version_duplicate(
             user, node, size=0, type='', hash=None, checksum='',
-            cluster=CLUSTER_DELETED, update_statistics_ancestors_depth=1)
-        del_size = self._apply_versioning(account, container, src_version_id,
-                                          update_statistics_ancestors_depth=1)
+            cluster=CLUSTER_DELETED,
+            update_statistics_ancestors_depth=OBJECT_STATS_DEPTH)
+        del_size = self._apply_versioning(
+            account, container, src_version_id,
+            update_statistics_ancestors_depth=OBJECT_STATS_DEPTH)
         if report_size_change:
             self._report_size_change(
                 user, account, -del_size, project,
@@ -1541,10 +1700,10 @@ class ModularBackend(BaseBackend):
                 src_version_id, dest_version_id = self._put_version_duplicate(
                     user, node, size=0, type='', hash=None, checksum='',
                     cluster=CLUSTER_DELETED,
-                    update_statistics_ancestors_depth=1)
+                    update_statistics_ancestors_depth=OBJECT_STATS_DEPTH)
                 del_size = self._apply_versioning(
                     account, container, src_version_id,
-                    update_statistics_ancestors_depth=1)
+                    update_statistics_ancestors_depth=OBJECT_STATS_DEPTH)
                 if report_size_change:
                     self._report_size_change(
                         user, account, -del_size, project,
@@ -1817,12 +1976,20 @@ class ModularBackend(BaseBackend):
         return src_version_id, dest_version_id
 
     def _list_limits(self, listing, marker, limit):
+        # Listings are sorted by name, either plain or as the first item of
+        # a tuple. Skip the entries up to the marker with a binary search.
         start = 0
         if marker:
-            try:
-                start = listing.index(marker) + 1
-            except ValueError:
-                pass
+            end = len(listing)
+            while start < end:
+                mid = (start + end) // 2
+                name = listing[mid]
+                if isinstance(name, tuple):
+                    name = name[0]
+                if name <= marker:
+                    start = mid + 1
+                else:
+                    end = mid
         if not limit or limit > 10000:
             limit = 10000
         return start, limit
@@ -1860,7 +2027,7 @@ class ModularBackend(BaseBackend):
             return
 
         account_node = self._lookup_account(account, True)[1]
-        total = self._get_statistics(account_node, compute=True)[1]
+        total = self._get_statistics(account_node)[1]
         details.update({'user': user, 'total': total})
         self.messages.append(
             (QUEUE_MESSAGE_KEY_PREFIX % ('resource.diskspace',),
@@ -2112,20 +2279,14 @@ class ModularBackend(BaseBackend):
             raise NotAllowedError
 
     def _allowed_accounts(self, user):
-        allow = set()
-        for path in self.permissions.access_list_paths(user):
-            p = path.split('/', 1)[0]
-            allow.add(p)
-        self.read_allowed_paths[user] |= allow
-        return sorted(allow)
+        allow = self.permissions.access_list_names(user)
+        self.read_allowed_paths[user].update(allow)
+        return allow
 
     def _allowed_containers(self, user, account):
-        allow = set()
-        for path in self.permissions.access_list_paths(user, account):
-            p = path.split('/', 2)[1]
-            allow.add(p)
-        self.read_allowed_paths[user] |= allow
-        return sorted(allow)
+        allow = self.permissions.access_list_names(user, account + '/')
+        self.read_allowed_paths[user].update(allow)
+        return allow
 
     # Domain functions
 
@@ -2138,9 +2299,11 @@ class ModularBackend(BaseBackend):
             return []
         obj_list = self.node.domain_object_list(
             domain, allowed_paths, CLUSTER_NORMAL)
+        permissions = self.permissions.access_get_bulk(
+            [path for path, props, user_defined_meta in obj_list])
         return [(path,
                  self._build_metadata(props, user_defined_meta),
-                 self.permissions.access_get(path)) for
+                 permissions.get(path, {})) for
                 path, props, user_defined_meta in obj_list]
 
     # util functions
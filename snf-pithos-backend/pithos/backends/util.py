@@ -38,7 +38,10 @@ class PithosBackendPool(ObjectPool):
                  container_versioning_policy=None,
                  archipelago_conf_file=None,
                  xseg_pool_size=8,
-                 map_check_interval=None):
+                 map_check_interval=None,
+                 xseg_pipeline_depth=None,
+                 db_pool_params=None,
+                 commission_resolve_params=None):
         super(PithosBackendPool, self).__init__(size=size)
         self.db_module = db_module
         self.db_connection = db_connection
@@ -63,6 +66,9 @@ class PithosBackendPool(ObjectPool):
         self.archipelago_conf_file = archipelago_conf_file
         self.xseg_pool_size = xseg_pool_size
         self.map_check_interval = map_check_interval
+        self.xseg_pipeline_depth = xseg_pipeline_depth
+        self.db_pool_params = db_pool_params
+        self.commission_resolve_params = commission_resolve_params
 
     def _pool_create(self):
         backend = connect_backend(
@@ -88,7 +94,10 @@ class PithosBackendPool(ObjectPool):
             container_versioning_policy=self.container_versioning_policy,
             archipelago_conf_file=self.archipelago_conf_file,
             xseg_pool_size=self.xseg_pool_size,
-            map_check_interval=self.map_check_interval)
+            map_check_interval=self.map_check_interval,
+            xseg_pipeline_depth=self.xseg_pipeline_depth,
+            db_pool_params=self.db_pool_params,
+            commission_resolve_params=self.commission_resolve_params)
 
         backend._real_close = backend.close
         backend.close = instancemethod(_pooled_backend_close, backend,
@@ -100,6 +109,9 @@ class PithosBackendPool(ObjectPool):
 
     def _pool_verify(self, backend):
         wrapper = backend.wrapper
+        if getattr(wrapper, 'pooled', False) and wrapper.trans is None:
+            # Idle connections are checked by the database pool itself.
+            return True
         conn = wrapper.conn
         if conn.closed:
             return False